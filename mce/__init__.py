@@ -44,6 +44,8 @@ DEEPSTREAM_BINDINGS_ROOT = os.path.join(
 THIS_DIR = os.path.abspath(os.path.dirname(__file__))
 PIE_CONF = os.path.join(THIS_DIR, 'pie.conf')
 MODEL_BASENAME_TEMPLATE = "resnet10.caffemodel_b{batch_size}_{precision}.engine"
+# the nvtracker low level library used by --tracker (by default)
+TRACKER_LIB = os.path.join(DEEPSTREAM_ROOT, 'lib', 'libnvds_mot_klt.so')
 
 
 def is_jetson():
@@ -23,17 +23,23 @@ the command line.
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import collections
 import os
 import shutil
 import logging
 
 from typing import (
     Iterable,
+    Mapping,
+    Optional,
+    Tuple,
 )
 
 import gi
 gi.require_version('Gst', '1.0')
+gi.require_version('GLib', '2.0')
 from gi.repository import (
+    GLib,
     GObject,
     Gst,
 )
@@ -43,12 +49,83 @@ import mce
 logger = logging.getLogger(__name__)
 
 __all__ = [
+    'AnalyticsOptions',
+    'OutputOptions',
+    'OverloadOptions',
+    'PatrolOptions',
     'cli_main',
     'ensure_config_path',
     'ensure_config',
     'main',
+    'parse_max_fps',
+    'parse_output',
+    'parse_roi',
+    'parse_rule',
 ]
 
+OutputOptions = collections.namedtuple('OutputOptions', (
+    'rtsp', 'rtsp_sources', 'bitrate', 'gop', 'outputs', 'headless'))
+OutputOptions.__new__.__defaults__ = (False, False, 4000000, 30, (), False)
+OutputOptions.__doc__ = """
+Where main's video goes.
+
+:arg rtsp: serve the tiled output over RTSP instead of displaying it (or as
+     well as any |outputs|)
+:arg rtsp_sources: also serve every source, as is, over RTSP
+:arg bitrate: RTSP encoder bitrate in bits per second
+:arg gop: RTSP encoder keyframe interval in frames
+:arg outputs: output branches (see parse_output). If none are supplied,
+     there is a single display (or rtsp) output.
+:arg headless: end the pipeline after inference, with no display
+"""
+
+AnalyticsOptions = collections.namedtuple('AnalyticsOptions', (
+    'tracker', 'zones', 'track_events', 'secondaries', 'classify_ttl',
+    'rollup'))
+AnalyticsOptions.__new__.__defaults__ = (None, None, None, (), 10.0, 0.0)
+AnalyticsOptions.__doc__ = """
+What main does with the detections.
+
+:arg tracker: an nvtracker low level library to track objects with (eg.
+     mce.TRACKER_LIB)
+:arg zones: a JSON file of zones and lines to count (see mce.zones)
+:arg track_events: a file to append track events to, as JSON lines (see
+     mce.tracks)
+:arg secondaries: nvinfer config files of secondary classifiers to run on
+     the pie's objects
+:arg classify_ttl: if non-zero, cache each tracked object's secondary labels
+     for this many seconds (see mce.classify)
+:arg rollup: if non-zero, keep object count time-series (see mce.rollup) and
+     log each source's counts over this many seconds, every this many
+     seconds
+"""
+
+PatrolOptions = collections.namedtuple('PatrolOptions', (
+    'slots', 'dwell', 'revisit', 'policy'))
+PatrolOptions.__new__.__defaults__ = (0, 10.0, 60.0, 'round-robin')
+PatrolOptions.__doc__ = """
+How main rotates the sources (see mce.patrol).
+
+:arg slots: if non-zero, rotate the sources through this many slots
+:arg dwell: seconds to watch each source per visit
+:arg revisit: minimum seconds between visits to a source
+:arg policy: 'round-robin' or 'weighted'
+"""
+
+OverloadOptions = collections.namedtuple('OverloadOptions', (
+    'target_latency', 'shed_order', 'low_priority'))
+OverloadOptions.__new__.__defaults__ = (
+    0.0, ('display', 'interval', 'sources'), ())
+OverloadOptions.__doc__ = """
+How main sheds load (see mce.overload).
+
+:arg target_latency: if non-zero, shed load to keep latency under this many
+     seconds
+:arg shed_order: the order to shed load in
+:arg low_priority: indexes of sources whose frames may be dropped when
+     overloaded
+"""
+
 
 def ensure_config_path() -> str:
     """
@@ -102,12 +179,136 @@ def ensure_config() -> str:
     return filename
 
 
-def main(sources: Iterable[str], pie_config: str, live:bool):
+def parse_rule(rule: str):
+    """
+    Parse a recording trigger rule from the command line.
+
+    :arg rule: "CLASS" or "CLASS:MIN_COUNT" where CLASS is a class name from
+         mce.osd (eg. "person") or a class id.
+
+    :returns: an mce.record.TriggerRule
+    """
+    import mce.record
+    class_, _, min_count = rule.partition(':')
+    try:
+        class_id = int(class_)
+    except ValueError:
+        class_id = getattr(mce.osd, class_.upper(), None)
+        if not isinstance(class_id, int):
+            raise ValueError(f'unknown class in rule: {rule}')
+    return mce.record.TriggerRule(class_id, int(min_count or 1))
+
+
+def parse_output(output: str):
+    """
+    Parse an output branch from the command line.
+
+    :arg output: "KIND" or "KIND:OPTION=VALUE,..." where KIND is one of
+         display, rtsp, file or meta and options are fps, leaky (0 or 1),
+         queue_size and location (eg. "file:location=out.mkv,fps=5")
+
+    :returns: an mce.pipeline.OutputBranch
+    """
+    import mce.pipeline
+    kind, _, options = output.partition(':')
+    kwargs = {}
+    for option in filter(None, options.split(',')):
+        key, _, value = option.partition('=')
+        if key == 'fps':
+            kwargs[key] = float(value)
+        elif key in ('leaky', 'queue_size'):
+            kwargs[key] = int(value)
+        elif key == 'location':
+            kwargs[key] = value
+        else:
+            raise ValueError(f'unknown option "{key}" in output: {output}')
+    return mce.pipeline.OutputBranch(kind, **kwargs)
+
+
+def parse_roi(roi: str):
+    """
+    Parse a source's region of interest from the command line.
+
+    :arg roi: "SOURCE:LEFT,TOP,WIDTH,HEIGHT" where SOURCE is the index of the
+         source on the command line (eg. "0:0,540,960,540" for the bottom left
+         quarter of the first 1080p source)
+
+    :returns: the source index and an mce.geometry.Roi
+    """
+    import mce.geometry
+    index, _, region = roi.partition(':')
+    return int(index), mce.geometry.parse_roi(region)
+
+
+def parse_max_fps(max_fps: str) -> Tuple[Optional[int], float]:
+    """
+    Parse a source's maximum frame rate from the command line.
+
+    :arg max_fps: "FPS" for every source or "SOURCE:FPS" where SOURCE is the
+         index of the source on the command line (eg. "2:7.5")
+
+    :returns: the source index (or None for every source) and the frame rate
+    """
+    index, _, fps = max_fps.rpartition(':')
+    return (int(index) if index else None), float(fps)
+
+
+def log_rollup(rollup, slots: Mapping[int, str], window: float) -> bool:
+    """
+    Log every source's object counts over the last |window| seconds.
+
+    :arg rollup: an mce.rollup.Rollup
+    :arg slots: muxer pad index -> source name (see DeepStreamApp.slots)
+
+    :returns: True (so it repeats as a GLib timeout)
+    """
+    import mce.osd
+    names = {getattr(mce.osd, n): n.lower()
+             for n in ('VEHICLE', 'BICYCLE', 'PERSON', 'ROADSIGN')}
+    for source, by_class in rollup.summary(window).items():
+        counts = ', '.join(
+            f"{names.get(c, c)} {s.mean:.1f} "
+            f"(max {s.max:.0f}, {s.occupancy:.0%} of frames)"
+            for c, s in by_class.items() if s.max)
+        logger.info(f"{slots.get(source, f'slot {source}')} last "
+                    f"{window:g}s: {counts or 'nothing'}")
+    return True
+
+
+def main(sources: Iterable[str], pie_config: str, live: bool,
+         record: str = None, record_rules: Iterable[str] = ('person',),
+         archive: str = None, queues: Iterable[str] = (),
+         oversample: float = 1.0, rois: Iterable[str] = (),
+         probe: bool = False, probe_timeout: float = 5.0,
+         max_fps: Iterable[str] = (), probe_budget: float = 0.0,
+         frame_trace: int = 0,
+         output: OutputOptions = OutputOptions(),
+         analytics: AnalyticsOptions = AnalyticsOptions(),
+         patrol: PatrolOptions = PatrolOptions(),
+         overload: OverloadOptions = OverloadOptions()):
     """
     Main function for mce. Does not parse the command line.
 
     :arg sources: video streams/files to analyse
     :arg pie_config: primary inference engine config file for nvinfer element
+    :param record: a directory to record detection events to (or None)
+    :param record_rules: rules triggering a recording (see parse_rule)
+    :param archive: a directory to archive the original streams to (or None)
+    :param queues: stages to add a queue (thread boundary) after
+           (see mce.pipeline.STAGES)
+    :param oversample: batch at this times the network input resolution
+    :param rois: source regions of interest to crop to (see parse_roi)
+    :param probe: probe the sources first and plan the pipeline from them
+    :param probe_timeout: seconds to wait for each source when probing
+    :param max_fps: source frame rate limits (see parse_max_fps)
+    :param probe_budget: if non-zero, milliseconds each probe callback may
+           take per batch before it's called less often (see mce.probes)
+    :param frame_trace: if non-zero, trace every frame of 1 in this many
+           batches, dumped on SIGUSR2 (see mce.trace)
+    :param output: an OutputOptions
+    :param analytics: an AnalyticsOptions
+    :param patrol: a PatrolOptions
+    :param overload: an OverloadOptions
     """
     logger.debug(f'main({sources}, {pie_config})')
     GObject.threads_init()
@@ -119,10 +320,125 @@ def main(sources: Iterable[str], pie_config: str, live:bool):
     # f**king bug took me ages to find.
     import mce.pipeline
 
+    recorder = None
+    if record:
+        import mce.record
+        os.makedirs(record, exist_ok=True)
+        recorder = mce.record.EventRecorder(
+            record, rules=[parse_rule(r) for r in record_rules])
+
+    if archive:
+        os.makedirs(archive, exist_ok=True)
+
+    kwargs = {}
+    if output.rtsp:
+        kwargs.update(sink=mce.pipeline.RTSP_SINK)
+    if output.rtsp or output.outputs:
+        kwargs.update(bitrate=output.bitrate, gop=output.gop,
+                      outputs=[parse_output(o) for o in output.outputs])
+    if output.headless:
+        kwargs.update(headless=True)
+    if queues:
+        kwargs.update(queues=mce.pipeline.make_queues(queues))
+    kwargs.update(oversample=oversample)
+    if probe_budget:
+        kwargs.update(probe_budget=probe_budget / 1000)
+    if analytics.tracker:
+        kwargs.update(tracker=analytics.tracker)
+
+    classifier_cache = None
+    if analytics.secondaries:
+        kwargs.update(secondaries=list(analytics.secondaries))
+        if analytics.classify_ttl:
+            import mce.classify
+            classifier_cache = mce.classify.ClassifierCache(
+                ttl=analytics.classify_ttl)
+            kwargs.update(classifier_cache=classifier_cache)
+
+    zones = None
+    if analytics.zones:
+        import mce.zones
+        zones = mce.zones.ZoneAnalytics(
+            *mce.zones.load(analytics.zones),
+            on_event=lambda e: logger.info(
+                f"{e.source}: object {e.object_id} {e.kind} {e.name}"))
+        kwargs.update(zones=zones)
+
+    tracks = None
+    if analytics.track_events:
+        import json
+        import mce.tracks
+        events_file = open(analytics.track_events, 'a')
+        tracks = mce.tracks.TrackEvents(on_event=lambda e: events_file.write(
+            json.dumps(e._asdict()) + '\n'))
+        kwargs.update(tracks=tracks)
+
+    sources = [mce.pipeline.Source(s) for s in sources]
+    for index, roi in (parse_roi(r) for r in rois):
+        sources[index] = sources[index]._replace(roi=roi)
+    for index, fps in (parse_max_fps(f) for f in max_fps):
+        for i in range(len(sources)) if index is None else (index,):
+            sources[i] = sources[i]._replace(max_fps=fps)
+
+    time_series = None
+    rollup_timer = None
+    if analytics.rollup:
+        import mce.rollup
+        # a muxer slot per source (and per patrol slot)
+        time_series = mce.rollup.Rollup(
+            max(len(sources) + patrol.slots, 1))
+        kwargs.update(rollup=time_series)
+
+    if overload.target_latency:
+        import mce.overload
+        kwargs.update(overload=mce.overload.OverloadController(
+            target_latency=overload.target_latency,
+            order=overload.shed_order,
+            low_priority=[f'source_{i}' for i in overload.low_priority]))
+
+    patroller = None
+    if patrol.slots:
+        import mce.patrol
+        patroller = mce.patrol.Patrol(
+            [mce.patrol.Camera(s.uri, patrol.dwell, patrol.revisit,
+                               roi=s.roi)
+             for s in sources],
+            slots=patrol.slots, policy=patrol.policy)
+        sources = []
+
     # do the gstreamer dance, elegantly.
-    with mce.pipeline.DeepStreamApp(pie_config, sources=sources, live=live) as pipeline:
+    with mce.pipeline.DeepStreamApp(pie_config, sources=sources, live=live,
+                                    recorder=recorder,
+                                    archive=archive,
+                                    rtsp_sources=output.rtsp_sources,
+                                    probe=probe,
+                                    probe_timeout=probe_timeout,
+                                    patrol=patroller,
+                                    **kwargs) as pipeline:
+        if frame_trace:
+            import mce.trace
+            tracer = mce.trace.Tracer(every=frame_trace)
+            pipeline.add_probe(tracer.on_buffer, name='tracer')
+            tracer.install_signal()
+        if time_series is not None:
+            rollup_timer = GLib.timeout_add(
+                int(analytics.rollup * 1000), log_rollup, time_series,
+                pipeline.slots, analytics.rollup)
+        # costs nothing until SIGUSR1 (see mce.profile)
+        import mce.profile
+        mce.profile.install()
         pipeline.ready()
         pipeline.play()
+    if zones is not None:
+        logger.info(f"zones: {zones.stats()}")
+    if tracks is not None:
+        events_file.close()
+        logger.info(f"track events: {tracks.stats()}")
+    if classifier_cache is not None:
+        logger.info(f"classifier cache: {classifier_cache.stats()}")
+    if time_series is not None:
+        GLib.source_remove(rollup_timer)
+        log_rollup(time_series, pipeline.slots, analytics.rollup)
 
 
 def cli_main(args: Iterable[str] = None):
@@ -132,8 +448,14 @@ def cli_main(args: Iterable[str] = None):
     :arg args: an iterable of string to pass to ap.parse_args() for testing
     """
     import argparse
+    import sys
+    args = list(sys.argv[1:] if args is None else args)
+    if args[:1] == ['batch']:
+        from mce import batch
+        return batch.cli_main(args[1:])
     ap = argparse.ArgumentParser(
-        description="Mechanical Compound Eye",
+        description="Mechanical Compound Eye. "
+                    "Run 'mce batch --help' for offline (batch) mode.",
         formatter_class=argparse.ArgumentDefaultsHelpFormatter,
     )
 
@@ -144,17 +466,180 @@ def cli_main(args: Iterable[str] = None):
                     action='store_true')
     ap.add_argument('--config', help='primary inference config',
                     default=ensure_config())
+    ap.add_argument('--record', metavar='DIR',
+                    help='record detection events (with pre-roll) to DIR')
+    ap.add_argument('--record-rule', metavar='CLASS[:MIN]', action='append',
+                    help='class (and minimum count per frame) triggering a '
+                         'recording. May be repeated. (default: person)')
+    ap.add_argument('--archive', metavar='DIR',
+                    help='archive the original (encoded) streams to DIR')
+    ap.add_argument('--rtsp', action='store_true',
+                    help='serve the tiled output at rtsp://HOST:8554/mce '
+                         'instead of displaying it (or as well as any '
+                         '--output)')
+    ap.add_argument('--rtsp-sources', action='store_true',
+                    help='also serve every source, as is, at '
+                         'rtsp://HOST:8554/source_N')
+    ap.add_argument('--output', metavar='KIND[:OPTION=VALUE,...]',
+                    action='append',
+                    help='add an output branch, each in it\'s own thread '
+                         '(KIND is display, rtsp, file or meta; options are '
+                         'fps, leaky, queue_size and location). May be '
+                         'repeated, once per KIND. '
+                         'eg. --output display:fps=10 --output rtsp')
+    ap.add_argument('--headless', action='store_true',
+                    help='analytics only: no tiler, osd or display')
+    ap.add_argument('--queues', metavar='STAGE[,STAGE...]',
+                    help='add a queue (thread boundary) after each stage. '
+                         'Stages are stream-muxer, pie, tracker (with '
+                         '--tracker), converter, tiler and osd. "python3 -m '
+                         'mce.benchmark queues" can find the best layout for '
+                         'your sources.')
+    ap.add_argument('--oversample', type=float, default=1.0,
+                    help='batch (nvstreammux) at this times the network '
+                         'input resolution. Raise for a sharper display.')
+    ap.add_argument('--roi', metavar='SOURCE:LEFT,TOP,WIDTH,HEIGHT',
+                    action='append',
+                    help='crop source number SOURCE (from 0) to a region '
+                         'before inference. Detections are still reported in '
+                         'full frame coordinates. May be repeated.')
+    ap.add_argument('--probe', action='store_true',
+                    help='probe every source (concurrently) first, and plan '
+                         'the muxer resolution, tiler layout and batch '
+                         'timeout from their sizes and frame rates')
+    ap.add_argument('--probe-timeout', metavar='SECONDS', type=float,
+                    default=5.0, help='seconds to wait for each source when '
+                                      'probing')
+    ap.add_argument('--patrol', metavar='SLOTS', type=int, default=0,
+                    help='rotate the sources (cameras) through SLOTS batch '
+                         'slots, for more cameras than can be run at once')
+    ap.add_argument('--dwell', metavar='SECONDS', type=float, default=10.0,
+                    help='seconds to watch each camera per visit (--patrol)')
+    ap.add_argument('--revisit', metavar='SECONDS', type=float, default=60.0,
+                    help='minimum seconds between visits to a camera '
+                         '(--patrol)')
+    ap.add_argument('--patrol-policy', choices=('round-robin', 'weighted'),
+                    default='round-robin',
+                    help='how the next camera is chosen (--patrol)')
+    ap.add_argument('--max-fps', metavar='[SOURCE:]FPS', action='append',
+                    help='run source number SOURCE (from 0), or every source, '
+                         'at no more than FPS. Frames are dropped by the '
+                         'decoder where possible (with --probe). May be '
+                         'repeated.')
+    ap.add_argument('--overload', metavar='SECONDS', type=float, default=0.0,
+                    help='when latency exceeds SECONDS (or queues fill), '
+                         'shed load until it doesn\'t, then restore it')
+    ap.add_argument('--shed-order', metavar='ACTION[,ACTION...]',
+                    default='display,interval,sources',
+                    help='the order to shed load in (--overload). display '
+                         'needs --output display:fps=N.')
+    ap.add_argument('--low-priority', metavar='SOURCE[,SOURCE...]',
+                    help='sources (numbered from 0) whose frames may be '
+                         'dropped when overloaded')
+    ap.add_argument('--probe-budget', metavar='MS', type=float, default=0.0,
+                    help='milliseconds each metadata probe may take per '
+                         'batch. Slower probes are called less often, then '
+                         'disabled.')
+    ap.add_argument('--frame-trace', metavar='N', type=int, default=0,
+                    help='trace every frame of 1 in N batches into a ring '
+                         'buffer, written to ~/.mce/traces/ on SIGUSR2')
+    ap.add_argument('--tracker', metavar='LIB', nargs='?',
+                    const=mce.TRACKER_LIB,
+                    help='track objects (after inference) with an nvtracker '
+                         'low level library (default: the KLT tracker)')
+    ap.add_argument('--zones', metavar='FILE',
+                    help='count objects in zones, and crossing lines, '
+                         'defined per source in a JSON file (see mce.zones). '
+                         'Crossings need --tracker.')
+    ap.add_argument('--track-events', metavar='FILE',
+                    help='append a JSON line to FILE when a tracked object '
+                         'appears, moves significantly or leaves, instead of '
+                         'every detection. Needs --tracker.')
+    ap.add_argument('--secondary', metavar='CONFIG', action='append',
+                    help='run a secondary classifier (an nvinfer config) on '
+                         'the primary detector\'s objects. May be repeated.')
+    ap.add_argument('--classify-ttl', metavar='SECONDS', type=float,
+                    default=10.0,
+                    help='with --secondary and --tracker, classify each '
+                         'object once and reuse it\'s labels for SECONDS '
+                         '(or until it\'s box grows). 0 classifies every '
+                         'frame.')
+    ap.add_argument('--rollup', metavar='SECONDS', type=float, default=0.0,
+                    help='keep per source object count time-series (by '
+                         'second, minute and hour, in fixed memory) and log '
+                         'each source\'s counts over the last SECONDS, every '
+                         'SECONDS')
+    ap.add_argument('--bitrate', type=int, default=4000000,
+                    help='RTSP encoder bitrate (bits per second)')
+    ap.add_argument('--gop', type=int, default=30,
+                    help='RTSP encoder keyframe interval (frames)')
+    ap.add_argument('--trace', action='store_true',
+                    help='run with GStreamer\'s latency and stats tracers and '
+                         'write a per element latency and buffer rate '
+                         'summary (as JSON) next to the pipeline graphs. '
+                         'GStreamer\'s debug log goes to a file.')
+    ap.add_argument('--graphs', metavar='EVENT[,EVENT...]',
+                    help='write pipeline graphs to ~/.mce on these events: '
+                         'init (each bin built), state (state changes), app '
+                         '(start and exit) or all')
+    ap.add_argument('--max-graphs', metavar='N', type=int, default=100,
+                    help='the most graph files to write (with --graphs)')
     ap.add_argument('-v', '--verbose', help='print DEBUG log level',
                     action='store_true', default=mce.DEBUG)
 
-    os.environ['GST_DEBUG_DUMP_DOT_DIR'] = ensure_config_path()
-
     args = ap.parse_args(args=args)
+    if args.headless and args.rtsp:
+        ap.error('--rtsp needs video to serve, so it can\'t be --headless')
 
     logging.basicConfig(
         level=logging.DEBUG if args.verbose else logging.INFO)
 
-    main(args.sources, args.config, args.live)
+    if args.graphs:
+        from mce import graphs
+        events = args.graphs.split(',')
+        graphs.configure(
+            ensure_config_path(),
+            events=graphs.EVENTS if 'all' in events else events,
+            max_files=args.max_graphs)
+
+    trace_log = None
+    if args.trace:
+        # the tracers are read from the environment by Gst.init (in main)
+        from mce import gsttrace
+        trace_log = gsttrace.enable(ensure_config_path())
+
+    try:
+        main(args.sources, args.config, args.live,
+             record=args.record,
+             record_rules=args.record_rule or ('person',),
+             archive=args.archive,
+             queues=args.queues.split(',') if args.queues else (),
+             oversample=args.oversample, rois=args.roi or (),
+             probe=args.probe, probe_timeout=args.probe_timeout,
+             max_fps=args.max_fps or (), probe_budget=args.probe_budget,
+             frame_trace=args.frame_trace,
+             output=OutputOptions(
+                 rtsp=args.rtsp, rtsp_sources=args.rtsp_sources,
+                 bitrate=args.bitrate, gop=args.gop,
+                 outputs=args.output or (), headless=args.headless),
+             analytics=AnalyticsOptions(
+                 tracker=args.tracker, zones=args.zones,
+                 track_events=args.track_events,
+                 secondaries=args.secondary or (),
+                 classify_ttl=args.classify_ttl, rollup=args.rollup),
+             patrol=PatrolOptions(
+                 slots=args.patrol, dwell=args.dwell, revisit=args.revisit,
+                 policy=args.patrol_policy),
+             overload=OverloadOptions(
+                 target_latency=args.overload,
+                 shed_order=args.shed_order.split(','),
+                 low_priority=[int(i) for i in args.low_priority.split(',')]
+                 if args.low_priority else ()))
+    finally:
+        if trace_log is not None and os.path.exists(trace_log):
+            gsttrace.summarize_file(trace_log)
+        if args.graphs:
+            graphs.flush()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,410 @@
+"""
+Offline backlog mode: run detection over (very) many video files as fast as
+possible. Executed with:
+
+mce batch --results DIR FILE_OR_DIR [FILE_OR_DIR ...]
+
+A fixed number of muxer slots is kept full: whenever a file ends, it's
+SourceBin is removed and the next file (read lazily from the command line,
+directories and --list files) takes it's slot. Nothing is synced to a clock or
+displayed. Detections are written to one .jsonl file per input and every
+finished file is appended to DIR/progress.jsonl, so an interrupted run can be
+resumed by running the same command again.
+"""
+
+# Copyright (c) 2020 Michael de Gans
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+import gi
+gi.require_version('Gst', '1.0')
+gi.require_version('GLib', '2.0')
+from gi.repository import (
+    GLib,
+    Gst,
+)
+
+from typing import (
+    Any,
+    Dict,
+    IO,
+    Iterable,
+    Iterator,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+)
+
+import mce.bus
+import mce.geometry
+import mce.osd
+from mce import pyds
+
+logger = logging.getLogger(__name__)
+
+__all__ = [
+    'BatchRunner',
+    'DEFAULT_SLOTS',
+    'PROGRESS_FILE',
+    'VIDEO_EXTENSIONS',
+    'iter_files',
+    'read_progress',
+    'result_filename',
+]
+
+DEFAULT_SLOTS = 4
+PROGRESS_FILE = 'progress.jsonl'
+VIDEO_EXTENSIONS = ('.mp4', '.mkv', '.mov', '.avi', '.ts', '.h264', '.h265')
+# seconds to keep a file's results open (and it's muxer slot held) after it's
+# EOS, for the frames still in the muxer and nvinfer
+LINGER = 1
+
+
+def iter_files(paths: Iterable[str], lists: Iterable[str] = (),
+               extensions: Tuple[str, ...] = VIDEO_EXTENSIONS,
+               ) -> Iterator[str]:
+    """
+    :yields: absolute filenames, lazily, from |paths| (files, or directories
+             walked recursively for |extensions|) and |lists| (text files with
+             one filename per line)
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.lower().endswith(extensions):
+                        yield os.path.abspath(os.path.join(root, name))
+        else:
+            yield os.path.abspath(path)
+    for list_file in lists:
+        with open(list_file) as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    yield os.path.abspath(line)
+
+
+def result_filename(path: str) -> str:
+    """:returns: a stable, unique, results filename for input |path|"""
+    digest = hashlib.sha1(path.encode()).hexdigest()[:10]
+    return f'{os.path.basename(path)}.{digest}.jsonl'
+
+
+def read_progress(results: str) -> Set[str]:
+    """:returns: input files already successfully processed into |results|"""
+    done = set()
+    try:
+        with open(os.path.join(results, PROGRESS_FILE)) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # a line cut short by a crash
+                    continue
+                if record.get('ok'):
+                    done.add(record['file'])
+    except FileNotFoundError:
+        pass
+    return done
+
+
+class _FileResult(object):
+    """a file being processed in a slot"""
+
+    def __init__(self, path: str, out: IO):
+        self.path = path
+        self.out = out
+        self.size = None  # type: Optional[Tuple[int, int]]
+        self.frames = 0
+        self.detections = 0
+        self.ok = True
+        # it's source reached EOS (or failed), so nothing more is coming
+        # but the frames still in flight
+        self.finished = False
+        self.start = time.monotonic()
+
+
+class BatchRunner(object):
+    """
+    Run a headless DeepStreamApp over |files|, |slots| at a time.
+
+    :arg pie_config: primary inference config
+    :arg files: input filenames. Consumed lazily, so this may be a generator
+         over millions of files.
+    :arg results: directory for results and progress
+    :param slots: how many files to batch at once (nvstreammux batch-size)
+    :param resume: skip files already in the progress file
+    :param kwargs: passed to DeepStreamApp (eg. queues)
+    """
+
+    def __init__(self, pie_config: str, files: Iterable[str], results: str,
+                 slots: int = DEFAULT_SLOTS, resume: bool = True, **kwargs):
+        self._pie_config = pie_config
+        self._files = iter(files)
+        self._results = results
+        self._slots = slots
+        self._done = read_progress(results) if resume else set()
+        self._kwargs = kwargs
+        self._app = None
+        self._muxer = (0, 0)
+        self._progress = None  # type: Optional[IO]
+        # source name -> _FileResult. accessed from streaming threads too.
+        self._active = {}  # type: Dict[str, _FileResult]
+        self._lock = threading.Lock()
+        self._running = 0  # sources in the pipeline (not lingering)
+        # no files left to start
+        self._exhausted = False
+        self.files = 0
+        self.failed = 0
+        self.skipped = 0
+        self.frames = 0
+
+    def run(self) -> Dict[str, Any]:
+        """
+        Process every file, blocking until done.
+
+        :returns: a dict of throughput stats
+        """
+        # import here for the same reason as in __main__.main()
+        import mce.pipeline
+        os.makedirs(self._results, exist_ok=True)
+        start = time.monotonic()
+        with open(os.path.join(self._results, PROGRESS_FILE), 'a') as progress:
+            self._progress = progress
+            with mce.pipeline.DeepStreamApp(
+                    self._pie_config, bus_cb=self._on_message, headless=True,
+                    num_sources=self._slots, **self._kwargs) as app:
+                self._app = app
+                muxer = app['stream-muxer']
+                self._muxer = (muxer.get_property('width'),
+                               muxer.get_property('height'))
+                app.add_probe(self._on_buffer)
+                for _ in range(self._slots):
+                    self._fill()
+                if self._running:
+                    app.ready()
+                    app.play()
+            self._app = None
+            # anything still lingering at exit. a file that hadn't finished
+            # (eg. on an error or interrupt) was cut short, so it fails, and
+            # is processed again on resume.
+            for name in list(self._active):
+                result = self._active[name]
+                result.ok = result.ok and result.finished
+                self._close(name)
+        seconds = time.monotonic() - start
+        return {
+            'files': self.files,
+            'failed': self.failed,
+            'skipped': self.skipped,
+            'frames': self.frames,
+            'seconds': seconds,
+            'files_per_hour': 3600 * self.files / seconds if seconds else 0.0,
+            'fps': self.frames / seconds if seconds else 0.0,
+        }
+
+    def _next_file(self) -> Optional[str]:
+        for path in self._files:
+            if path in self._done:
+                self.skipped += 1
+                continue
+            return path
+        return None
+
+    def _fill(self) -> bool:
+        """add the next file to a free slot. :returns: False if none left"""
+        path = self._next_file()
+        if path is None:
+            return False
+        source = self._app.add_source(Gst.filename_to_uri(path))
+        out = open(os.path.join(self._results, result_filename(path)), 'w')
+        with self._lock:
+            self._active[source.name] = _FileResult(path, out)
+        self._running += 1
+        source.connect('pad-added', self._on_source_pad)
+        logger.debug(f"{source.name}: {path}")
+        return True
+
+    def _on_source_pad(self, source: Gst.Element, pad: Gst.Pad):
+        caps = pad.get_current_caps() or pad.query_caps()
+        structure = caps.get_structure(0)
+        (w_ok, width), (h_ok, height) = (
+            structure.get_int('width'), structure.get_int('height'))
+        with self._lock:
+            result = self._active.get(source.name)
+            if result is not None and w_ok and h_ok:
+                result.size = (width, height)
+        pad.add_probe(Gst.PadProbeType.EVENT_DOWNSTREAM, self._on_event, source)
+
+    def _on_event(self, _: Gst.Pad, info: Gst.PadProbeInfo,
+                  source: Gst.Element) -> Gst.PadProbeReturn:
+        if info.get_event().type != Gst.EventType.EOS:
+            return Gst.PadProbeReturn.OK
+        GLib.idle_add(self._finish, source, True)
+        # the muxer only needs to know a stream ended if it isn't replaced
+        return Gst.PadProbeReturn.DROP
+
+    def _finish(self, source: Gst.Element, ok: bool) -> bool:
+        """remove a finished (or failed) source and refill it's slot"""
+        if source.get_parent() is not self._app:
+            return False  # already removed (eg. an error and then EOS)
+        with self._lock:
+            result = self._active.get(source.name)
+            if result is not None:
+                result.ok = result.ok and ok
+                result.finished = True
+        # hold the slot, so the frames in flight still map to this file (the
+        # next file takes another slot meanwhile)
+        held = self._app.remove_source(source, hold=True)
+        self._running -= 1
+        GLib.timeout_add_seconds(LINGER, self._close, source.name, held)
+        if not self._fill() and not self._running:
+            # quit once the last file's frames in flight are in, when it's
+            # closed (see _close)
+            self._exhausted = True
+        return False  # don't repeat
+
+    def _close(self, name: str, held: Sequence[int] = ()) -> bool:
+        """
+        close a file's results, record it in the progress file and release
+        the slots |held| for it
+        """
+        with self._lock:
+            result = self._active.pop(name, None)
+        if self._app is not None:
+            for index in held:
+                self._app.release_slot(index)
+        if result is None:
+            return False
+        result.out.close()
+        self.frames += result.frames
+        if result.ok:
+            self.files += 1
+        else:
+            self.failed += 1
+        self._progress.write(json.dumps({
+            'file': result.path,
+            'ok': result.ok,
+            'frames': result.frames,
+            'detections': result.detections,
+            'seconds': round(time.monotonic() - result.start, 3),
+            'results': result_filename(result.path),
+        }) + '\n')
+        self._progress.flush()
+        logger.info(
+            f"{'done' if result.ok else 'FAILED'}: {result.path} "
+            f"({result.frames} frames)")
+        if self._exhausted and not self._active and self._app is not None:
+            logger.info("no files left")
+            self._app.quit()
+        return False  # don't repeat
+
+    def _on_message(self, bus: Gst.Bus, message: Gst.Message, app) -> bool:
+        if message.type == Gst.MessageType.ERROR:
+            # an error in a source fails just that file
+            element = message.src
+            while element is not None and element.get_parent() is not app:
+                element = element.get_parent()
+            if element is not None and element.name in self._active:
+                err, errmsg = message.parse_error()  # type: GLib.Error, str
+                logger.error(f'{element.name}: {err}: {errmsg}')
+                GLib.idle_add(self._finish, element, False)
+                return True
+        return mce.bus.on_message(bus, message, app)
+
+    def _on_buffer(self, pad: Gst.Pad, info: Gst.PadProbeInfo, _: Any,
+                   ) -> Gst.PadProbeReturn:
+        batch_meta = pyds.gst_buffer_get_nvds_batch_meta(
+            hash(info.get_buffer()))
+        slots = self._app.slots
+        with self._lock:
+            for frame_meta in mce.osd.frame_meta_iterator(
+                    batch_meta.frame_meta_list):
+                result = self._active.get(slots.get(frame_meta.pad_index))
+                if result is None:
+                    continue
+                objects = []
+                for obj_meta in mce.osd.obj_meta_iterator(
+                        frame_meta.obj_meta_list):
+                    r = obj_meta.rect_params
+                    rect = (r.left, r.top, r.width, r.height)
+                    if result.size:
+                        # source pixels, rather than muxer pixels
+                        rect = mce.geometry.unletterbox(
+                            rect, result.size, self._muxer)
+                    objects.append([obj_meta.class_id,
+                                    round(obj_meta.confidence, 3),
+                                    *(round(v, 1) for v in rect)])
+                result.frames += 1
+                result.detections += len(objects)
+                if objects:
+                    result.out.write(json.dumps({
+                        'frame': frame_meta.frame_num,
+                        'pts': frame_meta.buf_pts / Gst.SECOND,
+                        'objects': objects,
+                    }) + '\n')
+        return Gst.PadProbeReturn.OK
+
+
+def cli_main(args: Iterable[str] = None):
+    """Parse command line arguments and run a BatchRunner."""
+    import argparse
+    import mce.__main__
+    ap = argparse.ArgumentParser(
+        prog='mce batch',
+        description="Mechanical Compound Eye offline (batch) mode",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    ap.add_argument('paths', metavar='FILE_OR_DIR', nargs='*',
+                    help='video files or directories to search for them')
+    ap.add_argument('--list', metavar='FILE', action='append', default=[],
+                    help='a file with one video filename per line. May be '
+                         'repeated.')
+    ap.add_argument('--results', metavar='DIR', required=True,
+                    help='where to write results and progress')
+    ap.add_argument('--slots', type=int, default=DEFAULT_SLOTS,
+                    help='files to process at once (batch size)')
+    ap.add_argument('--no-resume', action='store_true',
+                    help='reprocess files already in DIR/progress.jsonl')
+    ap.add_argument('--config', help='primary inference config',
+                    default=mce.__main__.ensure_config())
+    ap.add_argument('-v', '--verbose', help='print DEBUG log level',
+                    action='store_true', default=mce.DEBUG)
+    args = ap.parse_args(args=args)
+    logging.basicConfig(
+        level=logging.DEBUG if args.verbose else logging.INFO)
+    Gst.init(None)
+    stats = BatchRunner(
+        args.config, iter_files(args.paths, args.list), args.results,
+        slots=args.slots, resume=not args.no_resume,
+    ).run()
+    print(json.dumps(stats, indent=2))
+
+
+if __name__ == '__main__':
+    cli_main()
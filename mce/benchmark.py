@@ -0,0 +1,701 @@
+"""
+Benchmarks for Mechanical Compound Eye. Executed with:
+
+python3 -m mce.benchmark headless URI [URI ...]
+
+which runs the same sources through the full display pipeline and then the
+headless one, and prints frame rate, CPU and GPU load for each, or:
+
+python3 -m mce.benchmark queues URI [URI ...]
+
+which tries several queue layouts (see make_inference_description) and
+prints the one with the best throughput, or:
+
+python3 -m mce.benchmark batch FILE_OR_DIR [FILE_OR_DIR ...]
+
+which runs the files through mce.batch and prints files per hour, or:
+
+python3 -m mce.benchmark osd-soak --frames 10000000
+
+which runs the osd probe over millions of simulated frames (no GPU or pyds
+needed) and prints how much memory grew, or:
+
+python3 -m mce.benchmark trace-overhead
+
+which prints the per-batch cost of mce.trace (disabled and sampling) and of
+eager vs. lazy debug logging, with simulated batches, or:
+
+python3 -m mce.benchmark zones --objects 500
+
+which times mce.zones on simulated batches of tracked objects against
+testing every object against every zone, one by one, in Python, or:
+
+python3 -m mce.benchmark rollup
+
+which times mce.rollup's probe and queries over a simulated day of batches,
+and prints it's (fixed) memory use.
+"""
+
+# Copyright (c) 2020 Michael de Gans
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import json
+import logging
+import os
+import tempfile
+import time
+import tracemalloc
+
+import gi
+gi.require_version('Gst', '1.0')
+gi.require_version('GLib', '2.0')
+from gi.repository import (
+    GLib,
+    Gst,
+)
+
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Tuple,
+)
+
+from mce import pyds
+
+logger = logging.getLogger(__name__)
+
+__all__ = [
+    'FrameCounter',
+    'QUEUE_LAYOUTS',
+    'batch',
+    'compare_headless',
+    'gpu_load',
+    'osd_soak',
+    'profile_queues',
+    'rollup',
+    'run',
+    'trace_overhead',
+]
+
+# candidate queue layouts for profile_queues (stages followed by a queue)
+QUEUE_LAYOUTS = (
+    (),
+    ('stream-muxer',),
+    ('pie',),
+    ('stream-muxer', 'pie'),
+    ('pie', 'tiler'),
+    ('stream-muxer', 'pie', 'tiler'),
+    ('stream-muxer', 'pie', 'converter', 'tiler', 'osd'),
+)
+
+# Tegra's GPU load, in tenths of a percent
+TEGRA_GPU_LOAD = '/sys/devices/gpu.0/load'
+
+
+def gpu_load() -> Optional[float]:
+    """:returns: GPU load in percent, or None if it can't be read"""
+    try:
+        with open(TEGRA_GPU_LOAD) as f:
+            return int(f.read()) / 10
+    except (OSError, ValueError):
+        return None
+
+
+class FrameCounter(object):
+    """
+    A pad probe counting batches and frames. The clock starts at the first
+    batch, so pipeline startup (eg. building the TensorRT engine) isn't
+    counted.
+    """
+
+    def __init__(self):
+        self.batches = 0
+        self.frames = 0
+        self.start = None  # type: Optional[float]
+        self.end = None  # type: Optional[float]
+
+    def on_buffer(self, pad: Gst.Pad, info: Gst.PadProbeInfo, _: Any,
+                  ) -> Gst.PadProbeReturn:
+        """the probe callback. Add with DeepStreamApp.add_probe"""
+        self.end = time.monotonic()
+        if self.start is None:
+            self.start = self.end
+        batch_meta = pyds.gst_buffer_get_nvds_batch_meta(
+            hash(info.get_buffer()))
+        self.batches += 1
+        self.frames += batch_meta.num_frames_in_batch
+        return Gst.PadProbeReturn.OK
+
+    @property
+    def fps(self) -> float:
+        """:returns: frames per second since the first batch"""
+        if self.start is None or self.end == self.start:
+            return 0.0
+        return self.frames / (self.end - self.start)
+
+
+def run(pie_config: str, sources: Iterable[str], duration: float = 30.0,
+        **kwargs) -> Dict[str, Any]:
+    """
+    Run a DeepStreamApp for |duration| seconds (or until EOS).
+
+    :arg pie_config: primary inference config
+    :arg sources: uris to run
+    :param duration: seconds to run for
+    :param kwargs: passed to DeepStreamApp
+
+    :returns: a dict of results
+    """
+    # import here for the same reason as in __main__.main()
+    import mce.pipeline
+    counter = FrameCounter()
+    gpu_samples = []  # type: List[float]
+
+    def sample_gpu():
+        load = gpu_load()
+        if load is not None:
+            gpu_samples.append(load)
+        return True
+
+    # GLib source ids to remove after the run (in case of an early EOS)
+    pending = {}  # type: Dict[str, int]
+
+    queue_stats = {}
+    source_stats = {}
+    probe_stats = {}
+
+    def stop():
+        del pending['stop']
+        # the queues are empty once stopped, so get their levels now
+        queue_stats.update(app.queue_stats())
+        source_stats.update(app.source_stats())
+        probe_stats.update(app.probe_stats())
+        app.quit()
+        return False  # don't repeat
+
+    with mce.pipeline.DeepStreamApp(
+            pie_config, sources=sources, **kwargs) as app:
+        app.add_probe(counter.on_buffer, name='frame_counter')
+        pending['gpu'] = GLib.timeout_add(500, sample_gpu)
+        pending['stop'] = GLib.timeout_add(int(duration * 1000), stop)
+        start_times = os.times()
+        start = time.monotonic()
+        app.ready()
+        app.play()
+        wall = time.monotonic() - start
+        end_times = os.times()
+        for source_id in pending.values():
+            GLib.source_remove(source_id)
+    cpu = ((end_times.user - start_times.user)
+           + (end_times.system - start_times.system))
+    return {
+        'batches': counter.batches,
+        'frames': counter.frames,
+        'fps': counter.fps,
+        # of one core, so may be over 100 on multi-core systems
+        'cpu_percent': 100 * cpu / wall if wall else 0.0,
+        'gpu_percent': (sum(gpu_samples) / len(gpu_samples)
+                        if gpu_samples else None),
+        'queues': queue_stats,
+        'probes': probe_stats,
+        'sources': source_stats,
+    }
+
+
+def compare_headless(pie_config: str, sources: Iterable[str],
+                     duration: float = 30.0, **kwargs
+                     ) -> Dict[str, Dict[str, Any]]:
+    """
+    Run |sources| through the full display pipeline, then headless.
+
+    :returns: a dict of results for 'display' and 'headless'
+    """
+    sources = list(sources)
+    return {
+        'display': run(pie_config, sources, duration, **kwargs),
+        'headless': run(pie_config, sources, duration, headless=True,
+                        **kwargs),
+    }
+
+
+def profile_queues(pie_config: str, sources: Iterable[str],
+                   duration: float = 30.0,
+                   layouts: Iterable[Tuple[str, ...]] = QUEUE_LAYOUTS,
+                   **kwargs) -> Tuple[Tuple[str, ...], Dict[str, Any]]:
+    """
+    Run |sources| with every queue layout in |layouts| and pick the one with
+    the highest frame rate. Stages the pipeline won't have (the tiler,
+    converter and osd if headless, the tracker without one) are left out of
+    the layouts, and layouts that are then the same are run once.
+
+    :returns: the best layout and a dict of results for every layout (keyed
+              by the layout as a comma separated string)
+    """
+    # import here for the same reason as in __main__.main()
+    import mce.pipeline
+    sources = list(sources)
+    absent = set()
+    if kwargs.get('headless'):
+        absent.update(('converter', 'tiler', 'osd'))
+    if not kwargs.get('tracker'):
+        absent.add('tracker')
+    layouts = dict.fromkeys(
+        tuple(stage for stage in layout if stage not in absent)
+        for layout in layouts)
+    results = {}
+    best, best_fps = (), -1.0
+    for layout in layouts:
+        result = run(pie_config, sources, duration,
+                     queues=mce.pipeline.make_queues(layout), **kwargs)
+        results[','.join(layout)] = result
+        logger.info(f"queues after {layout or 'nothing'}: "
+                    f"{result['fps']:.2f} fps")
+        if result['fps'] > best_fps:
+            best, best_fps = layout, result['fps']
+    return best, results
+
+
+def batch(pie_config: str, paths: Iterable[str], slots: int = 4,
+          **kwargs) -> Dict[str, Any]:
+    """
+    Run files (or directories of them) through a BatchRunner, from scratch,
+    writing results to a temporary directory.
+
+    :returns: the BatchRunner's stats (including 'files_per_hour')
+    """
+    import mce.batch
+    with tempfile.TemporaryDirectory() as results:
+        return mce.batch.BatchRunner(
+            pie_config, mce.batch.iter_files(paths), results, slots=slots,
+            resume=False, **kwargs).run()
+
+
+class _GList(object):
+    """a node of a fake GLib.List"""
+
+    def __init__(self, data, following=None):
+        self.data = data
+        self.next = following
+
+
+class _Color(object):
+    def set(self, red: float, green: float, blue: float, alpha: float):
+        self.rgba = (red, green, blue, alpha)
+
+
+class _Meta(object):
+    pass
+
+
+class _FakePyds(object):
+    """
+    Just enough of pyds to run mce.osd.Overlay without DeepStream. Like pyds,
+    setting a string field allocates a C string (counted in |strings|),
+    freeing the one it replaces, and reading it back returns it's address.
+    Display metas come from a pool, like DeepStream's, and go back to it when
+    their batch is done (at the next batch), still holding their strings.
+    Freeing a string twice raises a RuntimeError.
+    """
+
+    def __init__(self, sources: int, objects: int):
+        self.strings = {}  # type: Dict[int, str]
+        self._next_address = 1
+        self.frame_meta = [self._frame_meta(i, objects) for i in range(sources)]
+        self.batch_meta = _Meta()
+        self.batch_meta.frame_meta_list = None
+        for frame_meta in reversed(self.frame_meta):
+            self.batch_meta.frame_meta_list = _GList(
+                frame_meta, self.batch_meta.frame_meta_list)
+        self.batch_meta.num_frames_in_batch = sources
+        # display metas free, and acquired for the current batch
+        self._pool = []  # type: List[_Meta]
+        self._acquired = []  # type: List[_Meta]
+
+    def _frame_meta(self, index: int, objects: int) -> _Meta:
+        frame_meta = _Meta()
+        frame_meta.pad_index = index
+        frame_meta.frame_num = 0
+        frame_meta.num_obj_meta = objects
+        frame_meta.obj_meta_list = None
+        for i in range(objects):
+            obj_meta = _Meta()
+            obj_meta.class_id = i % 4
+            frame_meta.obj_meta_list = _GList(
+                obj_meta, frame_meta.obj_meta_list)
+        return frame_meta
+
+    def _make_display_meta(self) -> _Meta:
+        fake = self
+
+        class TextParams(object):
+            def __init__(self):
+                self._text = None
+                self.font_params = FontParams()
+                self.text_bg_clr = _Color()
+
+            @property
+            def display_text(self) -> int:
+                return self._text
+
+            @display_text.setter
+            def display_text(self, text: str):
+                if self._text is not None:
+                    fake.free_buffer(self._text)
+                self._text = fake.malloc(text)
+
+        class FontParams(object):
+            def __init__(self):
+                self._name = None
+                self.font_color = _Color()
+
+            @property
+            def font_name(self) -> int:
+                return self._name
+
+            @font_name.setter
+            def font_name(self, name: str):
+                if self._name is not None:
+                    fake.free_buffer(self._name)
+                self._name = fake.malloc(name)
+
+        display_meta = _Meta()
+        display_meta.text_params = [TextParams()]
+        return display_meta
+
+    def malloc(self, text: str) -> int:
+        address = self._next_address
+        self._next_address += 1
+        self.strings[address] = text
+        return address
+
+    def free_buffer(self, address: int):
+        if self.strings.pop(address, None) is None:
+            raise RuntimeError(f"double free of {address}")
+
+    def gst_buffer_get_nvds_batch_meta(self, _: int) -> _Meta:
+        # a new batch, so the last one's display metas are released
+        self._pool.extend(self._acquired)
+        self._acquired.clear()
+        return self.batch_meta
+
+    def glist_get_nvds_frame_meta(self, data: _Meta) -> _Meta:
+        return data
+
+    def glist_get_nvds_object_meta(self, data: _Meta) -> _Meta:
+        return data
+
+    def nvds_acquire_display_meta_from_pool(self, _: _Meta) -> _Meta:
+        display_meta = (self._pool.pop() if self._pool
+                        else self._make_display_meta())
+        self._acquired.append(display_meta)
+        return display_meta
+
+    def nvds_add_display_meta_to_frame(self, frame_meta: _Meta, _: _Meta):
+        pass
+
+
+class _FakeInfo(object):
+    @staticmethod
+    def get_buffer():
+        return 1
+
+
+def osd_soak(frames: int = 1000000, sources: int = 4, objects: int = 8,
+             samples: int = 10) -> Dict[str, Any]:
+    """
+    Run mce.osd.Overlay over |frames| simulated frames with a fake pyds,
+    sampling Python heap use (with tracemalloc) and the count of live C
+    strings as it goes. Object counts change every so often, so text is
+    regenerated too. Memory should be flat after the first sample: the
+    only C strings live are the ones the pooled display metas hold.
+
+    :returns: the samples, the growth between the first and last and the
+              display metas in the pool
+    """
+    import mce.osd
+    fake = _FakePyds(sources, objects)
+    overlay = mce.osd.Overlay()
+    info = _FakeInfo()
+    batches = max(frames // sources, samples)
+    every = max(batches // samples, 1)
+    real_pyds = mce.osd.pyds
+    mce.osd.pyds = fake
+    tracemalloc.start()
+    results = []
+    start = time.monotonic()
+    try:
+        for i in range(batches):
+            if not i % 97:
+                for frame_meta in fake.frame_meta:
+                    frame_meta.num_obj_meta = objects - i % 3
+            overlay.on_buffer(None, info, None)
+            if not (i + 1) % every:
+                current, _ = tracemalloc.get_traced_memory()
+                results.append({
+                    'frames': overlay.frames,
+                    'python_bytes': current,
+                    'c_strings': len(fake.strings),
+                })
+    finally:
+        tracemalloc.stop()
+        mce.osd.pyds = real_pyds
+    elapsed = time.monotonic() - start
+    return {
+        'samples': results,
+        'python_growth': results[-1]['python_bytes'] - results[0]['python_bytes'],
+        'c_string_growth': results[-1]['c_strings'] - results[0]['c_strings'],
+        'display_metas': len(fake._pool) + len(fake._acquired),
+        'regenerated': overlay.regenerated,
+        'frames_per_second': overlay.frames / elapsed if elapsed else 0.0,
+    }
+
+
+def trace_overhead(batches: int = 100000, sources: int = 4,
+                   objects: int = 8) -> Dict[str, float]:
+    """
+    Time mce.trace.Tracer with a fake pyds, disabled, sampling 1 in 30
+    batches and tracing every batch, against an empty probe. Also times a
+    disabled debug log with an f-string (formatted anyway) against lazy
+    %-style arguments.
+
+    :returns: nanoseconds per batch (or per log call) for each
+    """
+    import timeit
+    import mce.osd
+    import mce.trace
+    fake = _FakePyds(sources, objects)
+    for frame_meta in fake.frame_meta:
+        frame_meta.ntp_timestamp = 0
+    info = _FakeInfo()
+    real_pyds = mce.trace.pyds
+    mce.trace.pyds = mce.osd.pyds = fake
+    results = {}
+
+    def empty(pad, info_, _):
+        return Gst.PadProbeReturn.OK
+
+    try:
+        results['empty_probe_ns'] = timeit.timeit(
+            lambda: empty(None, info, None), number=batches)
+        for every, key in ((0, 'disabled_ns'), (30, 'every_30_ns'),
+                           (1, 'every_batch_ns')):
+            tracer = mce.trace.Tracer(every=every)
+            results[key] = timeit.timeit(
+                lambda: tracer.on_buffer(None, info, None), number=batches)
+    finally:
+        mce.trace.pyds = mce.osd.pyds = real_pyds
+    quiet = logging.getLogger('mce.benchmark.quiet')
+    quiet.setLevel(logging.INFO)
+    frame_meta = fake.frame_meta[0]
+    results['log_eager_ns'] = timeit.timeit(
+        lambda: quiet.debug(f"{frame_meta.pad_index}:{frame_meta.frame_num}"),
+        number=batches)
+    results['log_lazy_ns'] = timeit.timeit(
+        lambda: quiet.debug("%s:%s", frame_meta.pad_index,
+                            frame_meta.frame_num),
+        number=batches)
+    return {k: v / batches * 1e9 for k, v in results.items()}
+
+
+def _naive_zones(zones, sources, anchors) -> List[List[bool]]:
+    """every anchor against every zone of it's source, one at a time"""
+    results = []
+    for source, (x, y) in zip(sources, anchors):
+        row = []
+        for zone_source, polygon in zones:
+            inside = False
+            if zone_source == source:
+                for (x0, y0), (x1, y1) in zip(
+                        polygon, polygon[1:] + polygon[:1]):
+                    if (y0 > y) != (y1 > y) and \
+                            x < x0 + (y - y0) * (x1 - x0) / (y1 - y0):
+                        inside = not inside
+            row.append(inside)
+        results.append(row)
+    return results
+
+
+def zones(batches: int = 1000, sources: int = 4, objects: int = 500,
+          zones_per_source: int = 8, lines_per_source: int = 4,
+          size: Tuple[int, int] = (1920, 1080)) -> Dict[str, float]:
+    """
+    Time mce.zones.ZoneAnalytics.process on simulated batches of |objects|
+    tracked objects (wandering across |sources| frames of |size|) against a
+    per object, per zone, Python polygon test (on fewer batches, it's slow).
+
+    :returns: milliseconds per batch for each, and the counts
+    """
+    import numpy as np
+    import mce.osd
+    import mce.zones
+    rng = np.random.default_rng(0)
+    width, height = size
+    zone_defs = []
+    line_defs = []
+    for s in range(sources):
+        for z in range(zones_per_source):
+            cx, cy = rng.uniform(0, width), rng.uniform(0, height)
+            # an irregular octagon
+            angles = np.sort(rng.uniform(0, 2 * np.pi, 8))
+            radii = rng.uniform(50, 300, 8)
+            polygon = [(float(cx + r * np.cos(a)), float(cy + r * np.sin(a)))
+                       for a, r in zip(angles, radii)]
+            zone_defs.append(mce.zones.Zone(f'zone_{s}_{z}', f'source_{s}',
+                                            polygon))
+        for i in range(lines_per_source):
+            a = (float(rng.uniform(0, width)), float(rng.uniform(0, height)))
+            b = (float(rng.uniform(0, width)), float(rng.uniform(0, height)))
+            line_defs.append(mce.zones.Line(f'line_{s}_{i}', f'source_{s}',
+                                            a, b))
+    analytics = mce.zones.ZoneAnalytics(zone_defs, line_defs)
+    source_ids = rng.integers(0, sources, objects)
+    anchors = rng.uniform((0, 0), size, (objects, 2))
+    class_ids = rng.integers(0, mce.osd.NUM_CLASSES, objects)
+    object_ids = np.arange(objects, dtype=np.uint64)
+    present = np.ones(sources, dtype=bool)
+    start = time.perf_counter()
+    for batch_ in range(batches):
+        anchors += rng.normal(0, 4, anchors.shape)
+        analytics.process(source_ids, anchors, class_ids, object_ids,
+                          present, now=batch_ / 30)
+    elapsed = time.perf_counter() - start
+    naive_batches = max(1, batches // 100)
+    polygons = [(z.source, list(z.polygon)) for z in zone_defs]
+    naive_sources = [f'source_{s}' for s in source_ids.tolist()]
+    naive_start = time.perf_counter()
+    for _ in range(naive_batches):
+        _naive_zones(polygons, naive_sources, anchors.tolist())
+    naive_elapsed = time.perf_counter() - naive_start
+    stats = analytics.stats()
+    return {
+        'objects': objects,
+        'zones': len(zone_defs),
+        'lines': len(line_defs),
+        'ms_per_batch': elapsed / batches * 1000,
+        'naive_zones_only_ms_per_batch':
+            naive_elapsed / naive_batches * 1000,
+        'entries': sum(z['entries'] for z in stats['zones'].values()),
+        'crossings': sum(line['in'] + line['out']
+                         for line in stats['lines'].values()),
+    }
+
+
+def rollup(batches: int = 100000, sources: int = 4,
+           objects: int = 8) -> Dict[str, float]:
+    """
+    Time mce.rollup.Rollup with a fake pyds: it's probe, adding |batches|
+    batches spread over a day (so every resolution's buckets close and
+    merge) and queries of a minute, an hour and a day.
+
+    :returns: microseconds per batch (or query) for each, and the bytes the
+              rollup holds (the same however long it runs)
+    """
+    import timeit
+    import numpy as np
+    import mce.osd
+    import mce.rollup
+    fake = _FakePyds(sources, objects)
+    info = _FakeInfo()
+    time_series = mce.rollup.Rollup(sources)
+    real_pyds = mce.rollup.pyds
+    mce.rollup.pyds = mce.osd.pyds = fake
+    results = {}
+    try:
+        results['probe_us'] = timeit.timeit(
+            lambda: time_series.on_buffer(None, info, None),
+            number=batches) / batches * 1e6
+    finally:
+        mce.rollup.pyds = mce.osd.pyds = real_pyds
+    time_series = mce.rollup.Rollup(sources)
+    rng = np.random.default_rng(0)
+    counts = rng.poisson(2, (batches, sources, time_series.classes))
+    present = np.ones(sources, dtype=bool)
+    step = 24 * 3600 / batches
+    start = time.perf_counter()
+    for i in range(batches):
+        time_series.add(counts[i], present, now=i * step)
+    results['add_us'] = (time.perf_counter() - start) / batches * 1e6
+    for name, window in (('minute', 60), ('hour', 3600), ('day', 86400)):
+        results[f'query_{name}_us'] = timeit.timeit(
+            lambda: time_series.query(0, 0, window),
+            number=1000) / 1000 * 1e6
+    results['bytes'] = sum(
+        array.nbytes for ring in time_series.rings
+        for array in vars(ring).values() if isinstance(array, np.ndarray))
+    return results
+
+
+def cli_main(args: Iterable[str] = None):
+    """Parse command line arguments and run a benchmark."""
+    import argparse
+    import mce.__main__
+    ap = argparse.ArgumentParser(
+        description="Mechanical Compound Eye benchmarks",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    ap.add_argument('benchmark',
+                    choices=('headless', 'queues', 'batch', 'osd-soak',
+                             'trace-overhead', 'zones', 'rollup'))
+    ap.add_argument('sources', help="urls or file sources", nargs='*')
+    ap.add_argument('--config', help='primary inference config',
+                    default=mce.__main__.ensure_config())
+    ap.add_argument('--duration', help='seconds to run each pipeline',
+                    type=float, default=30.0)
+    ap.add_argument('--slots', help='batch size for the batch benchmark',
+                    type=int, default=4)
+    ap.add_argument('--frames', help='frames for the osd-soak benchmark',
+                    type=int, default=1000000)
+    ap.add_argument('--objects', help='objects per batch for the zones '
+                                      'benchmark', type=int, default=500)
+    args = ap.parse_args(args=args)
+    if not args.sources and args.benchmark not in ('osd-soak',
+                                                   'trace-overhead',
+                                                   'zones', 'rollup'):
+        ap.error(f"{args.benchmark} needs at least one source")
+    logging.basicConfig(level=logging.INFO)
+    Gst.init(None)
+    if args.benchmark == 'headless':
+        results = compare_headless(args.config, args.sources, args.duration)
+    elif args.benchmark == 'queues':
+        best, results = profile_queues(
+            args.config, args.sources, args.duration)
+        print(f"best layout: --queues {','.join(best) or 'none'}")
+    elif args.benchmark == 'batch':
+        results = batch(args.config, args.sources, args.slots)
+        print(f"{results['files_per_hour']:.1f} files/hour")
+    elif args.benchmark == 'osd-soak':
+        results = osd_soak(args.frames)
+        print(f"grew {results['python_growth']} bytes and "
+              f"{results['c_string_growth']} C strings over {args.frames} "
+              f"frames")
+    elif args.benchmark == 'trace-overhead':
+        results = trace_overhead()
+    elif args.benchmark == 'zones':
+        results = zones(objects=args.objects)
+    elif args.benchmark == 'rollup':
+        results = rollup()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    cli_main()
@@ -26,15 +26,18 @@ def on_message(bus: Gst.Bus,
     elif message.type == Gst.MessageType.DURATION_CHANGED:
         pass
     elif message.type == Gst.MessageType.STREAM_STATUS:
-        status, owner = message.parse_stream_status()  # type: Gst.StreamStatusType, Gst.Element
-        logger.debug(f"{owner.name}:status:{status.value_name}")
+        # there's one of these (and of the below) per element per change, so
+        # don't even parse them unless they'll be logged
+        if logger.isEnabledFor(logging.DEBUG):
+            status, owner = message.parse_stream_status()  # type: Gst.StreamStatusType, Gst.Element
+            logger.debug("%s:status:%s", owner.name, status.value_name)
     elif message.type == Gst.MessageType.STATE_CHANGED:
-        old, new, pending = message.parse_state_changed()  # type: Gst.State, Gst.State, Gst.State
-        logger.debug(
-            f"{message.src.name}:state-change:"
-            f"{old.value_name}->{new.value_name}")
+        if logger.isEnabledFor(logging.DEBUG):
+            old, new, pending = message.parse_state_changed()  # type: Gst.State, Gst.State, Gst.State
+            logger.debug("%s:state-change:%s->%s", message.src.name,
+                         old.value_name, new.value_name)
     elif message.type == Gst.MessageType.EOS:
-        logger.debug(f"Got EOS")
+        logger.debug("Got EOS")
         app.quit()
     elif message.type == Gst.MessageType.ERROR:
         err, errmsg = message.parse_error()  # type: GLib.Error, str
@@ -45,6 +48,6 @@ def on_message(bus: Gst.Bus,
         logger.warning(f'{err}: {errmsg}')
     else:
         if mce.DEBUG:
-            logger.debug(
-                f"{message.src.name}:{Gst.MessageType.get_name(message.type)}")
+            logger.debug("%s:%s", message.src.name,
+                         Gst.MessageType.get_name(message.type))
     return True
@@ -0,0 +1,369 @@
+"""
+Classify each tracked object once, with a cache of secondary results.
+
+Secondary inference engines (sies, see make_inference_description's
+|secondaries|) classify every object they're given, on every frame: 30 times
+a second for a car that's parked. A :class:`ClassifierCache` remembers each
+tracked object's labels, by (source, object_id), and hides objects with
+fresh labels from the sies, so each object is classified once, and again
+only when:
+
+* it's labels are older than |ttl| seconds, or
+* it's box has grown by |regrow| times (it's closer, so a better look)
+
+Objects are hidden by a probe before the first sie, which marks them (nvinfer
+only classifies objects of the pie, see PIE_UNIQUE_ID). A probe after the
+last sie unmarks them and attaches their cached labels, as classifier
+metadata, like the sie would have, so later probes can't tell the
+difference. New results are read into the cache there too (no labels only
+once an object has passed the sies without any EMPTY_PASSES times, since
+with classifier-async-mode they come late).
+
+The cache is a least recently used mapping of at most |max_objects|.
+"""
+
+# Copyright (c) 2020 Michael de Gans
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import collections
+import logging
+import threading
+import time
+
+import gi
+gi.require_version('Gst', '1.0')
+gi.require_version('GLib', '2.0')
+from gi.repository import (
+    GLib,
+    Gst,
+)
+
+from typing import (
+    Any,
+    Dict,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Tuple,
+)
+
+import mce.osd
+from mce import pyds
+
+logger = logging.getLogger(__name__)
+
+__all__ = [
+    'ClassifierCache',
+    'Entry',
+    'Label',
+    'classifier_meta_iterator',
+    'label_info_iterator',
+]
+
+# seconds an object's labels are used before it's classified again
+DEFAULT_TTL = 10.0
+# classify again when an object's box area grows by this many times
+DEFAULT_REGROW = 1.5
+# objects cached (the least recently seen are forgotten first)
+DEFAULT_MAX_OBJECTS = 10000
+# times an object passes the sies without labels before that's cached. with
+# classifier-async-mode, labels come a frame (or more) after it's classified.
+EMPTY_PASSES = 2
+# the unique_component_id marking an object hidden from the sies (nvinfer
+# only classifies objects of it's infer-on-gie-id)
+HIDDEN_COMPONENT_ID = 0x6d6365  # "mce"
+
+# (source name, object_id)
+Key = Tuple[str, int]
+
+Label = collections.namedtuple(
+    'Label', ('component_id', 'label_id', 'class_id', 'probability',
+              'label'))
+Label.__doc__ = """
+A NamedTuple class describing one label from a secondary classifier.
+
+:arg component_id: the sie's unique-id
+:arg label_id: the NvDsLabelInfo.label_id (the output layer, if several)
+:arg class_id: the class id
+:arg probability: the classifier's probability
+:arg label: the class's name
+"""
+
+Entry = collections.namedtuple('Entry', ('labels', 'area', 'time'))
+Entry.__doc__ = """
+A NamedTuple class describing an object's cached classification.
+
+:arg labels: a Tuple of Label
+:arg area: the object's box area (pixels) when classified
+:arg time: when it was classified (as time.time())
+"""
+
+
+def classifier_meta_iterator(classifier_meta_list: GLib.List
+                             ) -> Iterator[pyds.NvDsClassifierMeta]:
+    while classifier_meta_list is not None:
+        yield pyds.glist_get_nvds_classifier_meta(classifier_meta_list.data)
+        classifier_meta_list = classifier_meta_list.next
+
+
+def label_info_iterator(label_info_list: GLib.List
+                        ) -> Iterator[pyds.NvDsLabelInfo]:
+    while label_info_list is not None:
+        yield pyds.glist_get_nvds_label_info(label_info_list.data)
+        label_info_list = label_info_list.next
+
+
+class ClassifierCache(object):
+    """
+    Caches secondary classifier results by tracked object (see the module
+    docs). Start on a DeepStreamApp with :meth:`start`.
+
+    :param ttl: seconds an object's labels are used before it's classified
+           again
+    :param regrow: classify again when an object's box area grows by this
+           many times since it was classified
+    :param max_objects: the most objects cached
+    """
+
+    def __init__(self, ttl: float = DEFAULT_TTL,
+                 regrow: float = DEFAULT_REGROW,
+                 max_objects: int = DEFAULT_MAX_OBJECTS):
+        self.ttl = ttl
+        self.regrow = regrow
+        self.max_objects = max_objects
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.grown = 0
+        self.evicted = 0
+        self._entries = collections.OrderedDict(
+        )  # type: collections.OrderedDict[Key, Entry]
+        self._lock = threading.Lock()
+        # key -> passes through the sies without labels, so far. only the
+        # sie src pad's thread uses it.
+        self._unlabelled = collections.OrderedDict(
+        )  # type: collections.OrderedDict[Key, int]
+        # set by start
+        self._slots = {}  # type: Mapping[int, str]
+        self._pie_id = None  # type: Optional[int]
+        # (pad, probe id) of each probe added
+        self._probes = []  # type: List[Tuple[Gst.Pad, int]]
+
+    def __len__(self):
+        return len(self._entries)
+
+    def lookup(self, key: Key, area: float, now: Optional[float] = None,
+               ) -> Optional[Entry]:
+        """
+        :returns: the cached Entry for |key|, if it's still good for a box
+                  of |area| (or None, so the object is classified)
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if now - entry.time > self.ttl:
+                self.expired += 1
+                return None
+            if area > entry.area * self.regrow:
+                self.grown += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def store(self, key: Key, labels: Tuple[Label, ...], area: float,
+              now: Optional[float] = None):
+        """cache |labels| for |key| (evicting the least recently used)"""
+        now = time.time() if now is None else now
+        with self._lock:
+            self._entries[key] = Entry(labels, area, now)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_objects:
+                self._entries.popitem(last=False)
+                self.evicted += 1
+
+    def labels(self, source: str, object_id: int) -> Tuple[Label, ...]:
+        """:returns: the cached labels of an object (if any)"""
+        with self._lock:
+            entry = self._entries.get((source, object_id))
+        return entry.labels if entry is not None else ()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        :returns: lookup 'hits' (objects not classified), 'misses' (new
+                  objects), 'expired' and 'grown' (classified again),
+                  'hit_ratio', 'objects' cached and 'evicted'
+        """
+        with self._lock:
+            lookups = self.hits + self.misses + self.expired + self.grown
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'expired': self.expired,
+                'grown': self.grown,
+                'hit_ratio': self.hits / lookups if lookups else None,
+                'objects': len(self._entries),
+                'evicted': self.evicted,
+            }
+
+    def start(self, app):
+        """
+        add the probes around the sies of a DeepStreamApp (called on it's
+        __enter__. It's sies are found by name, see
+        make_inference_description)
+        """
+        import mce.pipeline
+        sies = []
+        while app[mce.pipeline.SIE_NAME.format(len(sies))] is not None:
+            sies.append(app[mce.pipeline.SIE_NAME.format(len(sies))])
+        if not sies:
+            logger.warning("classifier cache: no secondary inference "
+                           "engines, so nothing to cache")
+            return
+        if app['tracker'] is None:
+            logger.warning("classifier cache: no tracker, so every object "
+                           "is classified on every frame (see --tracker)")
+        self._slots = app.slots
+        self._pie_id = mce.pipeline.PIE_UNIQUE_ID
+        for element, direction, callback in (
+                (sies[0], 'sink', self.on_sie_sink),
+                (sies[-1], 'src', self.on_sie_src)):
+            pad = element.get_static_pad(direction)  # type: Gst.Pad
+            if not pad:
+                raise RuntimeError(
+                    f"could not get {element.name} {direction} pad")
+            self._probes.append((pad, pad.add_probe(
+                Gst.PadProbeType.BUFFER, callback, None)))
+
+    def stop(self):
+        """remove the probes added by start (called on the DeepStreamApp's
+        __exit__)"""
+        for pad, probe_id in self._probes:
+            pad.remove_probe(probe_id)
+        self._probes = []
+
+    def on_sie_sink(self, pad: Gst.Pad, info: Gst.PadProbeInfo, _: Any,
+                    ) -> Gst.PadProbeReturn:
+        """hide objects with good cached labels from the sies"""
+        now = time.time()
+        untracked = mce.osd.UNTRACKED_OBJECT_ID
+        batch_meta = pyds.gst_buffer_get_nvds_batch_meta(
+            hash(info.get_buffer()))
+        for frame_meta in mce.osd.frame_meta_iterator(
+                batch_meta.frame_meta_list):
+            name = self._slots.get(frame_meta.pad_index)
+            for obj_meta in mce.osd.obj_meta_iterator(
+                    frame_meta.obj_meta_list):
+                if (obj_meta.object_id == untracked
+                        or obj_meta.unique_component_id != self._pie_id):
+                    continue
+                rect_params = obj_meta.rect_params
+                if self.lookup((name, obj_meta.object_id),
+                               rect_params.width * rect_params.height,
+                               now) is not None:
+                    obj_meta.unique_component_id = HIDDEN_COMPONENT_ID
+        return Gst.PadProbeReturn.OK
+
+    def on_sie_src(self, pad: Gst.Pad, info: Gst.PadProbeInfo, _: Any,
+                   ) -> Gst.PadProbeReturn:
+        """unhide objects, attaching cached labels, and cache new ones"""
+        now = time.time()
+        untracked = mce.osd.UNTRACKED_OBJECT_ID
+        batch_meta = pyds.gst_buffer_get_nvds_batch_meta(
+            hash(info.get_buffer()))
+        for frame_meta in mce.osd.frame_meta_iterator(
+                batch_meta.frame_meta_list):
+            name = self._slots.get(frame_meta.pad_index)
+            for obj_meta in mce.osd.obj_meta_iterator(
+                    frame_meta.obj_meta_list):
+                key = (name, obj_meta.object_id)
+                if obj_meta.unique_component_id == HIDDEN_COMPONENT_ID:
+                    obj_meta.unique_component_id = self._pie_id
+                    self._attach(batch_meta, obj_meta, self.labels(*key))
+                elif (obj_meta.object_id != untracked
+                        and obj_meta.unique_component_id == self._pie_id):
+                    # the sies saw it. no labels is cached too (eg. too
+                    # small, or not a class they classify), until it grows,
+                    # but only once they've had time to attach some.
+                    labels = self._read(obj_meta)
+                    if labels:
+                        self._unlabelled.pop(key, None)
+                    elif not self._settled(key):
+                        continue
+                    rect_params = obj_meta.rect_params
+                    self.store(key, labels,
+                               rect_params.width * rect_params.height, now)
+        return Gst.PadProbeReturn.OK
+
+    def _settled(self, key: Key) -> bool:
+        """
+        count a pass of |key| through the sies without labels.
+
+        :returns: True if that's EMPTY_PASSES in a row, so it has none
+        """
+        passes = self._unlabelled.pop(key, 0) + 1
+        if passes >= EMPTY_PASSES:
+            return True
+        self._unlabelled[key] = passes
+        while len(self._unlabelled) > self.max_objects:
+            self._unlabelled.popitem(last=False)
+        return False
+
+    @staticmethod
+    def _read(obj_meta) -> Tuple[Label, ...]:
+        """:returns: every label the sies attached to |obj_meta|"""
+        labels = []  # type: List[Label]
+        for classifier_meta in classifier_meta_iterator(
+                obj_meta.classifier_meta_list):
+            for label_info in label_info_iterator(
+                    classifier_meta.label_info_list):
+                labels.append(Label(
+                    classifier_meta.unique_component_id,
+                    label_info.label_id, label_info.result_class_id,
+                    label_info.result_prob, label_info.result_label))
+        return tuple(labels)
+
+    @staticmethod
+    def _attach(batch_meta, obj_meta, labels: Tuple[Label, ...]):
+        """attach |labels| to |obj_meta| as the sies would have"""
+        by_component = collections.OrderedDict(
+        )  # type: collections.OrderedDict[int, List[Label]]
+        for label in labels:
+            by_component.setdefault(label.component_id, []).append(label)
+        for component_id, component_labels in by_component.items():
+            classifier_meta = pyds.nvds_acquire_classifier_meta_from_pool(
+                batch_meta)
+            classifier_meta.unique_component_id = component_id
+            classifier_meta.num_labels = len(component_labels)
+            for label in component_labels:
+                label_info = pyds.nvds_acquire_label_info_meta_from_pool(
+                    batch_meta)
+                label_info.label_id = label.label_id
+                label_info.result_class_id = label.class_id
+                label_info.result_prob = label.probability
+                # a fixed size array in NvDsLabelInfo, so nothing to free
+                label_info.result_label = label.label
+                pyds.nvds_add_label_info_meta_to_classifier(
+                    classifier_meta, label_info)
+            pyds.nvds_add_classifier_meta_to_object(obj_meta, classifier_meta)
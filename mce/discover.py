@@ -0,0 +1,219 @@
+"""
+Probe sources before building a pipeline, so the batch geometry can be
+planned from what the sources actually are, not just how many there are.
+Executed with:
+
+python3 -m mce.discover URI_OR_FILE [URI_OR_FILE ...]
+
+it prints what was found for each source and the resulting plan.
+"""
+
+# Copyright (c) 2020 Michael de Gans
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import collections
+import concurrent.futures
+import json
+import logging
+import os
+import threading
+
+import gi
+gi.require_version('Gst', '1.0')
+gi.require_version('GLib', '2.0')
+gi.require_version('GstPbutils', '1.0')
+from gi.repository import (
+    GLib,
+    Gst,
+    GstPbutils,
+)
+
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    Optional,
+    Sequence,
+)
+
+logger = logging.getLogger(__name__)
+
+__all__ = [
+    'DEFAULT_TIMEOUT',
+    'SourceInfo',
+    'clear_cache',
+    'plan',
+    'probe',
+    'probe_all',
+]
+
+# seconds to wait for any one source
+DEFAULT_TIMEOUT = 5.0
+# sources probed at once
+DEFAULT_WORKERS = 8
+
+SourceInfo = collections.namedtuple(
+    'SourceInfo',
+    ('uri', 'width', 'height', 'fps', 'codec', 'live', 'duration'))
+SourceInfo.__doc__ = """
+A NamedTuple class describing what was found probing a source.
+
+:arg uri: the uri probed
+:arg width: width of the first video stream
+:arg height: height of the first video stream
+:arg fps: frame rate of the first video stream (0.0 if variable or unknown)
+:arg codec: caps name of the first video stream (eg. "video/x-h264")
+:arg live: True if the source is live (eg. a camera)
+:arg duration: duration in seconds (0.0 if live or unknown)
+"""
+
+# uri -> SourceInfo, shared by every probe_all (only successes are cached)
+_cache = {}  # type: Dict[str, SourceInfo]
+_cache_lock = threading.Lock()
+
+
+def clear_cache():
+    """forget every cached SourceInfo (eg. if a camera's settings changed)"""
+    with _cache_lock:
+        _cache.clear()
+
+
+def probe(uri: str, timeout: float = DEFAULT_TIMEOUT) -> Optional[SourceInfo]:
+    """
+    Probe a single source with a GstPbutils.Discoverer. Blocks for up to
+    |timeout| seconds. Safe to call from any thread.
+
+    :returns: a SourceInfo or None if |uri| couldn't be probed or has no video
+    """
+    discoverer = GstPbutils.Discoverer.new(int(timeout * Gst.SECOND))
+    try:
+        info = discoverer.discover_uri(uri)  # type: GstPbutils.DiscovererInfo
+    except GLib.Error as err:
+        logger.warning(f"could not probe {uri}: {err.message}")
+        return None
+    streams = info.get_video_streams()
+    if not streams:
+        logger.warning(f"no video found probing {uri}")
+        return None
+    video = streams[0]  # type: GstPbutils.DiscovererVideoInfo
+    denom = video.get_framerate_denom()
+    caps = video.get_caps()
+    live = info.get_live()
+    return SourceInfo(
+        uri=uri,
+        width=video.get_width(),
+        height=video.get_height(),
+        fps=video.get_framerate_num() / denom if denom else 0.0,
+        codec=caps.get_structure(0).get_name() if caps else None,
+        live=live,
+        duration=0.0 if live else info.get_duration() / Gst.SECOND,
+    )
+
+
+def probe_all(uris: Iterable[str], timeout: float = DEFAULT_TIMEOUT,
+              workers: int = DEFAULT_WORKERS, use_cache: bool = True,
+              ) -> Dict[str, Optional[SourceInfo]]:
+    """
+    Probe every uri concurrently, so a slow (or dead) source only costs
+    |timeout| once, not once per source.
+
+    :returns: a dict of uri to SourceInfo (or None, if probing failed)
+
+    :arg uris: the uris to probe
+    :param timeout: seconds to wait for each source
+    :param workers: the most sources to probe at once
+    :param use_cache: reuse (and store) results for uris already probed
+    """
+    uris = list(uris)
+    results = {}  # type: Dict[str, Optional[SourceInfo]]
+    if use_cache:
+        with _cache_lock:
+            results.update((u, _cache[u]) for u in uris if u in _cache)
+    todo = [u for u in dict.fromkeys(uris) if u not in results]
+    if todo:
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=min(workers, len(todo))) as pool:
+            for uri, info in zip(todo, pool.map(
+                    lambda u: probe(u, timeout), todo)):
+                results[uri] = info
+                logger.debug(f"probed {uri}: {info}")
+        if use_cache:
+            with _cache_lock:
+                _cache.update((u, i) for u, i in results.items() if i)
+    return results
+
+
+def plan(infos: Sequence[Optional[SourceInfo]],
+         rois: Sequence[Optional[Any]] = ()) -> Dict[str, Any]:
+    """
+    Plan make_inference_description keyword arguments from probe results.
+    Sources that couldn't be probed are simply left out of the plan.
+
+    :returns: a dict with 'source_sizes' and 'source_fps' (for the muxer
+              resolution, tiler layout and batched-push-timeout) and 'live'
+              (if any source is live)
+
+    :arg infos: a SourceInfo (or None) for each source, in order
+    :param rois: an optional mce.geometry.Roi for each source, in order. A
+           cropped source is planned at it's roi's size.
+    """
+    rois = list(rois) + [None] * (len(infos) - len(rois))
+    sizes = []
+    fps = []
+    for info, roi in zip(infos, rois):
+        if info is None:
+            continue
+        if roi is not None:
+            sizes.append((roi.width, roi.height))
+        elif info.width and info.height:
+            sizes.append((info.width, info.height))
+        if info.fps:
+            fps.append(info.fps)
+    return {
+        'source_sizes': sizes,
+        'source_fps': fps,
+        'live': any(info.live for info in infos if info),
+    }
+
+
+def cli_main(args: Iterable[str] = None):
+    """Parse command line arguments, probe sources and print the results."""
+    import argparse
+    ap = argparse.ArgumentParser(
+        description="Probe Mechanical Compound Eye sources",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    ap.add_argument('sources', help="urls or file sources", nargs='+')
+    ap.add_argument('--timeout', help='seconds to wait for each source',
+                    type=float, default=DEFAULT_TIMEOUT)
+    args = ap.parse_args(args=args)
+    logging.basicConfig(level=logging.INFO)
+    Gst.init(None)
+    uris = [Gst.filename_to_uri(os.path.abspath(s)) if os.path.isfile(s)
+            else s for s in args.sources]
+    infos = probe_all(uris, args.timeout)
+    print(json.dumps({
+        'sources': {u: i._asdict() if i else None for u, i in infos.items()},
+        'plan': plan([infos[u] for u in uris]),
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    cli_main()
@@ -25,7 +25,6 @@
 # server for the osd stuff rather than displaying it locally
 ################################################################################
 import sys
-import math
 import socket
 
 # noinspection PyPackageRequirements
@@ -39,6 +38,7 @@ from gi.repository import (
     GstRtspServer,
 )
 
+import mce.geometry
 from mce import is_jetson as is_aarch64
 from mce.bus import on_message as bus_call
 from mce.osd import on_buffer as osd_sink_pad_buffer_probe
@@ -238,8 +238,8 @@ def main(args):
         print("WARNING: Overriding infer-config batch-size", pgie_batch_size,
               " with number of sources ", number_sources)
         pgie.set_property("batch-size", number_sources)
-    tiler_rows = int(math.sqrt(number_sources))
-    tiler_columns = int(math.ceil((1.0 * number_sources) / tiler_rows))
+    tiler_rows, tiler_columns = mce.geometry.plan_layout(
+        number_sources, (TILED_OUTPUT_WIDTH, TILED_OUTPUT_HEIGHT))
     tiler.set_property("rows", tiler_rows)
     tiler.set_property("columns", tiler_columns)
     tiler.set_property("width", TILED_OUTPUT_WIDTH)
@@ -308,8 +308,8 @@ def main(args):
     print("Starting pipeline")
     # start play back and listed to events
     pipeline.set_state(Gst.State.PLAYING)
-    import mce.pipeline
-    mce.pipeline.bin_to_pdf(pipeline, Gst.DebugGraphDetails.ALL, 'dstest1')
+    from mce import pipeline as mce_pipeline
+    mce_pipeline.bin_to_pdf(pipeline, Gst.DebugGraphDetails.ALL, 'dstest1')
     try:
         loop.run()
     except KeyboardInterrupt:
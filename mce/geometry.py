@@ -0,0 +1,325 @@
+"""
+Pure functions planning the geometry of a pipeline: what resolution to batch
+sources at, given what the network actually consumes, how to lay out
+sources on the tiler, and how to map boxes back to source coordinates.
+
+Nothing in here touches Gst or pyds, so the functions are easy to test.
+"""
+
+# Copyright (c) 2020 Michael de Gans
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import collections
+import configparser
+import logging
+import os
+import re
+
+from typing import (
+    Dict,
+    Iterable,
+    Optional,
+    Tuple,
+)
+
+logger = logging.getLogger(__name__)
+
+__all__ = [
+    'DEFAULT_NETWORK_SIZE',
+    'Roi',
+    'align',
+    'frame_transform',
+    'network_size',
+    'parse_dims',
+    'parse_roi',
+    'pixel_rates',
+    'plan_layout',
+    'plan_muxer',
+    'read_proto_dims',
+    'unletterbox',
+    'untile',
+]
+
+# a (width, height) Tuple
+Size = Tuple[int, int]
+# a (left, top, width, height) Tuple
+Rect = Tuple[float, float, float, float]
+
+Roi = collections.namedtuple('Roi', ('left', 'top', 'width', 'height'))
+Roi.__doc__ = """
+A NamedTuple describing a region of interest of a source, in pixels.
+
+:arg left: x of the top left corner
+:arg top: y of the top left corner
+:arg width: width of the region
+:arg height: height of the region
+"""
+
+# input size of resnet10 from the DeepStream samples (used by pie.conf)
+DEFAULT_NETWORK_SIZE = (640, 368)  # type: Size
+
+# aspect ratio assumed for sources of unknown size
+DEFAULT_ASPECT = 16 / 9
+
+# nvinfer config keys with network input dimensions as "C;H;W[;order]"
+DIMS_KEYS = ('infer-dims', 'uff-input-dims', 'input-dims')
+
+_PROTO_DIM = re.compile(r'(?:input_)?dim\s*:\s*(\d+)')
+
+
+def parse_dims(value: str) -> Optional[Size]:
+    """
+    :returns: (width, height) from an nvinfer "C;H;W[;order]" dims value, or
+              None if it can't be parsed
+
+    :arg value: eg. "3;368;640;0"
+    """
+    try:
+        _, height, width = (int(v) for v in value.split(';')[:3])
+    except ValueError:
+        return None
+    return width, height
+
+
+def read_proto_dims(proto_file: str) -> Optional[Size]:
+    """
+    :returns: (width, height) of the input layer of a caffe .prototxt, or
+              None if not found
+
+    :arg proto_file: path to the .prototxt
+    """
+    with open(proto_file) as f:
+        dims = [int(d) for d in _PROTO_DIM.findall(f.read())[:4]]
+    if len(dims) < 4:
+        return None
+    return dims[3], dims[2]  # N, C, H, W
+
+
+def network_size(pie_config: str) -> Size:
+    """
+    :returns: the network input (width, height) for an nvinfer config file,
+              from the dims keys or the caffe proto-file it references, or
+              DEFAULT_NETWORK_SIZE if neither can be read
+
+    :arg pie_config: path to an nvinfer config file (eg. ~/.mce/pie.conf)
+    """
+    parser = configparser.ConfigParser()
+    try:
+        parser.read(pie_config)
+        section = parser['property']
+    except (configparser.Error, KeyError):
+        logger.warning(
+            f"could not read {pie_config}. assuming a network input size of "
+            f"{DEFAULT_NETWORK_SIZE}")
+        return DEFAULT_NETWORK_SIZE
+    for key in DIMS_KEYS:
+        if key in section:
+            size = parse_dims(section[key])
+            if size:
+                return size
+    if 'proto-file' in section:
+        proto_file = os.path.join(
+            os.path.dirname(os.path.abspath(pie_config)),
+            section['proto-file'])
+        try:
+            size = read_proto_dims(proto_file)
+        except OSError:
+            size = None
+        if size:
+            return size
+    logger.warning(
+        f"network input size not found in {pie_config}. assuming "
+        f"{DEFAULT_NETWORK_SIZE}")
+    return DEFAULT_NETWORK_SIZE
+
+
+def align(value: float, alignment: int = 4) -> int:
+    """:returns: |value| rounded to the nearest multiple of |alignment|"""
+    return max(alignment, int(round(value / alignment)) * alignment)
+
+
+def plan_muxer(network: Size,
+               sources: Iterable[Size] = (),
+               oversample: float = 1.0,
+               alignment: int = 4,
+               ) -> Size:
+    """
+    Plan the nvstreammux output resolution. Every frame is scaled to this and
+    then scaled again, by nvinfer, to the network input size, so anything
+    bigger than the network is (mostly) wasted bandwidth and anything smaller
+    throws away detail the detector could have used.
+
+    :returns: the network size times |oversample|, shrunk (keeping the
+              network's aspect ratio) so it's no bigger than the largest
+              source, if source sizes are known.
+
+    :arg network: the network input (width, height)
+    :param sources: known (width, height) of the sources
+    :param oversample: how much bigger than the network to batch at (eg. 2.0
+           if the tiler output should keep more detail than the network needs)
+    :param alignment: round width and height to a multiple of this
+    """
+    width, height = network[0] * oversample, network[1] * oversample
+    sources = list(sources)
+    if sources:
+        largest_w = max(w for w, _ in sources)
+        largest_h = max(h for _, h in sources)
+        scale = min(1.0, largest_w / width, largest_h / height)
+        width, height = width * scale, height * scale
+    return align(width, alignment), align(height, alignment)
+
+
+def pixel_rates(muxer: Size, network: Size, tiler: Optional[Size],
+                num_sources: int, fps: float = 30.0) -> Dict[str, int]:
+    """
+    :returns: pixels per second moved at each scaling stage (and in total) for
+              a configuration. Useful to compare configurations.
+
+    :arg muxer: the nvstreammux output (width, height)
+    :arg network: the network input (width, height)
+    :arg tiler: the tiler output (width, height) or None if headless
+    :arg num_sources: the number of sources (batch size)
+    :param fps: frames per second per source
+    """
+    rates = {
+        'muxer': int(muxer[0] * muxer[1] * num_sources * fps),
+        'network': int(network[0] * network[1] * num_sources * fps),
+        # the tiler composites one frame from the whole batch
+        'tiler': int(tiler[0] * tiler[1] * fps) if tiler else 0,
+    }
+    rates['total'] = sum(rates.values())
+    return rates
+
+
+def tile_area(cell: Tuple[float, float], aspect: float) -> float:
+    """
+    :returns: the visible area of a source with |aspect| ratio fit (letter or
+              pillar boxed) into a |cell| (width, height)
+    """
+    width = min(cell[0], cell[1] * aspect)
+    return width * (width / aspect)
+
+
+def plan_layout(num_sources: int,
+                out_size: Size,
+                sources: Iterable[Size] = (),
+                ) -> Tuple[int, int]:
+    """
+    Plan the nvmultistreamtiler grid. Every (rows, columns) grid with room
+    for |num_sources| is tried and the one showing the most source pixels on
+    screen wins. Ties go to the grid with the fewest empty tiles, then the
+    fewest rows. For example, 5 sources on a 16:9 output get 2x3, not 3x3 with
+    4 empty tiles.
+
+    :returns: (rows, columns)
+
+    :arg num_sources: the number of sources to tile
+    :arg out_size: the tiler output (width, height)
+    :param sources: known (width, height) of the sources. Sources of unknown
+           size are assumed to be DEFAULT_ASPECT (16:9).
+    """
+    if num_sources < 1:
+        return 1, 1
+    aspects = [w / h for w, h in sources if w and h]
+    aspects += [DEFAULT_ASPECT] * max(0, num_sources - len(aspects))
+    best, best_score = (1, num_sources), None
+    for columns in range(1, num_sources + 1):
+        rows = -(-num_sources // columns)  # ceil
+        cell = (out_size[0] / columns, out_size[1] / rows)
+        area = sum(tile_area(cell, aspect) for aspect in aspects)
+        # prefer more area, then fewer empty tiles, then fewer rows
+        score = (round(area), -(rows * columns - num_sources), -rows)
+        if best_score is None or score > best_score:
+            best, best_score = (rows, columns), score
+    return best
+
+
+def parse_roi(value: str) -> Roi:
+    """
+    :returns: a Roi from a "LEFT,TOP,WIDTH,HEIGHT" string (eg. "0,540,960,540")
+    """
+    left, top, width, height = (int(v) for v in value.split(','))
+    if width <= 0 or height <= 0 or left < 0 or top < 0:
+        raise ValueError(f'invalid roi: {value}')
+    return Roi(left, top, width, height)
+
+
+def untile(rect: Rect, index: int, rows: int, columns: int,
+           out_size: Size, muxer: Size) -> Rect:
+    """
+    Undo nvmultistreamtiler's scaling of a box.
+
+    :returns: |rect| in muxer coordinates
+
+    :arg rect: (left, top, width, height) in tiler output coordinates
+    :arg index: the source's tile (its muxer pad index)
+    :arg rows: the tiler's rows
+    :arg columns: the tiler's columns
+    :arg out_size: the tiler output (width, height)
+    :arg muxer: the nvstreammux output (width, height)
+    """
+    tile_w, tile_h = out_size[0] / columns, out_size[1] / rows
+    row, column = divmod(index, columns)
+    sx, sy = muxer[0] / tile_w, muxer[1] / tile_h
+    return ((rect[0] - column * tile_w) * sx, (rect[1] - row * tile_h) * sy,
+            rect[2] * sx, rect[3] * sy)
+
+
+def unletterbox(rect: Rect, content: Size, muxer: Size,
+                offset: Tuple[int, int] = (0, 0)) -> Rect:
+    """
+    Undo nvstreammux's (enable-padding) scaling of a box. The content is
+    assumed to be scaled, keeping it's aspect ratio, into the top left of the
+    muxer's output.
+
+    :returns: |rect| in content coordinates, plus |offset|
+
+    :arg rect: (left, top, width, height) in muxer coordinates
+    :arg content: the (width, height) of what was scaled into the muxer (the
+         ROI if cropped, otherwise the whole source)
+    :arg muxer: the nvstreammux output (width, height)
+    :param offset: added to the result (eg. the ROI's left and top)
+    """
+    scale = min(muxer[0] / content[0], muxer[1] / content[1])
+    return (rect[0] / scale + offset[0], rect[1] / scale + offset[1],
+            rect[2] / scale, rect[3] / scale)
+
+
+def frame_transform(index: int, content: Size, muxer: Size,
+                    offset: Tuple[int, int] = (0, 0),
+                    grid: Optional[Tuple[int, int, Size]] = None) -> Rect:
+    """
+    The combined :func:`untile` and :func:`unletterbox` of a source, as one
+    scale and offset per axis, so a whole batch of boxes (as arrays) can be
+    mapped to full frame pixels at once: x * x_scale + x_offset.
+
+    :returns: (x_offset, y_offset, x_scale, y_scale)
+
+    :arg index: the source's tile (its muxer pad index)
+    :arg content: see :func:`unletterbox`
+    :arg muxer: the nvstreammux output (width, height)
+    :param offset: see :func:`unletterbox`
+    :param grid: the tiler's (rows, columns, (width, height)), if boxes are
+           in tiler output coordinates
+    """
+    rect = (0.0, 0.0, 1.0, 1.0)
+    if grid is not None:
+        rect = untile(rect, index, grid[0], grid[1], grid[2], muxer)
+    return unletterbox(rect, content, muxer, offset)
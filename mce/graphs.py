@@ -0,0 +1,256 @@
+"""
+Pipeline graph dumping.
+
+Graphs are off by default. :func:`configure` turns them on for some events:
+
+* INIT: every GhostBin, once built
+* STATE: a pipeline, before and after every state change
+* APP: a DeepStreamApp, once entered and when exited
+
+A graph is rendered on the calling thread (Gst.debug_bin_to_dot_data is
+quick), but it's written, and converted with graphviz's dot, by a single
+background worker, so a burst of events never spawns a burst of processes.
+A graph identical to the last one dumped for the same bin is skipped, and
+once the file count or total size cap is reached, dumping stops (with a
+warning).
+"""
+
+# Copyright (c) 2020 Michael de Gans
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import hashlib
+import logging
+import os
+import queue
+import shutil
+import subprocess
+import threading
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+
+from typing import (
+    Dict,
+    Iterable,
+    Optional,
+    Tuple,
+)
+
+logger = logging.getLogger(__name__)
+
+__all__ = [
+    'APP',
+    'EVENTS',
+    'GraphDumper',
+    'INIT',
+    'STATE',
+    'configure',
+    'dump',
+    'dump_event',
+    'flush',
+]
+
+INIT = 'init'
+STATE = 'state'
+APP = 'app'
+EVENTS = (INIT, STATE, APP)
+
+DEFAULT_MAX_FILES = 100
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+# the graphviz output format (or None for .dot files only)
+DEFAULT_FORMAT = 'pdf'
+
+# the dumper configured (or None, if graphs are off)
+_dumper = None  # type: Optional[GraphDumper]
+
+
+class GraphDumper(object):
+    """
+    Writes pipeline graphs to |directory| from a background thread.
+
+    :arg directory: where to write graphs
+    :param events: the events to dump graphs for (see :func:`dump_event`)
+    :param max_files: the most files to write (.dot and converted)
+    :param max_bytes: the most bytes to write
+    :param format_: the format to convert to with dot (eg. 'pdf', 'svg') or
+           None to only write .dot files
+    """
+
+    def __init__(self, directory: str, events: Iterable[str] = EVENTS,
+                 max_files: int = DEFAULT_MAX_FILES,
+                 max_bytes: int = DEFAULT_MAX_BYTES,
+                 format_: Optional[str] = DEFAULT_FORMAT):
+        self.directory = directory
+        self.events = frozenset(events)
+        unknown = self.events.difference(EVENTS)
+        if unknown:
+            raise ValueError(f"unknown graph events: {','.join(unknown)}")
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self.format = format_
+        self.files = 0
+        self.bytes = 0
+        self.skipped = 0
+        self._dot = shutil.which('dot') if format_ else None
+        if format_ and not self._dot:
+            logger.warning(
+                f'graphviz does not appear to be installed, so graphs will '
+                f'only be written as .dot. You can install graphviz with '
+                f'"sudo apt install graphviz" on Linux for Tegra or Ubuntu.')
+        # bin name -> digest of the last graph dumped
+        self._last = {}  # type: Dict[str, bytes]
+        self._lock = threading.Lock()
+        self._capped = False
+        self._queue = queue.Queue()  # type: queue.Queue[Optional[Tuple[str, str]]]
+        self._worker = threading.Thread(
+            target=self._run, name='mce-graphs', daemon=True)
+        self._worker.start()
+
+    def dump(self, bin_: Gst.Bin, filename: str,
+             details: Gst.DebugGraphDetails = Gst.DebugGraphDetails.ALL,
+             ) -> Optional[str]:
+        """
+        Queue a graph of |bin_| to be written as |filename| (with no
+        extension) and converted.
+
+        :returns: the path that will be written (the converted file if
+                  graphviz is installed) or None if skipped
+        """
+        data = Gst.debug_bin_to_dot_data(bin_, details)
+        digest = hashlib.sha1(data.encode()).digest()
+        with self._lock:
+            if self._last.get(bin_.name) == digest:
+                self.skipped += 1
+                logger.debug("graph of %s unchanged, skipping %s",
+                             bin_.name, filename)
+                return None
+            if (self.files >= self.max_files
+                    or self.bytes + len(data) > self.max_bytes):
+                if not self._capped:
+                    self._capped = True
+                    logger.warning(
+                        f"graph cap reached ({self.files} files, "
+                        f"{self.bytes} bytes). no more graphs will be "
+                        f"written to {self.directory}")
+                self.skipped += 1
+                return None
+            self._last[bin_.name] = digest
+            self.files += 1
+            self.bytes += len(data)
+        dot_file = os.path.join(self.directory, f'{filename}.dot')
+        self._queue.put((dot_file, data))
+        if self._dot:
+            return f'{os.path.splitext(dot_file)[0]}.{self.format}'
+        return dot_file
+
+    def flush(self):
+        """wait for every queued graph to be written and converted"""
+        self._queue.join()
+
+    def close(self):
+        """flush, then stop the worker"""
+        self.flush()
+        self._queue.put(None)
+        self._worker.join()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                self._write(*item)
+            except Exception:
+                logger.exception("could not write graph")
+            finally:
+                self._queue.task_done()
+
+    def _write(self, dot_file: str, data: str):
+        logger.debug("writing %s", dot_file)
+        with open(dot_file, 'w') as f:
+            f.write(data)
+        if not self._dot:
+            return
+        out_file = f'{os.path.splitext(dot_file)[0]}.{self.format}'
+        # one at a time, so never more than one dot process
+        subprocess.run(
+            (self._dot, f'-T{self.format}', dot_file, f'-o{out_file}'),
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        if os.path.exists(out_file):
+            with self._lock:
+                self.files += 1
+                self.bytes += os.path.getsize(out_file)
+
+
+def configure(directory: str, events: Iterable[str] = EVENTS,
+              **kwargs) -> GraphDumper:
+    """
+    Turn graph dumping on (replacing any previous configuration).
+
+    :arg directory: where to write graphs
+    :param events: the events to dump graphs for
+    :param kwargs: passed to GraphDumper
+
+    :returns: the GraphDumper
+    """
+    global _dumper
+    if _dumper is not None:
+        _dumper.close()
+    os.makedirs(directory, exist_ok=True)
+    _dumper = GraphDumper(directory, events, **kwargs)
+    return _dumper
+
+
+def dump_event(event: str, bin_: Gst.Bin, filename: str) -> Optional[str]:
+    """
+    Dump a graph of |bin_| if graphs are on for |event|.
+
+    :returns: the path that will be written, or None
+    """
+    if _dumper is None or event not in _dumper.events:
+        return None
+    return _dumper.dump(bin_, filename)
+
+
+def dump(bin_: Gst.Bin, filename: str,
+         details: Gst.DebugGraphDetails = Gst.DebugGraphDetails.ALL,
+         ) -> Optional[str]:
+    """
+    Dump a graph of |bin_|, whatever the events configured. If graphs were
+    never configured, but GST_DEBUG_DUMP_DOT_DIR is set, they're configured
+    for no events, in that directory.
+
+    :returns: the path that will be written, or None
+    """
+    if _dumper is None:
+        directory = os.environ.get('GST_DEBUG_DUMP_DOT_DIR')
+        if not directory:
+            return None
+        configure(directory, events=())
+    return _dumper.dump(bin_, filename, details)
+
+
+def flush():
+    """wait for every queued graph to be written (if graphs are on)"""
+    if _dumper is not None:
+        _dumper.flush()
@@ -0,0 +1,255 @@
+"""
+GStreamer tracer integration.
+
+:func:`enable` turns on GStreamer's latency and stats tracers (it must be
+called before Gst.init), sending their records to a log file. When the run
+ends, :func:`summarize` reads the log, one line at a time, into a per element
+latency and buffer rate summary. mce --trace does both, writing the summary
+as JSON next to the pipeline graphs (in ~/.mce). The parsing doesn't need
+Gst at all, and a CPU-only pipeline can be traced with:
+
+python3 -m mce.gsttrace [--pipeline "videotestsrc num-buffers=300 ! fakesink"]
+"""
+
+# Copyright (c) 2020 Michael de Gans
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import json
+import logging
+import os
+import re
+import time
+
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    Optional,
+    Tuple,
+)
+
+logger = logging.getLogger(__name__)
+
+__all__ = [
+    'DEFAULT_TRACERS',
+    'LatencyStats',
+    'enable',
+    'parse_record',
+    'summarize',
+    'summarize_file',
+]
+
+# element latency (time a buffer spends in each element), source to sink
+# latency and, from stats, every buffer pushed (and the element names)
+DEFAULT_TRACERS = 'latency(flags=pipeline+element);stats'
+# the default --pipeline for cli_main
+TEST_PIPELINE = 'videotestsrc num-buffers=300 ! videoconvert ! fakesink sync=0'
+
+# the message of a tracer record, after the debug log prefix
+_RECORD = re.compile(r'GST_TRACER :\d+:\S*:?\s*(.*)$')
+# "name=(type)value", where value may be a quoted string
+_FIELD = re.compile(r'([\w-]+)=\(([\w]+)\)("(?:[^"\\]|\\.)*"|[^,;]*)')
+_INTEGERS = ('int', 'uint', 'gint', 'guint', 'gint64', 'guint64', 'i', 'u')
+
+
+def enable(log_dir: str, tracers: str = DEFAULT_TRACERS) -> str:
+    """
+    Turn on GStreamer tracers by setting the environment. Must be called
+    before Gst.init. All GStreamer debug output (not just the tracers') goes
+    to the log file.
+
+    :arg log_dir: a directory for the log
+    :param tracers: GST_TRACERS
+
+    :returns: the path of the log file
+    """
+    path = os.path.join(log_dir, f'gst-trace-{int(time.time())}.log')
+    os.environ['GST_TRACERS'] = tracers
+    debug = os.environ.get('GST_DEBUG')
+    os.environ['GST_DEBUG'] = f'{debug},GST_TRACER:7' if debug \
+        else 'GST_TRACER:7'
+    os.environ['GST_DEBUG_FILE'] = path
+    os.environ['GST_DEBUG_NO_COLOR'] = '1'
+    logger.info(f"tracing with {tracers} to {path}")
+    return path
+
+
+def parse_record(line: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+    """
+    Parse a line of tracer output.
+
+    :returns: the record's name (eg. "element-latency") and fields, or None
+              if |line| isn't a tracer record
+    """
+    if 'GST_TRACER' not in line:
+        return None
+    match = _RECORD.search(line)
+    if match is None:
+        return None
+    message = match.group(1)
+    name, _, rest = message.partition(',')
+    fields = {}
+    for key, type_, value in _FIELD.findall(rest):
+        if value.startswith('"'):
+            value = value[1:-1].replace('\\"', '"')
+        elif type_ in _INTEGERS:
+            try:
+                value = int(value, 0)
+            except ValueError:
+                pass
+        fields[key] = value
+    return name.strip(), fields
+
+
+class LatencyStats(object):
+    """running count, mean, min and max of latencies in nanoseconds"""
+
+    __slots__ = ('count', 'total', 'min', 'max')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.min = None  # type: Optional[int]
+        self.max = None  # type: Optional[int]
+
+    def add(self, value: int):
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def as_dict(self) -> Dict[str, Any]:
+        """:returns: count and mean, min and max in milliseconds"""
+        return {
+            'count': self.count,
+            'mean_ms': self.total / self.count / 1e6 if self.count else None,
+            'min_ms': self.min / 1e6 if self.min is not None else None,
+            'max_ms': self.max / 1e6 if self.max is not None else None,
+        }
+
+
+def summarize(lines: Iterable[str]) -> Dict[str, Any]:
+    """
+    Summarize tracer output. Only running totals are kept, so a log of any
+    size can be summarized.
+
+    :arg lines: lines of tracer output (eg. an open log file)
+
+    :returns: a dict with 'elements' (name to 'latency' stats, 'buffers'
+              pushed and 'buffers_per_second'), 'paths' (source to sink
+              latency, by "source:pad->sink:pad") and 'duration' (seconds
+              between the first and last record)
+    """
+    names = {}  # type: Dict[int, str]
+    element_latency = {}  # type: Dict[str, LatencyStats]
+    path_latency = {}  # type: Dict[str, LatencyStats]
+    buffers = {}  # type: Dict[int, int]
+    first = last = None
+    for line in lines:
+        record = parse_record(line)
+        if record is None:
+            continue
+        name, fields = record
+        ts = fields.get('ts')
+        if isinstance(ts, int):
+            if first is None:
+                first = ts
+            last = ts
+        if name == 'element-latency':
+            element_latency.setdefault(
+                fields.get('element'), LatencyStats()).add(fields['time'])
+        elif name == 'latency':
+            path = (f"{fields.get('src-element')}:{fields.get('src')}->"
+                    f"{fields.get('sink-element')}:{fields.get('sink')}")
+            path_latency.setdefault(path, LatencyStats()).add(fields['time'])
+        elif name == 'new-element':
+            names[fields.get('ix')] = fields.get('name')
+        elif name == 'buffer':
+            ix = fields.get('element-ix')
+            buffers[ix] = buffers.get(ix, 0) + 1
+    duration = (last - first) / 1e9 if first is not None else 0.0
+    elements = {}  # type: Dict[str, Dict[str, Any]]
+    for name, stats in element_latency.items():
+        elements.setdefault(name, {})['latency'] = stats.as_dict()
+    for ix, count in buffers.items():
+        element = elements.setdefault(names.get(ix, f'element-{ix}'), {})
+        element['buffers'] = count
+        element['buffers_per_second'] = count / duration if duration else None
+    return {
+        'duration': duration,
+        'elements': elements,
+        'paths': {k: v.as_dict() for k, v in path_latency.items()},
+    }
+
+
+def summarize_file(log: str, summary: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Summarize a tracer log (see :func:`enable`) and write it as JSON.
+
+    :arg log: the log file
+    :param summary: where to write (default: |log| with a .json extension)
+
+    :returns: the summary
+    """
+    with open(log, errors='replace') as f:
+        result = summarize(f)
+    if summary is None:
+        summary = f'{os.path.splitext(log)[0]}.json'
+    with open(summary, 'w') as f:
+        json.dump(result, f, indent=2)
+    logger.info(f"wrote trace summary of {len(result['elements'])} elements "
+                f"to {summary}")
+    return result
+
+
+def cli_main(args: Iterable[str] = None):
+    """Trace a pipeline description (CPU-only by default) and summarize it."""
+    import argparse
+    import tempfile
+    ap = argparse.ArgumentParser(
+        description="Trace a GStreamer pipeline and summarize latency",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    ap.add_argument('--pipeline', help='a gst-launch pipeline description',
+                    default=TEST_PIPELINE)
+    ap.add_argument('--tracers', help='GST_TRACERS', default=DEFAULT_TRACERS)
+    ap.add_argument('--log-dir', help='where to write the log and summary '
+                                      '(default: a temporary directory)')
+    args = ap.parse_args(args=args)
+    logging.basicConfig(level=logging.INFO)
+    log_dir = args.log_dir or tempfile.mkdtemp(prefix='mce-trace-')
+    log = enable(log_dir, args.tracers)
+
+    import gi
+    gi.require_version('Gst', '1.0')
+    from gi.repository import Gst
+    Gst.init(None)
+    pipeline = Gst.parse_launch(args.pipeline)
+    pipeline.set_state(Gst.State.PLAYING)
+    pipeline.get_bus().timed_pop_filtered(
+        Gst.CLOCK_TIME_NONE, Gst.MessageType.EOS | Gst.MessageType.ERROR)
+    pipeline.set_state(Gst.State.NULL)
+    print(json.dumps(summarize_file(log), indent=2))
+
+
+if __name__ == '__main__':
+    cli_main()
@@ -37,18 +37,25 @@ from mce import pyds
 from typing import (
     Dict,
     Iterator,  # like Generator, but only yields (no send/ return)
+    Tuple,
 )
 
 __all__ = [
+    'Overlay',
+    'UNTRACKED_OBJECT_ID',
     'frame_meta_iterator',
     'obj_meta_iterator',
-    'on_buffer'
+    'on_buffer',
 ]
 
 VEHICLE = 0
 BICYCLE = 1
 PERSON = 2
 ROADSIGN = 3
+NUM_CLASSES = 4
+
+# NvDsObjectMeta.object_id of an object no tracker has seen
+UNTRACKED_OBJECT_ID = 0xFFFFFFFFFFFFFFFF
 
 
 # this iterator and the one below are identical, other than the type hints
@@ -70,62 +77,93 @@ def obj_meta_iterator(obj_meta_list: GLib.List
         obj_meta_list = obj_meta_list.next
 
 
+class Overlay(object):
+    """
+    A pad probe drawing per-source object counts with nvdsosd, built to run
+    24/7 without growing:
+
+    * the counts part of a source's text is only regenerated when it's
+      counts change (the frame number is prepended every frame)
+    * pyds allocates a C string for every display_text and font_name set.
+      It frees the old one itself when the field is set again, and display
+      metas are reused from a pool, so the strings are bounded by the pool
+      and the overlay must never free them (that would be a double free).
+    * the counters are reused rather than allocated per frame
+
+    The module level :func:`~on_buffer` uses a default Overlay.
+    """
+
+    # text position, size and colors. These are the same for every frame.
+    X_OFFSET = 10
+    Y_OFFSET = 12
+    FONT_NAME = "Serif"
+    FONT_SIZE = 10
+    FONT_COLOR = (1.0, 1.0, 1.0, 1.0)  # white
+    BG_COLOR = (0.0, 0.0, 0.0, 1.0)  # black
+
+    def __init__(self):
+        self._counts = [0] * NUM_CLASSES
+        # pad_index -> ((objects, vehicles, people), text)
+        self._texts = {}  # type: Dict[int, Tuple[Tuple[int, int, int], str]]
+        self.frames = 0
+        self.regenerated = 0
+
+    def on_buffer(self, pad: Gst.Pad, info: Gst.PadProbeInfo, _: None,
+                  ) -> Gst.PadProbeReturn:
+        """the probe callback"""
+        gst_buffer = info.get_buffer()
+        if not gst_buffer:
+            raise BufferError("Could not get Gst.Buffer")
+
+        counts = self._counts
+        # hash returns a pointer, apparently
+        batch_meta = pyds.gst_buffer_get_nvds_batch_meta(hash(gst_buffer))
+        for frame_meta in frame_meta_iterator(batch_meta.frame_meta_list):
+            for i in range(NUM_CLASSES):
+                counts[i] = 0
+            for obj_meta in obj_meta_iterator(frame_meta.obj_meta_list):
+                if obj_meta.class_id < NUM_CLASSES:
+                    counts[obj_meta.class_id] += 1
+
+            key = (frame_meta.num_obj_meta, counts[VEHICLE], counts[PERSON])
+            cached = self._texts.get(frame_meta.pad_index)
+            if cached is None or cached[0] != key:
+                cached = (key, f"Objects={key[0]} Vehicles={key[1]} "
+                               f"People={key[2]}")
+                self._texts[frame_meta.pad_index] = cached
+                self.regenerated += 1
+
+            # Acquiring a display meta object. The memory ownership remains in
+            # the C code so downstream plugins can still access it. Otherwise
+            # the garbage collector will claim it when this probe function
+            # exits.
+            display_meta = pyds.nvds_acquire_display_meta_from_pool(batch_meta)
+            display_meta.num_labels = 1
+            text_params = display_meta.text_params[0]
+
+            # pyds allocates a buffer for each of these strings, and frees
+            # the pooled meta's last one, so they're it's to free, not ours.
+            text_params.display_text = \
+                f"Frame={frame_meta.frame_num} {cached[1]}"
+            text_params.font_params.font_name = self.FONT_NAME
+
+            text_params.x_offset = self.X_OFFSET
+            text_params.y_offset = self.Y_OFFSET
+            text_params.font_params.font_size = self.FONT_SIZE
+            text_params.font_params.font_color.set(*self.FONT_COLOR)
+            text_params.set_bg_clr = 1
+            text_params.text_bg_clr.set(*self.BG_COLOR)
+            pyds.nvds_add_display_meta_to_frame(frame_meta, display_meta)
+            self.frames += 1
+
+        return Gst.PadProbeReturn.OK
+
+
+_overlay = Overlay()
+
+
 def on_buffer(pad: Gst.Pad, info: Gst.PadProbeInfo, _: None,
               ) -> Gst.PadProbeReturn:
+    """draw object counts on every frame (see Overlay)"""
+    return _overlay.on_buffer(pad, info, _)
 
-    gst_buffer = info.get_buffer()
-    if not gst_buffer:
-        raise BufferError("Could not get Gst.Buffer")
-
-    obj_counter = {
-        VEHICLE: 0,
-        PERSON: 0,
-        BICYCLE: 0,
-        ROADSIGN: 0,
-    }  # type: Dict[int, int]
-
-    # hash returns a pointer, apparently
-    batch_meta = pyds.gst_buffer_get_nvds_batch_meta(hash(gst_buffer))
-
-    # (mdegans) condensed this a bit from the original to be more pythonic
-    for frame_meta in frame_meta_iterator(batch_meta.frame_meta_list):
-        for obj_meta in obj_meta_iterator(frame_meta.obj_meta_list):
-            obj_counter[obj_meta.class_id] += 1
-
-        # Acquiring a display meta object. The memory ownership remains in
-        # the C code so downstream plugins can still access it. Otherwise
-        # the garbage collector will claim it when this probe function exits.
-        display_meta = pyds.nvds_acquire_display_meta_from_pool(batch_meta)
-        display_meta.num_labels = 1
-        py_nvosd_text_params = display_meta.text_params[0]
-
-        # Setting display text to be shown on screen
-        # Note that the pyds module allocates a buffer for the string, and the
-        # memory will not be claimed by the garbage collector.
-        # Reading the display_text field here will return the C address of the
-        # allocated string. Use pyds.get_string() to get the string content.
-        # (this is a setter, and reading from it will only return a pointer)
-        py_nvosd_text_params.display_text = \
-            f"Frame={frame_meta.frame_num} " \
-            f"Objects={frame_meta.num_obj_meta} " \
-            f"Vehicles={obj_counter[VEHICLE]} " \
-            f"People={obj_counter[PERSON]}"
-
-        # Now set the offsets where the string should appear
-        py_nvosd_text_params.x_offset = 10
-        py_nvosd_text_params.y_offset = 12
-
-        # Font , font-color and font-size
-        py_nvosd_text_params.font_params.font_name = "Serif"
-        py_nvosd_text_params.font_params.font_size = 10
-        # set(red, green, blue, alpha); set to White
-        py_nvosd_text_params.font_params.font_color.set(1.0, 1.0, 1.0, 1.0)
-
-        # Text background color
-        py_nvosd_text_params.set_bg_clr = 1
-        # set(red, green, blue, alpha); set to Black
-        py_nvosd_text_params.text_bg_clr.set(0.0, 0.0, 0.0, 1.0)
-        # Using pyds.get_string() to get display_text as string
-        pyds.nvds_add_display_meta_to_frame(frame_meta, display_meta)
-
-    return Gst.PadProbeReturn.OK
@@ -0,0 +1,321 @@
+"""
+An overload controller for a DeepStreamApp.
+
+Every tick, the controller compares end-to-end latency (from the stream muxer
+to the metadata probes) and the fill of the inference queues against targets.
+While overloaded, it sheds load one rung at a time, in a configured order:
+
+* DISPLAY: lower the display output's frame rate
+* INTERVAL: raise nvinfer's interval (batches skipped between inferences)
+* SOURCES: lower the frame rate of low priority sources
+
+When there's headroom again (for a few ticks in a row, so it doesn't
+oscillate) quality is restored, one rung at a time, in reverse. Every
+decision is logged with the metrics that led to it.
+"""
+
+# Copyright (c) 2020 Michael de Gans
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import collections
+import logging
+import time
+
+import gi
+gi.require_version('Gst', '1.0')
+gi.require_version('GLib', '2.0')
+from gi.repository import (
+    GLib,
+    Gst,
+)
+
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+import mce.osd
+from mce import pyds
+
+logger = logging.getLogger(__name__)
+
+__all__ = [
+    'ACTIONS',
+    'DEFAULT_STEPS',
+    'DISPLAY',
+    'INTERVAL',
+    'Metrics',
+    'OverloadController',
+    'SOURCES',
+    'decide',
+    'effective',
+    'make_ladder',
+]
+
+DISPLAY = 'display'
+INTERVAL = 'interval'
+SOURCES = 'sources'
+ACTIONS = (DISPLAY, INTERVAL, SOURCES)
+
+# the values each action steps through, from least to most load shed
+DEFAULT_STEPS = {
+    DISPLAY: (15, 5),  # display fps
+    INTERVAL: (1, 2, 4),  # nvinfer interval
+    SOURCES: (10, 5, 1),  # low priority source fps
+}  # type: Dict[str, Tuple[float, ...]]
+
+# the display output's videorate (see make_output_description)
+DISPLAY_RATE = 'display_rate'
+
+Metrics = collections.namedtuple('Metrics', ('latency', 'queue_fill'))
+Metrics.__doc__ = """
+A NamedTuple class describing the load measured over a tick.
+
+:arg latency: worst stream muxer to probe latency in seconds (or None if no
+     batches were seen)
+:arg queue_fill: the fullest inference queue's fill (0.0 to 1.0)
+"""
+
+# a (action, value) step
+Rung = Tuple[str, float]
+
+
+def make_ladder(order: Iterable[str] = ACTIONS,
+                steps: Mapping[str, Sequence[float]] = None) -> List[Rung]:
+    """
+    :returns: every (action, value) rung, in the order load is shed
+
+    :param order: the actions, in the order to use them
+    :param steps: the values for each action (default: DEFAULT_STEPS)
+    """
+    steps = DEFAULT_STEPS if steps is None else steps
+    ladder = []
+    for action in order:
+        if action not in ACTIONS:
+            raise ValueError(f"unknown overload action: {action}")
+        ladder.extend((action, value) for value in steps[action])
+    return ladder
+
+
+def effective(ladder: Sequence[Rung], level: int) -> Dict[str, float]:
+    """
+    :returns: the value of each action at |level| (the first |level| rungs
+              applied). Actions not yet used are absent.
+    """
+    values = {}
+    for action, value in ladder[:level]:
+        values[action] = value
+    return values
+
+
+def decide(metrics: Metrics, level: int, top: int, calm: int,
+           target_latency: float, max_queue_fill: float,
+           restore_ratio: float = 0.5, hold: int = 3) -> Tuple[int, int, str]:
+    """
+    Decide the next level. Knows nothing of Gst, so it's easy to test. A tick
+    without a latency (no batches seen) changes nothing.
+
+    :returns: the new level, the new count of calm ticks and a reason
+
+    :arg metrics: the Metrics of the last tick
+    :arg level: the current level (0 is full quality)
+    :arg top: the highest level (len(ladder))
+    :arg calm: ticks in a row with headroom so far
+    :arg target_latency: seconds of latency considered overloaded
+    :arg max_queue_fill: queue fill considered overloaded
+    :param restore_ratio: there's headroom below this times both targets
+    :param hold: ticks of headroom in a row before restoring a rung
+    """
+    if metrics.latency is None:
+        # nothing measured (eg. paused, or every source between files), so
+        # there's nothing to decide on
+        return level, calm, ''
+    latency = metrics.latency
+    if latency > target_latency or metrics.queue_fill > max_queue_fill:
+        if level < top:
+            return level + 1, 0, 'overloaded, shedding'
+        return level, 0, 'overloaded, nothing left to shed'
+    if (latency < target_latency * restore_ratio
+            and metrics.queue_fill < max_queue_fill * restore_ratio):
+        calm += 1
+        if level and calm >= hold:
+            return level - 1, 0, 'headroom, restoring'
+        return level, calm, ''
+    return level, 0, ''
+
+
+class OverloadController(object):
+    """
+    Watches a DeepStreamApp and sheds load to keep latency near a target. Pass
+    to DeepStreamApp(overload=...), which starts it (and gives every source a
+    rate limiter, see SourceBin.set_max_fps).
+
+    The DISPLAY action needs a display output with a rate limit to change
+    (eg. --output display:fps=30). Actions with nothing to act on are
+    skipped.
+
+    :param target_latency: seconds from the stream muxer to the metadata
+           probes considered overloaded
+    :param max_queue_fill: fill (0.0 to 1.0) of the fullest inference queue
+           considered overloaded
+    :param order: the actions, in the order to shed load with them
+    :param steps: the values for each action (default: DEFAULT_STEPS)
+    :param low_priority: names of sources whose frames may be dropped
+    :param tick: seconds between decisions
+    :param hold: ticks of headroom in a row before restoring a rung
+    """
+
+    def __init__(self, target_latency: float = 0.5,
+                 max_queue_fill: float = 0.8,
+                 order: Iterable[str] = ACTIONS,
+                 steps: Mapping[str, Sequence[float]] = None,
+                 low_priority: Iterable[str] = (),
+                 tick: float = 1.0, hold: int = 3):
+        self.target_latency = target_latency
+        self.max_queue_fill = max_queue_fill
+        self.low_priority = list(low_priority)
+        self.tick = tick
+        self.hold = hold
+        self._order = list(order)
+        self._steps = steps
+        self.ladder = []  # type: List[Rung]
+        self.level = 0
+        self._calm = 0
+        self._app = None
+        self._registration = None  # type: Optional[mce.probes.Registration]
+        self._timer = None  # type: Optional[int]
+        # worst latency seen this tick. only a float is shared with the
+        # streaming thread, so no lock.
+        self._latency = None  # type: Optional[float]
+        # frame rates of the low priority sources before any shedding
+        self._original_fps = {}  # type: Dict[str, Optional[float]]
+        self._original_interval = 0
+        self._original_display = None  # type: Optional[int]
+
+    def start(self, app):
+        """start watching a DeepStreamApp (called on it's __enter__)"""
+        self._app = app
+        pie = app['pie']
+        self._original_interval = pie.get_property('interval')
+        display_rate = app[DISPLAY_RATE]
+        if display_rate is not None:
+            self._original_display = display_rate.get_property('max-rate')
+        order = []
+        for action in self._order:
+            if action == DISPLAY and display_rate is None:
+                logger.info(f"overload: no {DISPLAY_RATE}, skipping {action}")
+            elif action == SOURCES and not self.low_priority:
+                logger.info(f"overload: no low priority sources, skipping "
+                            f"{action}")
+            else:
+                order.append(action)
+        self.ladder = make_ladder(order, self._steps)
+        self._original_fps = {
+            name: self._source_fps(name) for name in self.low_priority}
+        # no budget: throttled, it would miss the very batches showing an
+        # overload
+        self._registration = app.add_probe(self.on_buffer, budget=None)
+        self._timer = GLib.timeout_add(int(self.tick * 1000), self._on_tick)
+
+    def stop(self):
+        """remove the probe and timer added by start (called on the
+        DeepStreamApp's __exit__)"""
+        if self._timer is not None:
+            GLib.source_remove(self._timer)
+            self._timer = None
+        if self._registration is not None:
+            self._app.remove_probe(self._registration)
+            self._registration = None
+
+    def on_buffer(self, pad: Gst.Pad, info: Gst.PadProbeInfo, _: Any,
+                  ) -> Gst.PadProbeReturn:
+        """the probe measuring latency (added by start)"""
+        batch_meta = pyds.gst_buffer_get_nvds_batch_meta(
+            hash(info.get_buffer()))
+        now = time.time()
+        for frame_meta in mce.osd.frame_meta_iterator(
+                batch_meta.frame_meta_list):
+            # the system time the muxer got the frame (attach-sys-ts)
+            latency = now - frame_meta.ntp_timestamp / 1e9
+            if self._latency is None or latency > self._latency:
+                self._latency = latency
+            break  # every frame in a batch was pushed together
+        return Gst.PadProbeReturn.OK
+
+    def metrics(self) -> Metrics:
+        """:returns: Metrics for the tick so far"""
+        fill = 0.0
+        for stats in self._app.queue_stats().values():
+            if stats['max_buffers']:
+                fill = max(fill, stats['buffers'] / stats['max_buffers'])
+        return Metrics(self._latency, fill)
+
+    def _on_tick(self) -> bool:
+        metrics = self.metrics()
+        self._latency = None
+        level, self._calm, reason = decide(
+            metrics, self.level, len(self.ladder), self._calm,
+            self.target_latency, self.max_queue_fill, hold=self.hold)
+        latency = 'none' if metrics.latency is None else \
+            f'{metrics.latency * 1000:.0f}ms'
+        if reason:
+            logger.info(
+                f"overload: {reason} (latency {latency}, queue fill "
+                f"{metrics.queue_fill:.0%}, level {self.level}->{level} of "
+                f"{len(self.ladder)})")
+        if level != self.level:
+            self.level = level
+            self._apply(effective(self.ladder, level))
+        return True  # repeat
+
+    def _apply(self, values: Mapping[str, float]):
+        # shedding never raises a display rate or lowers an interval past
+        # what it was configured as
+        display_rate = self._app[DISPLAY_RATE]
+        if display_rate is not None:
+            fps = values.get(DISPLAY)
+            original = self._original_display or GLib.MAXINT
+            display_rate.set_property(
+                'max-rate', min(int(fps), original) if fps else original)
+        interval = values.get(INTERVAL)
+        self._app['pie'].set_property(
+            'interval', self._original_interval if interval is None
+            else max(int(interval), self._original_interval))
+        fps = values.get(SOURCES)
+        for name in self.low_priority:
+            original = self._original_fps.get(name)
+            limit = fps if fps else original
+            # never raise a source above it's own limit
+            if fps and original:
+                limit = min(fps, original)
+            self._app.set_max_fps(name, limit)
+        logger.info(f"overload: now {values or 'full quality'}")
+
+    def _source_fps(self, name: str) -> Optional[float]:
+        for element in self._app.children:
+            if name in getattr(element, 'consumers', ()):
+                return element.max_fps
+        return None
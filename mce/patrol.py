@@ -0,0 +1,289 @@
+"""
+Camera patrol: time-slice more cameras than there are batch slots.
+
+A Patrol rotates cameras through a fixed number of muxer slots. Each camera
+is watched for it's dwell time and then, if another camera is due, swapped
+out. It isn't watched again until it's revisit interval has passed. The
+cameras most likely to be next are kept connected (in PAUSED, with their state
+locked) so switching doesn't pay full RTSP negotiation each time.
+
+Standby only helps live sources (cameras). A paused live source connects but
+doesn't push data. A paused file would preroll into it's (unlinked) pad, so
+patrol files with standby=0.
+"""
+
+# Copyright (c) 2020 Michael de Gans
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import collections
+import logging
+import time
+
+import gi
+gi.require_version('Gst', '1.0')
+gi.require_version('GLib', '2.0')
+from gi.repository import (
+    GLib,
+    Gst,
+)
+
+from typing import (
+    Container,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Tuple,
+)
+
+logger = logging.getLogger(__name__)
+
+__all__ = [
+    'Camera',
+    'POLICIES',
+    'Patrol',
+    'ROUND_ROBIN',
+    'Schedule',
+    'WEIGHTED',
+]
+
+ROUND_ROBIN = 'round-robin'
+WEIGHTED = 'weighted'
+POLICIES = (ROUND_ROBIN, WEIGHTED)
+
+Camera = collections.namedtuple(
+    'Camera', ('uri', 'dwell', 'revisit', 'weight', 'roi'))
+Camera.__new__.__defaults__ = (10.0, 60.0, 1.0, None)
+Camera.__doc__ = """
+A NamedTuple class describing a camera on patrol.
+
+:arg uri: a uri for uridecodebin
+:arg dwell: seconds to watch the camera per visit (default 10)
+:arg revisit: minimum seconds between the end of one visit and the start of
+     the next (default 60)
+:arg weight: relative priority with the WEIGHTED policy (default 1.0)
+:arg roi: an optional mce.geometry.Roi to crop the camera to
+"""
+
+
+class Schedule(object):
+    """
+    Decides which camera to visit next. Knows nothing of Gst, so it's easy to
+    test with made up times.
+
+    With ROUND_ROBIN, cameras are visited in order, skipping any not yet due.
+    With WEIGHTED, the due camera that's waited longest, relative to it's
+    revisit interval and times it's weight, goes first.
+
+    :arg cameras: the cameras to schedule
+    :param policy: ROUND_ROBIN or WEIGHTED
+    """
+
+    def __init__(self, cameras: Iterable[Camera], policy: str = ROUND_ROBIN):
+        if policy not in POLICIES:
+            raise ValueError(f"unknown patrol policy: {policy}")
+        self.cameras = list(cameras)  # type: List[Camera]
+        self.policy = policy
+        # when each camera's last visit ended (None if never visited)
+        self.last_seen = [None] * len(self.cameras)  # type: List[Optional[float]]
+        # the round robin cursor
+        self._next = 0
+
+    def due(self, index: int, now: float) -> bool:
+        """:returns: True if camera |index| may be visited at |now|"""
+        last = self.last_seen[index]
+        return last is None or now - last >= self.cameras[index].revisit
+
+    def rank(self, now: float, exclude: Container[int] = ()) -> List[int]:
+        """
+        :returns: camera indexes, not in |exclude|, in the order they should
+                  be visited (due or not)
+        """
+        count = len(self.cameras)
+        if self.policy == ROUND_ROBIN:
+            order = [(self._next + i) % count for i in range(count)]
+        else:
+            def overdue(i: int) -> float:
+                last = self.last_seen[i]
+                if last is None:
+                    return float('inf')
+                camera = self.cameras[i]
+                return (now - last) / max(camera.revisit, 1e-6) * camera.weight
+            order = sorted(range(count), key=lambda i: (-overdue(i), i))
+        return [i for i in order if i not in exclude]
+
+    def pick(self, now: float, exclude: Container[int] = ()) -> Optional[int]:
+        """:returns: the next camera to visit at |now|, or None if none due"""
+        for index in self.rank(now, exclude):
+            if self.due(index, now):
+                return index
+        return None
+
+    def start(self, index: int):
+        """record the start of a visit to camera |index|"""
+        if self.policy == ROUND_ROBIN:
+            self._next = (index + 1) % len(self.cameras)
+
+    def end(self, index: int, now: float):
+        """record the end of a visit to camera |index| at |now|"""
+        self.last_seen[index] = now
+
+
+class Patrol(object):
+    """
+    Rotates |cameras| through |slots| muxer slots of a DeepStreamApp. Pass to
+    DeepStreamApp(patrol=...), which reserves the slots and starts it.
+
+    :arg cameras: the cameras to patrol
+    :param slots: how many cameras to watch at once
+    :param policy: ROUND_ROBIN or WEIGHTED (see Schedule)
+    :param standby: how many upcoming cameras to keep connected and paused
+           (default: |slots|)
+    :param tick: seconds between checks for expired visits
+    """
+
+    def __init__(self, cameras: Iterable[Camera], slots: int = 8,
+                 policy: str = ROUND_ROBIN, standby: Optional[int] = None,
+                 tick: float = 1.0):
+        self.schedule = Schedule(cameras, policy)
+        self.slots = slots
+        self.standby = slots if standby is None else standby
+        self.tick = tick
+        self._app = None
+        self._timer = None  # type: Optional[int]
+        # camera index -> (SourceBin, visit start time)
+        self._active = {}  # type: Dict[int, Tuple[Gst.Bin, float]]
+        # camera index -> paused SourceBin
+        self._standby = {}  # type: Dict[int, Gst.Bin]
+        self.visits = 0
+        self.failures = 0
+
+    @property
+    def cameras(self) -> List[Camera]:
+        return self.schedule.cameras
+
+    @property
+    def active(self) -> Dict[str, int]:
+        """:returns: a mapping of source name to camera index being watched"""
+        return {source.name: i for i, (source, _) in self._active.items()}
+
+    def start(self, app):
+        """start patrolling with a DeepStreamApp (called on it's __enter__)"""
+        self._app = app
+        now = time.monotonic()
+        for _ in range(min(self.slots, len(self.cameras))):
+            index = self.schedule.pick(now, exclude=self._active)
+            if index is None:
+                break
+            self._visit(index, now)
+        self._refresh_standby(now)
+        self._timer = GLib.timeout_add(int(self.tick * 1000), self._on_tick)
+
+    def stop(self):
+        """stop the timer added by start (called on the DeepStreamApp's
+        __exit__)"""
+        if self._timer is not None:
+            GLib.source_remove(self._timer)
+            self._timer = None
+
+    def _visit(self, index: int, now: float):
+        camera = self.cameras[index]
+        source = self._standby.pop(index, None)
+        if source is not None:
+            self._app.activate_source(source)
+        else:
+            source = self._app.add_source(camera.uri, roi=camera.roi)
+        self._active[index] = (source, now)
+        self.schedule.start(index)
+        self.visits += 1
+        logger.debug(f"patrol: watching {camera.uri} as {source.name}")
+
+    def _leave(self, index: int, now: float):
+        source, _ = self._active.pop(index)
+        self._app.remove_source(source)
+        self.schedule.end(index, now)
+
+    def _on_tick(self) -> bool:
+        now = time.monotonic()
+        expired = [
+            i for i, (_, started) in self._active.items()
+            if now - started >= self.cameras[i].dwell
+        ]
+        for index in expired:
+            # someone else must be due, otherwise keep watching
+            following = self.schedule.pick(now, exclude=self._active)
+            if following is None:
+                break
+            self._leave(index, now)
+            self._visit(following, now)
+        if expired:
+            self._refresh_standby(now)
+        return True  # repeat
+
+    def _refresh_standby(self, now: float):
+        """keep the cameras most likely to be next connected and paused"""
+        wanted = self.schedule.rank(now, exclude=self._active)[:self.standby]
+        for index in [i for i in self._standby if i not in wanted]:
+            self._app.remove_source(self._standby.pop(index))
+        for index in wanted:
+            if index not in self._standby:
+                camera = self.cameras[index]
+                self._standby[index] = self._app.add_source(
+                    camera.uri, roi=camera.roi, standby=True)
+
+    def on_message(self, _: Gst.Bus, message: Gst.Message) -> bool:
+        """
+        Take a camera that errors (eg. it's offline) off patrol until it's
+        next revisit, filling it's slot with the next camera due.
+
+        :returns: True if the message was handled
+        """
+        if message.type != Gst.MessageType.ERROR or self._app is None:
+            return False
+        element = message.src
+        while element is not None and element.get_parent() is not self._app:
+            element = element.get_parent()
+        sources = {s: i for i, (s, _) in self._active.items()}
+        sources.update((s, i) for i, s in self._standby.items())
+        if element not in sources:
+            return False
+        index = sources[element]
+        err, errmsg = message.parse_error()  # type: GLib.Error, str
+        logger.warning(
+            f"patrol: {self.cameras[index].uri} failed ({err}: {errmsg}). "
+            f"retrying in {self.cameras[index].revisit}s")
+        self.failures += 1
+        now = time.monotonic()
+        # idle, since the source is still streaming
+        GLib.idle_add(self._replace, index, element, now)
+        return True
+
+    def _replace(self, index: int, source: Gst.Bin, now: float) -> bool:
+        if self._standby.get(index) is source:
+            del self._standby[index]
+            self._app.remove_source(source)
+            self.schedule.end(index, now)
+        elif index in self._active and self._active[index][0] is source:
+            self._leave(index, now)
+            following = self.schedule.pick(now, exclude=self._active)
+            if following is not None:
+                self._visit(following, now)
+        self._refresh_standby(now)
+        return False  # don't repeat
@@ -25,9 +25,8 @@ import itertools
 import logging
 import math
 import os
-import shutil
-import subprocess
 import sys
+import time
 import urllib.parse
 
 try:
@@ -48,6 +47,7 @@ from gi.repository import (
 from typing import (
     Any,
     Callable,
+    Dict,
     Iterable,
     Iterator,
     List,
@@ -60,10 +60,27 @@ from typing import (
 
 
 import mce
+import mce.graphs
+import mce.probes
 
 logger = logging.getLogger(__name__)
 
 DEFAULT_SINK = 'nveglglessink' if 'DISPLAY' in os.environ else 'nvoverlaysink'
+# the names of the InferenceBin elements queues may be added after
+STAGES = ('stream-muxer', 'pie', 'tracker', 'converter', 'tiler', 'osd')
+# pie.conf's gie-unique-id. secondary inference engines (sies) classify the
+# objects it detects.
+PIE_UNIQUE_ID = 1
+# the name of secondary inference engine N is SIE_NAME.format(N)
+SIE_NAME = 'sie_{}'
+# pass as |sink| to make_inference_description to encode for an RtspServer
+RTSP_SINK = 'rtsp'
+# OutputBranch kinds (see make_output_description)
+DISPLAY_OUTPUT = 'display'
+RTSP_OUTPUT = RTSP_SINK
+FILE_OUTPUT = 'file'
+META_OUTPUT = 'meta'
+DEFAULT_ENCODER = 'nvv4l2h264enc'
 
 YOUTUBE_HOSTNAMES = ('www.youtube.com', 'youtu.be')
 
@@ -77,8 +94,55 @@ A NamedTuple class describing a Gst.Element and it's properties.
 :arg properties: an ElementProperties (a kwarg dict) to use to assign properties
      to the Gst.Element
 """
+Branches = collections.namedtuple("Branches", ('name', 'branches'))
+Branches.__doc__ = """
+A NamedTuple class describing a tee and the branches following it. May only be
+the last item of a BinDescription.
+
+:arg name: the unique name to give the tee
+:arg branches: a Sequence of BinDescription, one for each branch
+"""
+OutputBranch = collections.namedtuple(
+    "OutputBranch", ('kind', 'fps', 'leaky', 'queue_size', 'location'))
+OutputBranch.__new__.__defaults__ = (None, True, 4, None)
+OutputBranch.__doc__ = """
+A NamedTuple class describing an output branch of an InferenceBin.
+
+:arg kind: DISPLAY_OUTPUT, RTSP_OUTPUT, FILE_OUTPUT or META_OUTPUT
+:arg fps: an optional maximum frame rate for the branch (default: no limit)
+:arg leaky: if True (default), the branch drops it's own oldest buffers when
+     it can't keep up instead of blocking everything upstream (inference).
+:arg queue_size: max buffers in the branch's queue (it's thread boundary)
+:arg location: filename for FILE_OUTPUT
+"""
+StageQueue = collections.namedtuple(
+    "StageQueue", ('max_buffers', 'max_time', 'leaky'))
+StageQueue.__new__.__defaults__ = (2, 0.0, False)
+StageQueue.__doc__ = """
+A NamedTuple class describing a queue (thread boundary) between stages of an
+InferenceBin. See make_inference_description.
+
+:arg max_buffers: max-size-buffers (default 2). Keep this small, since NVMM
+     buffers come from small, fixed size, pools.
+:arg max_time: max-size-time in seconds (default 0, unlimited)
+:arg leaky: if True, drop old buffers when full, rather than block. Usually
+     you don't want this before inference. (default False)
+"""
+Source = collections.namedtuple("Source", ('uri', 'roi', 'max_fps'))
+Source.__new__.__defaults__ = (None, None)
+Source.__doc__ = """
+A NamedTuple class describing a source of a DeepStreamApp. Plain uri strings
+are also accepted wherever a Source is.
+
+:arg uri: a uri or filename
+:arg roi: an optional mce.geometry.Roi to crop the source to before inference.
+     Detections are mapped back to full frame coordinates after the probes
+     (see mce.roi).
+:arg max_fps: an optional maximum frame rate to run the source at (see
+     SourceBin)
+"""
 # a pipeline/bin description
-BinDescription = Sequence[ElementDescription]
+BinDescription = Sequence[Union[ElementDescription, Branches]]
 # the properties within an ElementDescription
 ElementProperties = Optional[Mapping[str, Any]]
 # a Gst.Element or Gst.Pad
@@ -90,18 +154,43 @@ PadProbeCallback = Callable[
     [Gst.Pad, Gst.PadProbeInfo, Any],
     Gst.PadProbeReturn,
 ]
+# Signature of a SourceBin encoded branch factory. Called with the SourceBin
+# and the encoded caps name (eg. "video/x-h264") from a streaming thread. It
+# should return linear, unlinked elements to attach to the encoded tee (or None)
+EncodedBranchFactory = Callable[
+    [Gst.Bin, str],
+    Optional[List[Gst.Element]],
+]
+
+# caps at which uridecodebin should stop when there are encoded branches
+ENCODED_VIDEO_CAPS = 'video/x-h264; video/x-h265'
+# parsers for the encoded caps above
+ENCODED_PARSERS = {
+    'video/x-h264': 'h264parse',
+    'video/x-h265': 'h265parse',
+}
 
 __all__ = [
     'BinDescription',
+    'Branches',
     'DeepStreamApp',
     'ElementDescription',
     'ElementOrPad',
     'GhostBin',
+    'insert_queues',
     'make_element',
+    'make_archive_description',
     'make_elements',
+    'make_encoder_description',
     'make_inference_description',
+    'make_output_description',
+    'make_queues',
     'link',
+    'OutputBranch',
     'bin_to_pdf',
+    'Source',
+    'SourceBin',
+    'StageQueue',
     'StateSetter',
 ]
 
@@ -129,50 +218,21 @@ class PipelineCreationError(RuntimeError):
 def bin_to_pdf(bin_: Gst.Bin, details: Gst.DebugGraphDetails, filename: str,
                ) -> Optional[str]:
     """
-    Dump a Gst.Bin to pdf using 
-    `Gst.debug_bin_to_dot_file <https://lazka.github.io/pgi-docs/Gst-1.0/functions.html#Gst.debug_bin_to_dot_file>`_
-    and graphviz.
-    Will launch the 'dot' subprocess in the background with Popen.
-    Does not check whether the process completes, but a .dot is
-    created in any case. Has the same arguments as 
-    `Gst.debug_bin_to_dot_file <https://lazka.github.io/pgi-docs/Gst-1.0/functions.html#Gst.debug_bin_to_dot_file>`_
+    Dump a Gst.Bin to pdf using
+    `Gst.debug_bin_to_dot_data <https://lazka.github.io/pgi-docs/Gst-1.0/functions.html#Gst.debug_bin_to_dot_data>`_
+    and graphviz, in the background (see mce.graphs). The .dot is written in
+    any case. Unchanged graphs are skipped.
 
-    :returns: the path to the created file (.dot or .pdf) or None if
-              GST_DEBUG_DUMP_DOT_DIR not found in os.environ
+    :returns: the path of the file that will be written (.dot or .pdf) or None
+              if skipped or graphs aren't configured and GST_DEBUG_DUMP_DOT_DIR
+              isn't in os.environ
 
     :arg bin_: the bin to make a .pdf visualization of
     :arg details: a Gst.DebugGraphDetails choice (see gstreamer docs)
     :arg filename: a base filename to use (not full path, with no extension)
          usually this is the name of the bin you can get with some_bin.name
     """
-    if 'GST_DEBUG_DUMP_DOT_DIR' in os.environ:
-        dot_dir = os.environ['GST_DEBUG_DUMP_DOT_DIR']
-        dot_file = os.path.join(dot_dir, f'{filename}.dot')
-        pdf_file = os.path.join(dot_dir, f'{filename}.pdf')
-        logger.debug(f"writing {bin_.name} to {dot_file}")
-        Gst.debug_bin_to_dot_file(bin_, details, filename)
-        dot_exe = shutil.which('dot')
-        if dot_exe:
-            logger.debug(
-                f"converting {os.path.basename(dot_file)} to "
-                f"{os.path.basename(pdf_file)} in background")
-            command = ('nohup', dot_exe, '-Tpdf', dot_file, f'-o{pdf_file}')
-            logger.debug(
-                f"running: {' '.join(command)}")
-            subprocess.Popen(
-                command,
-                stdout=subprocess.DEVNULL,
-                stderr=subprocess.DEVNULL,
-                preexec_fn=os.setpgrp,
-            )
-        else:
-            logger.warning(
-                f'graphviz does not appear to be installed, so cannot convert'
-                f'{dot_file} to pdf. You can install graphviz with '
-                f'"sudo apt install graphviz" on Linux for Tegra or Ubuntu.')
-            return dot_file
-        return pdf_file
-    return None
+    return mce.graphs.dump(bin_, filename, details)
 
 
 def make_element(type_name: str, name: str) -> Gst.Element:
@@ -185,7 +245,7 @@ def make_element(type_name: str, name: str) -> Gst.Element:
 
     :raises: ElementCreationError if element creation fails
     """
-    logger.debug(f"creating element: {type_name} with name: {name}")
+    logger.debug("creating element: %s with name: %s", type_name, name)
     element = Gst.ElementFactory.make(type_name, name)
     if not element:
         err = f"failed to create {type_name} with name: {name}"
@@ -203,17 +263,24 @@ def make_elements(bin_description: BinDescription
           silently skipped. See make_inference_description for why, and example
           usage of this feature.
 
+    note: Branches are returned as a tee, followed by a list with a list of
+          elements for each branch. Use iter_elements to flatten the result.
+
     :arg bin_description: a BinDescription (Sequence of ElementDescription)
     """
     elements = []
     for ed in bin_description:
         if not ed:
             continue
+        if isinstance(ed, Branches):
+            elements.append(make_element('tee', ed.name))
+            elements.append([make_elements(bd) for bd in ed.branches])
+            continue
         element = make_element(ed.type, ed.name)
         if ed.properties:
             for k, v in ed.properties.items():
                 element.set_property(k, v)
-        if ed.name in (e.name for e in elements):
+        if ed.name in (e.name for e in iter_elements(elements)):
             logger.warning(
                 f"DUPLICATE ELEMENT NAME: {ed.name} "
                 f"this may lead to unexpected behavior.")
@@ -221,6 +288,19 @@ def make_elements(bin_description: BinDescription
     return elements
 
 
+def iter_elements(elements: Iterable) -> Iterator[Gst.Element]:
+    """
+    :yields: every Gst.Element in |elements| (as returned by make_elements),
+    including those in branches.
+    """
+    for element in elements:
+        if isinstance(element, list):
+            for branch in element:
+                yield from iter_elements(branch)
+        else:
+            yield element
+
+
 def caps_start_with(pad: Gst.Pad, caps_str: str) -> bool:
     caps = pad.query_caps()  # type: Gst.Caps
     string = caps.to_string()  # type: str
@@ -248,9 +328,8 @@ def _link_pads(a: Gst.Pad, b: Gst.Pad):
     # try to link pads
     ret = a.link(b)
     if ret == Gst.PadLinkReturn.OK:
-        logger.debug(
-            f'pad link between {a.parent.name}:{a.name} and '
-            f'{b.parent.name}{b.name} OK')
+        logger.debug("pad link between %s:%s and %s:%s OK",
+                     a.parent.name, a.name, b.parent.name, b.name)
         return
     elif ret == Gst.PadLinkReturn.WRONG_HIERARCHY:
         # todo: handle this automatically (really, gstreamer itself should)
@@ -292,12 +371,13 @@ def link(a: ElementOrPad, b: ElementOrPad):
     :raises: LinkError if link fails
     """
     # todo: support elements with request pads
-    try:
-        logger.debug(
-            f"linking {'pad ' if isinstance(a, Gst.Pad) else ''}{a.name} "
-            f"to {'pad ' if isinstance(b, Gst.Pad) else ''}{b.name}")
-    except AttributeError:
+    if not hasattr(a, 'name') or not hasattr(b, 'name'):
         raise LinkError(f"{a} or {b} does not seem to be an Element or Pad")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(
+            "linking %s%s to %s%s",
+            'pad ' if isinstance(a, Gst.Pad) else '', a.name,
+            'pad ' if isinstance(b, Gst.Pad) else '', b.name)
     if isinstance(a, Gst.Element) and isinstance(b, Gst.Element):
         if not a.link(b):
             raise LinkError(f"could not link {a.name} to {b.name}")
@@ -307,10 +387,12 @@ def link(a: ElementOrPad, b: ElementOrPad):
 
 def auto_link(elements: Iterable[Gst.Element]):
     """
-    Automatically link a *linear* Iterable of elements together (no tees or
-    other branching).
+    Automatically link a *linear* Iterable of elements together. The only
+    branching supported is a tee followed by a list of branches, as returned
+    by make_elements for Branches. Each branch is linked to a new tee request
+    pad, then auto-linked itself.
 
-    note: Won't link sometimes/request pads (for now), but link() could be
+    note: Won't link sometimes pads (for now), but link() could be
           patched to so. If you want to submit a PR, this would be a welcome
           addition. Warning: it's not an easy task, with a lot of edge cases.
 
@@ -320,6 +402,12 @@ def auto_link(elements: Iterable[Gst.Element]):
     """
     prev = None
     for element in elements:  # type: Gst.Element
+        if isinstance(element, list):
+            # a tee's branches are always last
+            for branch in element:
+                link(prev, branch[0])
+                auto_link(branch)
+            return
         if prev is not None:
             link(prev, element)
         prev = element
@@ -329,6 +417,8 @@ def calc_rows_and_columns(num_sources: int) -> int:
     """
     calculates rows and columns values from a number of sources
     :returns:  int(math.ceil(math.sqrt(num_sources)))
+
+    note: this is always square. mce.geometry.plan_layout wastes fewer tiles.
     """
     if not num_sources:
         return 1
@@ -340,11 +430,259 @@ def calc_in_scale(out_scale: Tuple[int, int], rows_and_columns: int
     return out_scale[0] // rows_and_columns, out_scale[1] // rows_and_columns
 
 
+def calc_drop_interval(source_fps: Optional[float],
+                       max_fps: Optional[float]) -> int:
+    """
+    :returns: an nvv4l2decoder "drop-frame-interval" (output every Nth frame)
+              keeping at least |max_fps| of |source_fps|, or 0 (no dropping)
+              if either is unknown
+    """
+    if not source_fps or not max_fps or max_fps >= source_fps:
+        return 0
+    interval = int(source_fps // max_fps)
+    return interval if interval > 1 else 0
+
+
+def make_encoder_description(name: str = 'encoder',
+                             encoder: str = DEFAULT_ENCODER,
+                             bitrate: int = 4000000,
+                             gop: int = 30,
+                             ) -> BinDescription:
+    """
+    :returns: a BinDescription encoding raw video to parsed, byte-stream h264.
+    More or less equal to:
+
+    "nvvideoconvert ! video/x-raw(memory:NVMM),format=I420 ! |encoder|
+    ! h264parse"
+
+    :param name: a base name for the elements
+    :param encoder: the h264 encoder element to use. Nvidia encoders (starting
+           with "nv") are fed NVMM memory. Anything else (eg. x264enc, as a
+           stand-in on machines without an Nvidia encoder) is fed system
+           memory, copied out of NVMM by nvvideoconvert.
+    :param bitrate: target bitrate in bits per second
+    :param gop: keyframe interval in frames
+    """
+    if encoder.startswith('nv'):
+        caps = 'video/x-raw(memory:NVMM),format=I420'
+        properties = {
+            'bitrate': bitrate,
+            'iframeinterval': gop,
+        }
+        if mce.is_jetson():
+            properties.update({
+                'preset-level': 1,
+                'insert-sps-pps': 1,
+                'bufapi-version': 1,
+            })
+    else:
+        # nvdsosd's output is NVMM, which only nvvideoconvert can read
+        caps = 'video/x-raw,format=I420'
+        properties = {
+            'bitrate': bitrate // 1000,  # kbit/s
+            'key-int-max': gop,
+            'speed-preset': 1,  # ultrafast
+            'tune': 0x4,  # zerolatency
+        }
+    return (
+        ElementDescription(
+            'nvvideoconvert', f'{name}_converter', None,
+        ),
+        ElementDescription(
+            'capsfilter', f'{name}_caps', {
+                'caps': Gst.Caps.from_string(caps),
+            },
+        ),
+        ElementDescription(
+            encoder, name, properties,
+        ),
+        ElementDescription(
+            'h264parse', f'{name}_parser', {
+                'config-interval': -1,
+            },
+        ),
+    )
+
+
+def make_output_description(output: OutputBranch,
+                            sink: str = DEFAULT_SINK,
+                            encoder: str = DEFAULT_ENCODER,
+                            bitrate: int = 4000000,
+                            gop: int = 30,
+                            ) -> BinDescription:
+    """
+    :returns: a BinDescription for an output branch following the osd. Every
+    branch starts with it's own queue, so it runs in it's own thread, and an
+    optional frame rate limit. More or less equal to:
+
+    "queue ! videorate (if |output.fps|) ! (kind specific elements)"
+
+    where the kind specific elements are:
+
+    * DISPLAY_OUTPUT: "nvegltransform (if Jetson) ! |sink|"
+    * RTSP_OUTPUT: "(encoder) ! appsink" (for an mce.rtsp.RtspServer)
+    * FILE_OUTPUT: "(encoder) ! matroskamux ! filesink"
+    * META_OUTPUT: "fakesink" (for metadata probes only)
+
+    Elements are named after the kind (eg. "display_sink", "rtsp_sink").
+
+    :arg output: an OutputBranch describing the branch
+    :param sink: the display sink element (see make_inference_description)
+    :param encoder: the encoder element (see make_encoder_description)
+    :param bitrate: encoder bitrate in bits per second
+    :param gop: encoder keyframe interval in frames
+    """
+    kind = output.kind
+    head = (
+        ElementDescription(
+            'queue', f'{kind}_queue', {
+                # 2 is downstream (drop old buffers), 0 is no leaking
+                'leaky': 2 if output.leaky else 0,
+                'max-size-buffers': output.queue_size,
+                'max-size-bytes': 0,
+                'max-size-time': 0,
+            },
+        ),
+        ElementDescription(
+            'videorate', f'{kind}_rate', {
+                'drop-only': True,
+                # a whole number of frames per second (see SourceBin)
+                'max-rate': max(1, int(round(output.fps))),
+            },
+        ) if output.fps else None,
+    )
+    if kind == DISPLAY_OUTPUT:
+        tail = (
+            ElementDescription(
+                'nvegltransform', f'{kind}_transform', None,
+            ) if mce.is_jetson() and sink == 'nveglglessink' else None,
+            ElementDescription(
+                sink, f'{kind}_sink', {
+                    'sync': False,
+                    'qos': False,
+                },
+            ),
+        )
+    elif kind == RTSP_OUTPUT:
+        tail = make_encoder_description(
+            f'{kind}_encoder', encoder, bitrate, gop) + (
+            ElementDescription(
+                'appsink', f'{kind}_sink', {
+                    'sync': False,
+                    'qos': False,
+                    'drop': True,
+                    'max-buffers': 30,
+                },
+            ),
+        )
+    elif kind == FILE_OUTPUT:
+        if not output.location:
+            raise ValueError(f'{kind} output requires a location')
+        tail = make_encoder_description(
+            f'{kind}_encoder', encoder, bitrate, gop) + (
+            ElementDescription(
+                'matroskamux', f'{kind}_muxer', None,
+            ),
+            ElementDescription(
+                'filesink', f'{kind}_sink', {
+                    'location': output.location,
+                    'sync': False,
+                    'async': False,
+                },
+            ),
+        )
+    elif kind == META_OUTPUT:
+        tail = (
+            ElementDescription(
+                'fakesink', f'{kind}_sink', {
+                    'sync': False,
+                    'async': False,
+                },
+            ),
+        )
+    else:
+        raise ValueError(f'unknown output kind: {kind}')
+    return head + tail
+
+
+def make_queues(stages: Iterable[str],
+                settings: 'StageQueue' = None,
+                ) -> Mapping[str, 'StageQueue']:
+    """
+    :returns: a queues mapping for make_inference_description with the same
+    |settings| after every stage in |stages|.
+
+    :arg stages: an Iterable of stage names (see STAGES)
+    :param settings: a StageQueue (default: StageQueue())
+    """
+    settings = settings if settings is not None else StageQueue()
+    return {stage: settings for stage in stages}
+
+
+def _is_sie_name(name: str) -> bool:
+    prefix, _, index = SIE_NAME.partition('{}')
+    return name.startswith(prefix) and name[len(prefix):].isdigit()
+
+
+def insert_queues(bd: BinDescription,
+                  queues: Optional[Mapping[str, 'StageQueue']],
+                  ) -> BinDescription:
+    """
+    :returns: a copy of |bd| with a queue named "(stage)_queue" inserted
+    after each element named in |queues|. Branches are left alone (they have
+    their own queues). Stages this pipeline doesn't have (eg. the tiler, if
+    headless, or the tracker, if there's none) are skipped, with a warning.
+
+    :arg bd: a BinDescription
+    :arg queues: a mapping of element name to StageQueue (or None)
+
+    :raises ValueError: if a name in |queues| isn't a stage at all
+    """
+    if not queues:
+        return bd
+    names = {ed.name for ed in bd if ed}
+    unknown = {name for name in set(queues) - names
+               if name not in STAGES and not _is_sie_name(name)}
+    if unknown:
+        raise ValueError(f"can't add queues after unknown stages: {unknown}")
+    absent = set(queues) - names
+    if absent:
+        logger.warning(f"no queues after {', '.join(sorted(absent))}: not "
+                       f"in this pipeline")
+    new_bd = []
+    for ed in bd:
+        new_bd.append(ed)
+        if ed and ed.name in queues:
+            settings = queues[ed.name]
+            new_bd.append(ElementDescription(
+                'queue', f'{ed.name}_queue', {
+                    # 2 is downstream (drop old buffers), 0 is no leaking
+                    'leaky': 2 if settings.leaky else 0,
+                    'max-size-buffers': settings.max_buffers,
+                    'max-size-bytes': 0,
+                    'max-size-time': int(settings.max_time * Gst.SECOND),
+                },
+            ))
+    return tuple(new_bd)
+
+
 def make_inference_description(pie_config: str,
                                sink: str = DEFAULT_SINK,
                                num_sources: int = 1,
                                out_scale: Tuple[int, int] = (1920, 1080),
-                               live: True,
+                               live: bool = False,
+                               encoder: str = DEFAULT_ENCODER,
+                               bitrate: int = 4000000,
+                               gop: int = 30,
+                               outputs: Sequence[OutputBranch] = (),
+                               headless: bool = False,
+                               queues: Mapping[str, 'StageQueue'] = None,
+                               source_sizes: Sequence[Tuple[int, int]] = (),
+                               muxer_scale: Optional[Tuple[int, int]] = None,
+                               oversample: float = 1.0,
+                               source_fps: Sequence[float] = (),
+                               tracker: Optional[str] = None,
+                               secondaries: Sequence[str] = (),
                                ) -> BinDescription:
     """
     :returns: a BinDescription (Sequence of ElementDescription) describing a
@@ -353,24 +691,97 @@ def make_inference_description(pie_config: str,
     "nvstreammux ! nvinfer ! nvvideoconvert ! nvosd ! nvegltransform (if Jetson)
     ! |sink|"
 
+    or, if |sink| is RTSP_SINK:
+
+    "nvstreammux ! nvinfer ! nvvideoconvert ! nvosd ! (encoder) ! appsink"
+
+    where the appsink should be connected to an mce.rtsp.RtspServer. The tiled
+    output is encoded once, no matter how many clients are watching.
+
+    or, if |outputs| are supplied:
+
+    "nvstreammux ! nvinfer ! nvvideoconvert ! nvosd ! tee name=output_tee
+    output_tee. ! (output 0) output_tee. ! (output 1) ..."
+
+    where each output is described by make_output_description. Since every
+    output has it's own thread and (by default) leaky queue, a slow consumer
+    drops it's own frames and doesn't throttle inference.
+
+    or, if |headless|:
+
+    "nvstreammux ! nvinfer ! fakesink"
+
+    for analytics only deployments, where nobody watches the video. Metadata
+    probes should be attached to the sink's sink pad (InferenceBin.add_probe
+    does this).
+
     :arg pie_config: path to a config file for the primary inference engine
          (pie). Samples are provided by Nvidia with DeepStream and in the mce
          Python library path (see pie.conf). Usually this is ~./mce/pie.conf
     :param num_sources: the number or sources in the pipeline. Will be used for
            the "batch-size" parameter of various elements.
     :param out_scale: a Tuple[width, height] for the width and height on the
-           nvmultistreamtiler element. Input scaling is automatically set
-           based on this and the number of sources.
+           nvmultistreamtiler element. This does not affect input scaling.
+           The tiler's rows and columns are planned to make the most of it
+           (see mce.geometry.plan_layout).
     :param sink: sink element to use (eg. nveglglessink). Must support NVMM.
            (otherwise performance will suffer, so don't use some standard
            gstreamer element). If it doesn't start with "nv" it won't perform
            well, if it works at all. 'qos' and 'sync' will be set to false on
            this element automatically.
     :param live: whether to specify live sources to the stream muxer
+    :param encoder: encoder element if |sink| is RTSP_SINK
+           (see make_encoder_description)
+    :param bitrate: encoder bitrate (bits per second) if |sink| is RTSP_SINK
+    :param gop: encoder keyframe interval (frames) if |sink| is RTSP_SINK
+    :param outputs: a Sequence of OutputBranch, at most one of each kind. If
+           supplied, |sink| is only used for DISPLAY_OUTPUT, unless it's
+           RTSP_SINK, which adds an RTSP_OUTPUT (if there isn't one) and
+           displays on DEFAULT_SINK.
+    :param headless: end the pipeline right after inference (no tiler, osd or
+           display). |sink| and |outputs| are ignored.
+    :param queues: a mapping of stage name (see STAGES) to StageQueue. A queue
+           is inserted after each named stage, so the stages on either side
+           run in separate threads (see insert_queues and make_queues).
+    :param source_sizes: known (width, height) of the sources, if any. The
+           muxer won't batch at a higher resolution than the largest, and the
+           tiler layout accounts for their aspect ratios.
+    :param muxer_scale: a Tuple[width, height] for nvstreammux. By default,
+           this is planned from the network input size in |pie_config| (see
+           mce.geometry.plan_muxer), so frames aren't scaled to more pixels
+           than the detector consumes.
+    :param oversample: batch at this times the network input size (when
+           |muxer_scale| is planned). Raise this to keep more detail for
+           the tiler.
+    :param source_fps: known frame rates of the sources, if any. The muxer
+           pushes a partial batch after one frame interval of the fastest
+           (default: 29.97 fps).
+    :param tracker: the path to an nvtracker low level library (eg.
+           mce.TRACKER_LIB). If supplied, a tracker follows the pie, so
+           every object has an object_id that persists across frames
+           (needed by mce.zones line crossings). Tracking runs at the
+           network input size.
+    :param secondaries: paths to nvinfer config files for secondary
+           classifiers (eg. vehicle type or color), run one after another
+           on the pie's objects, after the tracker (so results may be cached
+           by object_id, see mce.classify). Named "sie_0", "sie_1" ...
     """
-    rows_and_columns = calc_rows_and_columns(num_sources)
-    in_scale = calc_in_scale(out_scale, rows_and_columns)
-    return (
+    import mce.geometry
+    rows, columns = mce.geometry.plan_layout(
+        num_sources, out_scale, source_sizes)
+    network = mce.geometry.network_size(pie_config)
+    if muxer_scale is not None:
+        in_scale = muxer_scale
+    else:
+        in_scale = mce.geometry.plan_muxer(
+            network, source_sizes, oversample=oversample)
+    fps = max(source_fps) if source_fps else 29.97
+    rates = mce.geometry.pixel_rates(
+        in_scale, network, None if headless else out_scale, num_sources, fps)
+    logger.info(
+        f"muxer: {in_scale[0]}x{in_scale[1]} network: "
+        f"{network[0]}x{network[1]} pixel rates at {fps:.2f}fps: {rates}")
+    muxer_and_pie = (
         ElementDescription(
             'nvstreammux', 'stream-muxer', {
                 'width': in_scale[0],
@@ -378,8 +789,8 @@ def make_inference_description(pie_config: str,
                 'enable-padding': 1,  # maintain aspect raidou
                 'batch-size': num_sources,
                 # https://en.wikipedia.org/wiki/Millisecond#Examples
-                # a single frame of 29.97 fps seems reasonable
-                'batched-push-timeout': 33367,
+                # a single frame (of the fastest source) seems reasonable
+                'batched-push-timeout': int(1000000 / fps),
                 'live-source': live,
             },
         ),
@@ -391,15 +802,84 @@ def make_inference_description(pie_config: str,
                     precision='int8' if mce.is_xavier() else 'fp16',
                 ),
                 'batch-size': num_sources,
+                # whatever the config says, the sies infer on this
+                'unique-id': PIE_UNIQUE_ID,
             },
         ),
+        ElementDescription(
+            'nvtracker', 'tracker', {
+                'll-lib-file': tracker,
+                'tracker-width': network[0],
+                'tracker-height': network[1],
+                'enable-batch-process': True,
+            },
+        ) if tracker else None,
+    ) + tuple(
+        ElementDescription(
+            'nvinfer', SIE_NAME.format(i), {
+                'config-file-path': config,
+                'process-mode': 2,  # secondary (on objects)
+                'unique-id': PIE_UNIQUE_ID + 1 + i,
+                'infer-on-gie-id': PIE_UNIQUE_ID,
+            },
+        ) for i, config in enumerate(secondaries)
+    )
+    if headless:
+        return insert_queues(muxer_and_pie + (
+            ElementDescription(
+                'fakesink', 'sink', {
+                    'sync': False,
+                    'async': False,
+                    'qos': False,
+                },
+            ),
+        ), queues)
+    if outputs:
+        kinds = [output.kind for output in outputs]
+        if len(set(kinds)) != len(kinds):
+            # elements are named after the kind
+            raise ValueError(f'duplicate output kinds: {kinds}')
+        if sink == RTSP_SINK:
+            sink = DEFAULT_SINK
+            if RTSP_OUTPUT not in kinds:
+                outputs = tuple(outputs) + (OutputBranch(RTSP_OUTPUT),)
+        tail = (
+            Branches('output_tee', tuple(
+                make_output_description(output, sink, encoder, bitrate, gop)
+                for output in outputs)),
+        )
+    elif sink == RTSP_SINK:
+        tail = make_encoder_description(
+            encoder=encoder, bitrate=bitrate, gop=gop) + (
+            ElementDescription(
+                'appsink', 'sink', {
+                    'sync': False,
+                    'qos': False,
+                    'drop': True,
+                    'max-buffers': 30,
+                },
+            ),
+        )
+    else:
+        tail = (
+            ElementDescription(
+                'nvegltransform', 'transform', None,
+            ) if mce.is_jetson() and sink == 'nveglglessink' else None,
+            ElementDescription(
+                sink, 'sink', {
+                    'sync': False,
+                    'qos': False,
+                },
+            ),
+        )
+    return insert_queues(muxer_and_pie + (
         ElementDescription(
             'nvvideoconvert', 'converter', None,
         ),
         ElementDescription(
             'nvmultistreamtiler', 'tiler', {
-                'rows': rows_and_columns,
-                'columns': rows_and_columns,
+                'rows': rows,
+                'columns': columns,
                 'width': out_scale[0],
                 'height': out_scale[1],
             },
@@ -407,13 +887,57 @@ def make_inference_description(pie_config: str,
         ElementDescription(
             'nvdsosd', 'osd', None,
         ),
+    ) + tail, queues)
+
+
+def make_archive_description(name: str,
+                             caps_name: str,
+                             directory: str,
+                             segment: float = 600.0,
+                             max_queue: float = 2.0,
+                             prefix: str = '',
+                             ) -> Optional[BinDescription]:
+    """
+    :returns: a BinDescription describing an encoded branch archiving a
+    source, as is, in segments, or None if |caps_name| can't be archived.
+    More or less equal to:
+
+    "queue leaky=downstream ! h26Xparse ! splitmuxsink"
+
+    The leaky queue decouples disk writes from decoding. If the disk can't
+    keep up, old encoded buffers are dropped rather than stalling inference.
+    splitmuxsink uses mp4mux by default. DeepStreamApp swaps in matroskamux
+    so an unfinished last segment is still playable.
+
+    :arg name: a base name for the elements (usually the SourceBin's name)
+    :arg caps_name: the encoded caps name (eg. "video/x-h264")
+    :arg directory: where to write the segments
+    :param segment: length of each segment in seconds (split on keyframes)
+    :param max_queue: seconds of encoded video to queue before dropping
+    :param prefix: prepended to the segment filenames (eg. a per-run
+           timestamp, so a run doesn't overwrite the last one's segments)
+    """
+    parser = ENCODED_PARSERS.get(caps_name)
+    if parser is None:
+        return None
+    return (
+        ElementDescription(
+            'queue', f'{name}_archive_queue', {
+                'leaky': 2,  # downstream (drop old buffers)
+                'max-size-buffers': 0,
+                'max-size-bytes': 0,
+                'max-size-time': int(max_queue * Gst.SECOND),
+            },
+        ),
         ElementDescription(
-            'nvegltransform', 'transform', None,
-        ) if mce.is_jetson() and sink == 'nveglglessink' else None,
+            parser, f'{name}_archive_parser', None,
+        ),
         ElementDescription(
-            sink, 'sink', {
-                'sync': False,
-                'qos': False,
+            'splitmuxsink', f'{name}_archive_sink', {
+                'location': os.path.join(
+                    directory, f'{prefix}{name}_%05d.mkv'),
+                'max-size-time': int(segment * Gst.SECOND),
+                'async-handling': True,
             },
         ),
     )
@@ -432,7 +956,8 @@ def add_iterable(bin_: Gst.Bin, elements: Iterable[Gst.Element], link_=True):
     todo: add |ghost| parameter to run .make_ghost() if the supplied Bin is a
      GhostBin and |ghost|=True
     """
-    for element in elements:
+    elements = list(elements)
+    for element in iter_elements(elements):
         if not bin_.add(element):
             raise BinAddError(
                 f"could not add {element.name} to {bin_.name}")
@@ -453,12 +978,13 @@ class StateSetter(Gst.Pipeline):
         :param state: a Gst.State to change to
         :param ``async_``: if True, and the Gst.StateChangeReturn is ASYNC, wait...
         :param timeout: seconds if ``async_`` is True and StateChangeReturn == async
-        :param pdf: if True, dumps a pdf before and after state change
+        :param pdf: if True, dumps a graph before and after state change (if
+               graphs are configured for mce.graphs.STATE)
         :returns:
         """
         if pdf:
-            bin_to_pdf(
-                self, Gst.DebugGraphDetails.ALL,
+            mce.graphs.dump_event(
+                mce.graphs.STATE, self,
                 f"{self.name}.{state.value_name}.start")
         ret = super().set_state(state)
         if not ret == Gst.StateChangeReturn.ASYNC:
@@ -470,8 +996,8 @@ class StateSetter(Gst.Pipeline):
             logger.error(
                 f"failed to set {self.name} state to {state.value_name}")
         if pdf:
-            bin_to_pdf(
-                self, Gst.DebugGraphDetails.ALL,
+            mce.graphs.dump_event(
+                mce.graphs.STATE, self,
                 f"{self.name}.{state.value_name}.end")
         return ret
 
@@ -521,7 +1047,7 @@ class StateSetter(Gst.Pipeline):
         :param kwargs: are passed to :meth:`~set_state`
         """
         ret = self.null(**kwargs)
-        if loop_also and hasattr(self, 'loop') and self._loop.is_running():
+        if loop_also and hasattr(self, '_loop') and self._loop.is_running():
             self._loop.quit()
         return ret
 
@@ -559,8 +1085,8 @@ class GhostBin(Gst.Bin):
             elements = make_elements(bd)
             if elements:
                 self.add_iterable(elements, link_=link_)
-        bin_to_pdf(
-            self, Gst.DebugGraphDetails.ALL, f"{self.name}.__init__.complete")
+        mce.graphs.dump_event(
+            mce.graphs.INIT, self, f"{self.name}.__init__.complete")
 
     def __getitem__(self, item) -> Gst.Element:  # noqa: D105
         return self.get_by_name(item)
@@ -644,12 +1170,20 @@ class InferenceBin(GhostBin):
     _count = itertools.count(0)
 
     def __init__(self, pie_config: str,
-                 on_buffer: Callable = mce.osd.on_buffer,
+                 on_buffer: Optional[Callable] = mce.osd.on_buffer,
+                 relayout: bool = False,
+                 probe_budget: Optional[float] = None,
                  **kwargs):
         """
         Create a new InferenceBin, ready to link to other Gst.Element
 
         :arg pie_config: primary inference config
+        :param on_buffer: a PadProbeCallback to add with add_probe (or None)
+        :param relayout: re-plan the tiler layout whenever the number of
+               linked sources changes
+        :param probe_budget: seconds each probe callback may take per batch
+               before it's called less often (see mce.probes). Default: no
+               budget.
         :param kwargs: keyword arguments passed to make_inference_description
                (see it's documentation for full available parameters)
         """
@@ -657,19 +1191,94 @@ class InferenceBin(GhostBin):
         super().__init__(f'inference_{next(self._count)}', bd=bd)
 
         self.stream_muxer = self['stream-muxer']
+        self._relayout = relayout
         # this is a counter for the pad number to request
         # could possibly need a lock around use in get_sink_pad
         self._pad_counter = 0
+        # indexes of released muxer sink pads, reused before new ones
+        self._free_pads = []  # type: List[int]
         # a counter for the number of sources added
         self._source_counter = 0
+        # muxer sink pad index (frame_meta.pad_index) -> linked source (or
+        # consumer, see SourceBin.add_consumer) name
+        self.slots = {}  # type: Dict[int, str]
+        # muxer sink pad index -> name of the element owning the stream (the
+        # SourceBin, even if the slot is one of several consumers)
+        self.owners = {}  # type: Dict[int, str]
+
+        # every callback added with add_probe shares one probe on the osd
+        # sink pad (or the sink's sink pad if headless)
+        self.probes = mce.probes.ProbeRegistry(probe_budget)
+        element = self.get_by_name('osd') or self.get_by_name('sink')
+        sink_pad = element.get_static_pad('sink')  # type: Gst.Pad
+        if not sink_pad:
+            raise GetPadError(f"could not get {element.name} sink pad")
+        self.probes.attach(sink_pad)
 
         # add on_buffer callback to osd sink pad
-        osd = self.get_by_name('osd')  # tyoe: Gst.Element
-        osd_sink_pad = osd.get_static_pad('sink')  # type: Gst.Pad
-        if not osd_sink_pad:
-            raise GetPadError("could not get nvosd sink pad")
-        osd_sink_pad.add_probe(
-            Gst.PadProbeType.BUFFER, on_buffer, None)
+        if on_buffer is not None:
+            self.add_probe(on_buffer)
+
+        # count overruns on every queue (stage and output)
+        self._overruns = {}  # type: Dict[str, int]
+        for element in self.iterate_elements():  # type: Gst.Element
+            factory = element.get_factory()
+            if factory is not None and factory.get_name() == 'queue':
+                self._overruns[element.name] = 0
+                element.connect('overrun', self._on_overrun)
+
+    def _on_overrun(self, queue: Gst.Element):
+        # not atomic, but this is just for stats
+        self._overruns[queue.name] += 1
+
+    def queue_stats(self) -> Mapping[str, Mapping[str, int]]:
+        """
+        :returns: a mapping of queue name to it's current fill level
+                  ('buffers', 'bytes' and 'time' in nanoseconds), the maximum
+                  ('max_buffers') and how many times it was full ('overruns')
+        """
+        stats = {}
+        for name, overruns in self._overruns.items():
+            queue = self.get_by_name(name)
+            stats[name] = {
+                'buffers': queue.get_property('current-level-buffers'),
+                'bytes': queue.get_property('current-level-bytes'),
+                'time': queue.get_property('current-level-time'),
+                'max_buffers': queue.get_property('max-size-buffers'),
+                'overruns': overruns,
+            }
+        return stats
+
+    def add_probe(self, callback: PadProbeCallback, data: Any = None,
+                  name: Optional[str] = None,
+                  budget: Optional[float] = mce.probes.REGISTRY_BUDGET,
+                  ) -> mce.probes.Registration:
+        """
+        Register a buffer probe callback on the osd sink pad (or the sink's
+        sink pad if headless), where batch metadata from inference is
+        available. Each callback is timed (see probe_stats).
+
+        Boxes are in tiler output pixels (or muxer pixels if headless), not
+        full frame pixels, even for sources with a roi (see mce.roi). Map
+        them with mce.geometry.frame_transform or mce.tracking.FrameMapper.
+
+        :arg callback: a PadProbeCallback (eg. mce.osd.on_buffer)
+        :param data: user data to pass to |callback|
+        :param name: a name for logs and stats (default: |callback|'s name)
+        :param budget: seconds |callback| may take per batch, or None for no
+               budget (default: the InferenceBin's |probe_budget|)
+
+        :returns: a mce.probes.Registration (see ProbeRegistry.unregister)
+        """
+        return self.probes.register(callback, data, name=name, budget=budget)
+
+    def remove_probe(self, registration: mce.probes.Registration):
+        """stop calling a callback added with add_probe"""
+        self.probes.unregister(registration)
+
+    def probe_stats(self) -> Mapping[str, Mapping[str, Any]]:
+        """:returns: call counts and timings of every probe callback"""
+        return self.probes.stats()
 
     @property
     def source_counter(self) -> int:
@@ -678,18 +1287,34 @@ class InferenceBin(GhostBin):
     @source_counter.setter
     def source_counter(self, count: int):
         # setting these at runtime seems to only work half the time
-        # rows_and_columns = calc_rows_and_columns(count)
-        # out_scale = (
-        #     self['tiler'].get_property('width'),
-        #     self['tiler'].get_property('height'),)
-        # in_scale = calc_in_scale(out_scale, rows_and_columns)
         # self['stream-muxer'].set_property('batch-size', count)
-        # self['stream-muxer'].set_property('width', in_scale[0])
-        # self['stream-muxer'].set_property('height', in_scale[1])
         # self['pie'].set_property('batch-size', count)
-        # self['tiler'].set_property('rows', rows_and_columns)
-        # self['tiler'].set_property('columns', rows_and_columns)
         self._source_counter = count
+        if self._relayout:
+            self.plan_layout(count)
+
+    def plan_layout(self, num_sources: int,
+                    source_sizes: Sequence[Tuple[int, int]] = ()):
+        """
+        Re-plan the tiler grid for |num_sources| (see
+        mce.geometry.plan_layout). Does nothing if headless.
+
+        :arg num_sources: the number of sources to lay out
+        :param source_sizes: known (width, height) of the sources
+        """
+        import mce.geometry
+        tiler = self['tiler']
+        if tiler is None:
+            return
+        out_size = (tiler.get_property('width'), tiler.get_property('height'))
+        rows, columns = mce.geometry.plan_layout(
+            num_sources, out_size, source_sizes)
+        if (rows, columns) != (tiler.get_property('rows'),
+                               tiler.get_property('columns')):
+            logger.info(f"tiler layout: {rows}x{columns} for "
+                        f"{num_sources} sources")
+            tiler.set_property('rows', rows)
+            tiler.set_property('columns', columns)
 
     def get_sink_pad(self) -> Gst.GhostPad:
         """
@@ -700,6 +1325,14 @@ class InferenceBin(GhostBin):
         :returns: a Gst.GhostPin, ready to be linked
         """
         logger.debug(f'finding unlinked pad on {self.name}')
+        if self._free_pads:
+            # a slot freed by unlink_source. it's pad_index (and tile) is reused
+            index = self._free_pads.pop(0)
+            inner_pad = self.stream_muxer.get_request_pad(f"sink_{index}")
+            if not inner_pad:
+                raise GetPadError(
+                    f'Could not request sink_{index} from {self.name}.muxer')
+            return self.make_ghost(inner_pad=inner_pad)
         inner_pad = self.find_unlinked_pad(Gst.PadDirection.SINK)  # type:Gst.Pad
         if not inner_pad or inner_pad.parent is not self.stream_muxer:
             logger.debug(
@@ -717,16 +1350,23 @@ class InferenceBin(GhostBin):
     def link_source(self, source: Gst.Element, src_pad: Gst.Pad, *_):
         # TODO: test and see if pausing the pipeline is necessary
         #  (i think it is)
-        logger.debug(f'linking {source.name} to {self.name} by {src_pad.name}')
+        logger.debug("linking %s to %s by %s",
+                     source.name, self.name, src_pad.name)
         if not is_video_pad(src_pad):
-            logger.debug(
-                f"ignoring non-video pad from {source.name} "
-                f"(CAPS: {src_pad.query_caps().to_string()})")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("ignoring non-video pad from %s (CAPS: %s)",
+                             source.name, src_pad.query_caps().to_string())
             return
         self.source_counter += 1
         try:
             sink_pad = self.get_sink_pad()
             link(src_pad, sink_pad)
+            # the target is the muxer's "sink_N" request pad
+            index = int(sink_pad.get_target().name.rsplit('_', 1)[-1])
+            self.slots[index] = (source.consumer_of(src_pad)
+                                 if isinstance(source, SourceBin)
+                                 else source.name)
+            self.owners[index] = source.name
         except Exception as _:
             self.source_counter -= 1
             logger.error(
@@ -734,6 +1374,288 @@ class InferenceBin(GhostBin):
                 exc_info=sys.exc_info(),)
             raise
 
+    def unlink_source(self, source: Gst.Element, hold=False) -> List[int]:
+        """
+        Unlink a source linked with :meth:`~link_source` and release it's
+        muxer sink pad, so the next source linked takes it's slot. The source
+        should already be in the NULL state.
+
+        :param hold: keep the slots (and their names in :attr:`slots`) for
+                     frames still in flight, until :meth:`~release_slot`.
+                     Sources linked meanwhile take other slots.
+
+        :returns: the slots (muxer pad indexes) unlinked
+        """
+        indexes = []
+        for src_pad in source.srcpads:  # type: Gst.Pad
+            ghost = src_pad.get_peer()  # type: Gst.GhostPad
+            if ghost is None or ghost.get_parent() is not self:
+                continue
+            src_pad.unlink(ghost)
+            target = ghost.get_target()  # type: Gst.Pad
+            index = int(target.name.rsplit('_', 1)[-1])
+            self.remove_pad(ghost)
+            # reset the muxer pad (as if the stream was flushed) and free it
+            target.send_event(Gst.Event.new_flush_stop(False))
+            self.stream_muxer.release_request_pad(target)
+            if not hold:
+                self.release_slot(index)
+            self.source_counter -= 1
+            indexes.append(index)
+            logger.debug(f"unlinked {source.name} from {self.name} slot {index}")
+        return indexes
+
+    def release_slot(self, index: int):
+        """free a slot held by :meth:`~unlink_source` for the next source"""
+        self.slots.pop(index, None)
+        self.owners.pop(index, None)
+        if index not in self._free_pads:
+            self._free_pads.append(index)
+            self._free_pads.sort()
+
+
+class SourceBin(GhostBin):
+    """
+    A GhostBin wrapping a uridecodebin. When decoded video appears, it is
+    ghosted to the outside of the SourceBin, so the SourceBin's "pad-added"
+    signal can be used to link it (eg. to :meth:`InferenceBin.link_source`).
+
+    If any encoded branches are added with :meth:`~add_encoded_branch`, the
+    uridecodebin stops at (still encoded) h264/h265 video. That is split by a
+    tee: one branch is decoded for inference and the rest get the encoded
+    stream as is (for recording, archiving, ...), with no re-encoding.
+
+    If a |roi| is supplied, decoded video is cropped to it before it's
+    ghosted.
+
+    If a |max_fps| is supplied, frames are dropped as early as possible: by
+    the decoder itself (nvv4l2decoder's drop-frame-interval), if the
+    |source_fps| is known, which only works in whole intervals and can't be
+    changed once started, then by a videorate (drop-only) for the rest. The
+    videorate's limit may be changed at any time with :meth:`~set_max_fps`.
+
+    The same decoded video may feed several muxer slots (consumers, see
+    :meth:`~add_consumer`), eg. with different rois. The stream is then
+    fetched and decoded once and split by a tee, with a ghost pad per
+    consumer. The SourceBin's own name is it's first consumer.
+
+    :arg name: the (unique) name to give the SourceBin
+    :arg uri: a uri for uridecodebin
+    :param roi: an optional mce.geometry.Roi to crop to
+    :param max_fps: an optional maximum frame rate
+    :param source_fps: the source's frame rate, if known (eg. from
+           mce.discover), for decoder level frame dropping
+    :param rate_limiter: add a videorate even without a |max_fps|, so
+           :meth:`~set_max_fps` works later (eg. for mce.overload)
+    """
+
+    def __init__(self, name: str, uri: str, roi=None,
+                 max_fps: Optional[float] = None,
+                 source_fps: Optional[float] = None,
+                 rate_limiter: bool = False):
+        super().__init__(name)
+        self.uri = uri
+        self.max_fps = max_fps
+        self.source_fps = source_fps
+        self._rate_limiter = rate_limiter or max_fps is not None
+        self._rate = None  # type: Optional[Gst.Element]
+        # (name, roi) for every consumer of the decoded video
+        self._consumers = [(name, roi)]  # type: List[Tuple[str, Any]]
+        # "element:pad" of each consumer's inner pad -> consumer name
+        self._consumer_pads = {}  # type: Dict[str, str]
+        # consumer name -> frames delivered
+        self._frames = {}  # type: Dict[str, int]
+        self._encoded_branches = []  # type: List[EncodedBranchFactory]
+        self._uridecodebin = make_element(
+            'uridecodebin', f'{name}_uridecodebin')
+        self._uridecodebin.set_property('uri', uri)
+        self._uridecodebin.set_property(
+            'caps', Gst.Caps.from_string("video/x-raw(ANY)"))
+        self._uridecodebin.set_property('expose-all-streams', False)
+        self._uridecodebin.set_property('async-handling', True)
+        self._uridecodebin.connect('pad-added', self._on_uridecodebin_pad)
+        self._uridecodebin.connect('element-added', self._on_child_added)
+        self.add(self._uridecodebin)
+
+    def add_encoded_branch(self, factory: EncodedBranchFactory):
+        """
+        Add an encoded branch. Must be called before the SourceBin leaves the
+        NULL state.
+
+        :arg factory: an EncodedBranchFactory, called when the encoded pad
+             appears. The elements it returns are added to the SourceBin and
+             linked, in order, to the encoded tee.
+        """
+        self._encoded_branches.append(factory)
+        self._uridecodebin.set_property('caps', Gst.Caps.from_string(
+            f"video/x-raw(ANY); {ENCODED_VIDEO_CAPS}"))
+
+    def _on_child_added(self, bin_: Gst.Bin, element: Gst.Element):
+        # logic borrowed from :
+        # https://github.com/NVIDIA-AI-IOT/deepstream_reference_apps/blob/master/runtime_source_add_delete/deepstream_test_rt_src_add_del.c
+        # sets properties on the nvv4l2decoder elements so that the pipeline
+        # but setting these doesn't seem to do anything
+        logger.debug("%s child added: %s", bin_.name, element.name)
+        if element.name.startswith('decodebin'):
+            # add this callback to the sub-bin
+            logger.debug("adding element-added callback to %s", element.name)
+            element.connect('element-added', self._on_child_added)
+        elif element.name.startswith('nvv4l2decoder'):
+            logger.debug("setting properties on decoder: %s", element.name)
+            element.set_property('enable-max-performance', True)
+            element.set_property('bufapi-version', True)
+            # only settable before the decoder starts, so it can't follow
+            # set_max_fps. the videorate does that.
+            interval = calc_drop_interval(self.source_fps, self.max_fps)
+            if interval:
+                logger.info(f"{self.name}: decoding every {interval} frames")
+            element.set_property('drop-frame-interval', interval)
+            element.set_property('num-extra-surfaces', 0)
+
+    def add_consumer(self, name: str, roi=None):
+        """
+        Feed another muxer slot from this source's decoded video. Must be
+        called before the SourceBin leaves the NULL state.
+
+        :arg name: a unique name for the consumer (reported in
+             InferenceBin.slots instead of the SourceBin's name)
+        :param roi: an optional mce.geometry.Roi to crop the consumer to
+        """
+        self._consumers.append((name, roi))
+
+    @property
+    def consumers(self) -> List[str]:
+        """the names of every consumer (the first is the SourceBin's name)"""
+        return [name for name, _ in self._consumers]
+
+    def consumer_of(self, pad: Gst.Pad) -> str:
+        """:returns: the consumer name for one of the SourceBin's src pads"""
+        target = pad.get_target() if isinstance(pad, Gst.GhostPad) else None
+        if target is None:
+            return self.name
+        return self._consumer_pads.get(_pad_key(target), self.name)
+
+    def stats(self) -> Mapping[str, Mapping[str, Any]]:
+        """:returns: a mapping of consumer name to 'uri' and 'frames'"""
+        return {name: {'uri': self.uri, 'frames': self._frames.get(name, 0)}
+                for name in self.consumers}
+
+    def set_max_fps(self, max_fps: Optional[float]) -> bool:
+        """
+        Change the maximum frame rate (None for no limit). Safe to call while
+        playing, from any thread.
+
+        :returns: False if there's no rate limiter to change (see __init__)
+        """
+        self.max_fps = max_fps
+        if self._rate is None:
+            if self._uridecodebin.get_state(0)[1] == Gst.State.NULL:
+                # not started, so a limiter can still be added
+                self._rate_limiter = self._rate_limiter or max_fps is not None
+            return self._rate_limiter
+        # videorate's max-rate is a whole number of frames per second
+        self._rate.set_property(
+            'max-rate', max(1, int(round(max_fps))) if max_fps else GLib.MAXINT)
+        return True
+
+    def _expose(self, pad: Gst.Pad):
+        """ghost decoded video |pad| for every consumer"""
+        if self._rate_limiter:
+            self._rate = make_element('videorate', f'{self.name}_rate')
+            self._rate.set_property('drop-only', True)
+            self._rate.set_property('skip-to-first', True)
+            self.set_max_fps(self.max_fps)
+            add_iterable(self, (self._rate,))
+            link(pad, self._rate.get_static_pad('sink'))
+            self._rate.sync_state_with_parent()
+            pad = self._rate.get_static_pad('src')
+        if len(self._consumers) == 1:
+            self._expose_consumer(pad, *self._consumers[0])
+            return
+        tee = make_element('tee', f'{self.name}_decoded_tee')
+        add_iterable(self, (tee,))
+        link(pad, tee.get_static_pad('sink'))
+        tee.sync_state_with_parent()
+        for name, roi in self._consumers:
+            # a thread per consumer, so one muxer pad waiting doesn't stall
+            # the others. small, since NVMM buffers come from a small pool.
+            queue = make_element('queue', f'{name}_consumer_queue')
+            queue.set_property('max-size-buffers', 2)
+            queue.set_property('max-size-bytes', 0)
+            queue.set_property('max-size-time', 0)
+            add_iterable(self, (queue,))
+            link(tee.get_request_pad('src_%u'), queue.get_static_pad('sink'))
+            queue.sync_state_with_parent()
+            self._expose_consumer(queue.get_static_pad('src'), name, roi)
+
+    def _expose_consumer(self, pad: Gst.Pad, name: str, roi):
+        """ghost |pad| for consumer |name|, cropping it first if there's a roi"""
+        if roi is not None:
+            import mce.roi
+            crop = make_element('nvvideoconvert', f'{name}_crop')
+            crop.set_property('src-crop', mce.roi.crop_property(roi))
+            crop_caps = make_element('capsfilter', f'{name}_crop_caps')
+            crop_caps.set_property('caps', mce.roi.crop_caps(roi))
+            add_iterable(self, (crop, crop_caps))
+            link(pad, crop.get_static_pad('sink'))
+            for element in (crop, crop_caps):
+                element.sync_state_with_parent()
+            pad = crop_caps.get_static_pad('src')
+        # before make_ghost, since linking happens on "pad-added"
+        self._consumer_pads[_pad_key(pad)] = name
+        self._frames[name] = 0
+        pad.add_probe(Gst.PadProbeType.BUFFER, self._count_frame, name)
+        self.make_ghost(inner_pad=pad)
+
+    def _count_frame(self, _: Gst.Pad, __: Gst.PadProbeInfo, name: str
+                     ) -> Gst.PadProbeReturn:
+        # not atomic, but this is just for stats
+        self._frames[name] += 1
+        return Gst.PadProbeReturn.OK
+
+    def _on_uridecodebin_pad(self, _: Gst.Element, pad: Gst.Pad):
+        if is_video_pad(pad):
+            self._expose(pad)
+            return
+        caps_name = pad.query_caps().get_structure(0).get_name()
+        if not caps_name.startswith('video/') or not self._encoded_branches:
+            logger.debug(f"{self.name}: ignoring {caps_name} pad {pad.name}")
+            return
+        self._tee_encoded(pad, caps_name)
+
+    def _tee_encoded(self, pad: Gst.Pad, caps_name: str):
+        """split encoded |pad| into a decoded branch and encoded branches"""
+        tee = make_element('tee', f'{self.name}_encoded_tee')
+        decode_queue = make_element('queue', f'{self.name}_decode_queue')
+        decodebin = make_element('decodebin', f'{self.name}_decodebin')
+        decodebin.connect('pad-added', self._on_decodebin_pad)
+        decodebin.connect('element-added', self._on_child_added)
+        branches = [[decode_queue, decodebin]]
+        for factory in self._encoded_branches:
+            elements = factory(self, caps_name)
+            if elements:
+                branches.append(elements)
+        for elements in branches:
+            add_iterable(self, elements)
+        add_iterable(self, (tee,), link_=False)
+        for elements in branches:
+            link(tee.get_request_pad('src_%u'),
+                 elements[0].get_static_pad('sink'))
+        link(pad, tee.get_static_pad('sink'))
+        for elements in itertools.chain(((tee,),), branches):
+            for element in elements:
+                element.sync_state_with_parent()
+
+    def _on_decodebin_pad(self, _: Gst.Element, pad: Gst.Pad):
+        if is_video_pad(pad):
+            self._expose(pad)
+
+
+def _pad_key(pad: Gst.Pad) -> str:
+    """:returns: a key identifying |pad| by it's parent and name"""
+    parent = pad.get_parent()
+    return f"{parent.name if parent else ''}:{pad.name}"
+
 
 def youtube_in_uris(uris: Iterable[str]) -> bool:
     """
@@ -762,7 +1684,7 @@ def convert_uris(uris: Iterable[str], ydl = None) -> Iterator[str]:
         with youtube_dl.YoutubeDL({'format': 'best'}) as ydl:
             for uri in convert_uris(_uris, ydl=ydl):
                 yield uri
-        raise StopIteration()
+        return
     for uri in uris:
         # if the uri is a filename, convert it to a file uri and yield it
         if os.path.isfile(uri):
@@ -802,10 +1724,41 @@ class DeepStreamApp(StateSetter):
     A Gst.Pipeline subclass with extra functionality specific to DeepStream.
 
     :arg pie_config: path to the primary inference config file
-    :param sources: urls or filenames to add and link on __enter__
+    :param sources: urls, filenames or Source (eg. with a roi) to add and link
+           on __enter__
     :param loop: a GLib.MainLoop (or one will be created)
     :param bus_cb: a bus callback, (default mce.bus.on_message)
     :param on_buffer: a per-buffer callback to attach to osd element (default: mce.osd.on_buffer)
+           If |headless| (in kwargs), the default is no callback, since
+           there is no display to draw on.
+    :param recorder: an mce.record.EventRecorder to record detection events
+           from every source (default: no recording)
+    :param archive: a directory to archive every source to, as is, without
+           re-encoding (default: no archiving). Segments are named
+           "(start time)_(source)_(segment).mkv", so runs don't overwrite
+           each other.
+    :param archive_segment: length of each archive segment in seconds
+    :param rtsp: an mce.rtsp.RtspServer. If |sink| (in kwargs) is RTSP_SINK,
+           or an RTSP_OUTPUT is in |outputs|, the tiled output is served at
+           "/mce". If None, one is created on the default port when needed.
+    :param rtsp_sources: also serve every source, as is, at "/source_N"
+    :param probe: probe every source (concurrently, see mce.discover) before
+           building the InferenceBin, so the muxer resolution, tiler layout
+           and batch timeout are planned from their actual sizes and frame
+           rates. Arguments in |kwargs| take precedence over the plan.
+    :param probe_timeout: seconds to wait for each source when probing
+    :param patrol: an mce.patrol.Patrol to rotate (more) cameras through
+           it's own muxer slots, in addition to |sources|
+    :param rate_limiters: give every source a rate limiter, so
+           :meth:`~set_max_fps` works on sources without a max_fps
+    :param overload: an mce.overload.OverloadController to shed load when
+           the pipeline falls behind (implies |rate_limiters|)
+    :param zones: an mce.zones.ZoneAnalytics to count every batch
+    :param rollup: an mce.rollup.Rollup to keep object count time-series in
+    :param tracks: an mce.tracks.TrackEvents to turn tracked objects into
+           events (flushed on exit)
+    :param classifier_cache: an mce.classify.ClassifierCache to classify
+           each tracked object once (needs secondaries, in kwargs)
     :param kwargs: passed to the infernce
     """
 
@@ -814,18 +1767,57 @@ class DeepStreamApp(StateSetter):
     _source_counter = 0
 
     def __init__(self, pie_config,
-                 sources: Iterable[str] = None,
+                 sources: Iterable[Union[str, Source]] = None,
                  loop: Optional[GLib.MainLoop] = None,
                  bus_cb: BusCallback = mce.bus.on_message,
-                 on_buffer: PadProbeCallback = mce.osd.on_buffer,
+                 on_buffer: Optional[PadProbeCallback] = None,
+                 recorder=None,
+                 archive: Optional[str] = None,
+                 archive_segment: float = 600.0,
+                 rtsp=None,
+                 rtsp_sources: bool = False,
+                 probe: bool = False,
+                 probe_timeout: float = 5.0,
+                 patrol=None,
+                 rate_limiters: bool = False,
+                 overload=None,
+                 zones=None,
+                 rollup=None,
+                 tracks=None,
+                 classifier_cache=None,
                  **kwargs):
         logger.debug(f"{self.__class__.__name__}.__init__")
         Gst.Pipeline.__init__(self)
         self._pie_config = pie_config
-        self._uris = list(sources) if sources else []  # type: List[str]
+        self._sources = [
+            Source(s) if isinstance(s, str) else s for s in sources or ()
+        ]  # type: List[Source]
+        # source name -> roi, filled as sources are added
+        self._rois = {}  # type: Dict[str, Any]
         self._loop = loop if loop else GLib.MainLoop()
         self._bus_cb = bus_cb
+        if on_buffer is None and not kwargs.get('headless'):
+            on_buffer = mce.osd.on_buffer
         self._on_buffer = on_buffer
+        self._recorder = recorder  # type: Optional[mce.record.EventRecorder]
+        self._archive = archive
+        self._archive_segment = archive_segment
+        # segment filenames start with when the app was made, so every run
+        # (where source names repeat) writes it's own
+        self._archive_prefix = f"{time.strftime('%Y%m%d-%H%M%S')}_"
+        self._rtsp = rtsp  # type: Optional[mce.rtsp.RtspServer]
+        self._rtsp_sources = rtsp_sources
+        self._probe = probe
+        self._probe_timeout = probe_timeout
+        self._patrol = patrol  # type: Optional[mce.patrol.Patrol]
+        self._overload = overload  # type: Optional[mce.overload.OverloadController]
+        self._rate_limiters = rate_limiters or overload is not None
+        self._zones = zones  # type: Optional[mce.zones.ZoneAnalytics]
+        self._rollup = rollup  # type: Optional[mce.rollup.Rollup]
+        self._tracks = tracks  # type: Optional[mce.tracks.TrackEvents]
+        self._classifier_cache = classifier_cache
+        # uri -> mce.discover.SourceInfo (or None), if probed
+        self._source_info = {}  # type: Dict[str, Any]
         self._inference_kwargs = kwargs
 
     def __enter__(self):  # noqa: D105
@@ -837,72 +1829,303 @@ class DeepStreamApp(StateSetter):
             logger.error("could not get bus")
         bus.add_watch(
             GLib.PRIORITY_DEFAULT,
-            self._bus_cb,
+            self._on_message,
             self)
 
+        # (uri, Source) for every source (a youtube playlist may expand to
+        # several uris)
+        sources = [
+            (uri, source) for source in self._sources
+            for uri in convert_uris((source.uri,))
+        ]
+        kwargs = dict(self._inference_kwargs)
+        if self._probe and sources:
+            kwargs.update(self._plan(sources, kwargs))
+
+        # a fixed number of slots may be passed instead (see add_source)
+        kwargs.setdefault('num_sources', len(sources) + (
+            self._patrol.slots if self._patrol is not None else 0))
+
         # create the inference bin, and add it to self
         self._inference_bin = InferenceBin(
             self._pie_config,
             on_buffer=self._on_buffer,
-            num_sources=len(self._uris),
-            **self._inference_kwargs,
+            **kwargs,
         )
         self.add(self._inference_bin)
 
-        # add and link all sources
-        if self._uris:
-            for uri in convert_uris(self._uris):
-                # noinspection PyTypeChecker
-                self._add_source(uri)
-
-        bin_to_pdf(
-            self, Gst.DebugGraphDetails.ALL, f"{self.name}.__enter__.complete")
+        # the rtsp appsink is "rtsp_sink" when it's one of several outputs,
+        # otherwise "sink" (unless headless, when "sink" is a fakesink)
+        rtsp_sink = self._inference_bin['rtsp_sink']
+        if rtsp_sink is None and not self._inference_kwargs.get('headless') \
+                and self._inference_kwargs.get('sink') == RTSP_SINK:
+            rtsp_sink = self._inference_bin['sink']
+        if rtsp_sink is not None or self._rtsp_sources:
+            import mce.rtsp
+            if self._rtsp is None:
+                self._rtsp = mce.rtsp.RtspServer()
+            if rtsp_sink is not None:
+                self._rtsp.connect_appsink(rtsp_sink, mce.rtsp.DEFAULT_MOUNT)
+
+        if self._recorder is not None:
+            # recordings are of the (shared) stream, not a consumer of it
+            self._recorder.slots = self._inference_bin.owners
+            self._inference_bin.add_probe(self._recorder.on_buffer)
+
+        # add and link all sources. a uri listed more than once is fetched
+        # and decoded once, feeding a slot per listing.
+        shared = {}  # type: Dict[str, SourceBin]
+        for uri, source in sources:
+            if uri in shared:
+                name = f'source_{self._source_counter}'
+                self._source_counter += 1
+                shared[uri].add_consumer(name, source.roi)
+                if source.roi is not None:
+                    self._rois[name] = source.roi
+                # a shared decode runs at the fastest rate any listing wants
+                bin_ = shared[uri]
+                if bin_.max_fps is not None:
+                    bin_.set_max_fps(None if source.max_fps is None
+                                     else max(bin_.max_fps, source.max_fps))
+            else:
+                shared[uri] = self._add_source(
+                    uri, roi=source.roi, max_fps=source.max_fps)
+        if self._patrol is not None:
+            self._patrol.start(self)
+        if self._overload is not None:
+            self._overload.start(self)
+        if self._zones is not None:
+            self._zones.start(self)
+        if self._rollup is not None:
+            self._rollup.start(self)
+        if self._tracks is not None:
+            self._tracks.start(self)
+        if self._classifier_cache is not None:
+            self._classifier_cache.start(self)
+
+        if self._rois or (self._patrol is not None and any(
+                camera.roi for camera in self._patrol.cameras)):
+            import mce.roi
+            mce.roi.RoiMapper(
+                self._rois, self._inference_bin.slots,
+            ).attach(self._inference_bin)
+
+        mce.graphs.dump_event(
+            mce.graphs.APP, self, f"{self.name}.__enter__.complete")
         return self
 
-    def _on_decode_bin_child_added(self, bin_: Gst.Bin,
-                                   element: Gst.Element):
-        # logic borrowed from :
-# https://github.com/NVIDIA-AI-IOT/deepstream_reference_apps/blob/master/runtime_source_add_delete/deepstream_test_rt_src_add_del.c
-        # sets properties on the nvv4l2decoder elements so that the pipeline
-        # but setting these doesn't seem to do anything
-        logger.debug(f"{bin_.name} child added: {element.name}")
-        if element.name.startswith('decodebin'):
-            # add this callback to the sub-bin
-            logger.debug(f'adding element-added callback to {element.name}')
-            element.connect('element-added', self._on_decode_bin_child_added)
-        elif element.name.startswith('nvv4l2decoder'):
-            logger.debug(f'setting properties on decoder: {element.name}')
-            element.set_property('enable-max-performance', True)
-            element.set_property('bufapi-version', True)
-            element.set_property('drop-frame-interval', 0)
-            element.set_property('num-extra-surfaces', 0)
+    def _on_message(self, bus: Gst.Bus, message: Gst.Message, app) -> bool:
+        if self._patrol is not None and self._patrol.on_message(bus, message):
+            return True
+        return self._bus_cb(bus, message, app)
+
+    def _plan(self, sources: Sequence[Tuple[str, Source]],
+              kwargs: Mapping[str, Any]) -> Dict[str, Any]:
+        """
+        Probe |sources| and plan the InferenceBin from the results.
+
+        :returns: planned kwargs not already in |kwargs| (live is or-ed)
+        """
+        import mce.discover
+        infos = mce.discover.probe_all(
+            (uri for uri, _ in sources), self._probe_timeout)
+        self._source_info.update(infos)
+        planned = mce.discover.plan(
+            [infos[uri] for uri, _ in sources],
+            [source.roi for _, source in sources])
+        logger.info(f"probed {sum(map(bool, infos.values()))} of "
+                    f"{len(infos)} sources: {planned}")
+        planned['live'] = planned['live'] or kwargs.get('live', False)
+        return {k: v for k, v in planned.items()
+                if k == 'live' or k not in kwargs}
+
+    def add_probe(self, callback: PadProbeCallback, data: Any = None,
+                  **kwargs) -> mce.probes.Registration:
+        """
+        Add a buffer probe where batch metadata is available. Must be called
+        after __enter__. See InferenceBin.add_probe.
+        """
+        return self._inference_bin.add_probe(callback, data, **kwargs)
+
+    def remove_probe(self, registration: mce.probes.Registration):
+        """stop calling a callback added with add_probe"""
+        self._inference_bin.remove_probe(registration)
+
+    def probe_stats(self) -> Mapping[str, Mapping[str, Any]]:
+        """:returns: call counts and timings of every probe callback"""
+        return self._inference_bin.probe_stats()
 
-    def _add_source(self, uri: str):
+    def queue_stats(self) -> Mapping[str, Mapping[str, int]]:
+        """:returns: fill levels of the inference queues (see InferenceBin)"""
+        return self._inference_bin.queue_stats()
+
+    def set_max_fps(self, name: str, max_fps: Optional[float]) -> bool:
+        """
+        Change the maximum frame rate of a source (by source or consumer
+        name) while running. A shared decode (see SourceBin.add_consumer) is
+        limited for every consumer.
+
+        :returns: False if the source wasn't found or can't be limited
+        """
+        for element in self.children:
+            if isinstance(element, SourceBin) and name in element.consumers:
+                return element.set_max_fps(max_fps)
+        return False
+
+    def source_stats(self) -> Mapping[str, Mapping[str, Any]]:
+        """
+        :returns: a mapping of source (or consumer) name to it's 'uri' and
+                  'frames' delivered to the muxer
+        """
+        stats = {}
+        for element in self.children:
+            if isinstance(element, SourceBin):
+                stats.update(element.stats())
+        return stats
+
+    @property
+    def slots(self) -> Mapping[int, str]:
+        """muxer pad index (frame_meta.pad_index) -> source name"""
+        return self._inference_bin.slots
+
+    def source_content(self, name: str,
+                       ) -> Optional[Tuple[Tuple[int, int], Tuple[int, int]]]:
+        """
+        :returns: the (width, height) of what a source (or consumer) scales
+                  into the muxer and it's (left, top) offset in the full
+                  frame: the Roi, if cropped, otherwise the whole frame, if
+                  probed. None if unknown.
         """
-        Adds a source uridecodebin to the app and sets up a callback to link it
-        to the inference bin.
+        roi = self._rois.get(name)
+        if roi is not None:
+            return (roi.width, roi.height), (roi.left, roi.top)
+        for element in self.children:
+            if isinstance(element, SourceBin) and name in element.consumers:
+                info = self._source_info.get(element.uri)
+                if info is not None and info.width and info.height:
+                    return (info.width, info.height), (0, 0)
+        return None
+
+    def add_source(self, uri: str, roi=None, standby: bool = False,
+                   max_fps: Optional[float] = None) -> SourceBin:
+        """
+        Add a source while the app is running (or before it starts). Must be
+        called after __enter__ and from the main loop's thread.
 
         :arg uri: a uri for uridecodebin
+        :param roi: an optional mce.geometry.Roi to crop the source to
+        :param max_fps: an optional maximum frame rate for the source
+        :param standby: don't link the source. Instead, lock it in PAUSED (so
+               a live source connects, but pushes nothing) until
+               :meth:`~activate_source` is called.
+
+        :returns: the SourceBin added
+        """
+        source = self._add_source(
+            uri, roi=roi, max_fps=max_fps, link_=not standby)
+        if standby:
+            source.set_locked_state(True)
+            source.set_state(Gst.State.PAUSED)
+        else:
+            source.sync_state_with_parent()
+        return source
+
+    def activate_source(self, source: SourceBin):
+        """link a source added with standby=True and start it"""
+        for src_pad in source.srcpads:  # type: Gst.Pad
+            if not src_pad.is_linked():
+                self._inference_bin.link_source(source, src_pad)
+        source.connect('pad-added', self._inference_bin.link_source)
+        source.set_locked_state(False)
+        source.sync_state_with_parent()
+
+    def remove_source(self, source: SourceBin, hold=False) -> List[int]:
+        """
+        Stop and remove a source, freeing it's muxer slot for the next source
+        added. Must be called from the main loop's thread.
+
+        :param hold: keep the source's slots, and their names in
+                     :attr:`slots`, until :meth:`release_slot` (eg. so frames
+                     still in the muxer and nvinfer are attributed to it)
+
+        :returns: the source's slots (muxer pad indexes)
+        """
+        source.set_state(Gst.State.NULL)
+        indexes = self._inference_bin.unlink_source(source, hold=hold)
+        self._rois.pop(source.name, None)
+        self.remove(source)
+        return indexes
+
+    def release_slot(self, index: int):
+        """
+        Free a slot held by :meth:`remove_source` for the next source added.
+        Must be called from the main loop's thread.
+        """
+        self._inference_bin.release_slot(index)
+
+    def _add_source(self, uri: str, roi=None, max_fps: Optional[float] = None,
+                    link_=True) -> SourceBin:
+        """
+        Adds a SourceBin to the app and sets up a callback to link it to the
+        inference bin.
+
+        :arg uri: a uri for uridecodebin
+        :param roi: an optional mce.geometry.Roi to crop the source to
+        :param max_fps: an optional maximum frame rate for the source
+        :param ``link_``: if false, don't link the source (yet)
+
+        :returns: the SourceBin added
         """
-        uridecodebin = Gst.ElementFactory.make(
-            'uridecodebin', f'source_{self._source_counter}')  # type: Gst.Element
-        uridecodebin.set_property('uri', uri)
-        uridecodebin.set_property('caps', Gst.Caps.from_string("video/x-raw(ANY)"))
-        uridecodebin.set_property('expose-all-streams', False)
-        uridecodebin.set_property('async-handling', True)
-        uridecodebin.connect('pad-added', self._inference_bin.link_source)
-        uridecodebin.connect('element-added', self._on_decode_bin_child_added)
-        self.add(uridecodebin)
+        info = self._source_info.get(uri)
+        source = SourceBin(
+            f'source_{self._source_counter}', uri, roi=roi, max_fps=max_fps,
+            source_fps=info.fps if info else None,
+            rate_limiter=self._rate_limiters)
+        if roi is not None:
+            self._rois[source.name] = roi
+        if self._recorder is not None:
+            source.add_encoded_branch(self._recorder.make_branch)
+        if self._archive is not None:
+            source.add_encoded_branch(self._make_archive_branch)
+        if self._rtsp_sources:
+            source.add_encoded_branch(self._rtsp.make_branch)
+        if link_:
+            source.connect('pad-added', self._inference_bin.link_source)
+        self.add(source)
         self._source_counter += 1
+        return source
+
+    def _make_archive_branch(self, source_bin: SourceBin, caps_name: str
+                             ) -> Optional[List[Gst.Element]]:
+        """an EncodedBranchFactory for archiving sources"""
+        bd = make_archive_description(
+            source_bin.name, caps_name, self._archive, self._archive_segment,
+            prefix=self._archive_prefix)
+        if bd is None:
+            logger.warning(f"{source_bin.name}: can't archive {caps_name}")
+            return None
+        elements = make_elements(bd)
+        elements[-1].set_property('muxer', make_element(
+            'matroskamux', f'{source_bin.name}_archive_muxer'))
+        return elements
 
     def __exit__(self, exc_type, exc_value, traceback):  # noqa: D105
         exc_info = None
         if exc_type is not None and exc_type is not KeyboardInterrupt:
             exc_info = sys.exc_info()
         logger.debug(f"{self.name}.__exit__", exc_info=exc_info)
-        bin_to_pdf(
-            self, Gst.DebugGraphDetails.ALL, f"{self.name}.__exit__.begin")
+        mce.graphs.dump_event(
+            mce.graphs.APP, self, f"{self.name}.__exit__.begin")
         self.quit()
+        # so another app in this process isn't probed or ticked against this
+        # (stopped) one
+        for analytics in (self._classifier_cache, self._tracks,
+                          self._rollup, self._zones, self._overload,
+                          self._patrol):
+            if analytics is not None:
+                analytics.stop()
+        if self._recorder is not None:
+            self._recorder.close()
         # todo: this gets called twice on an EOS exit, while not a big problem,
         #  it could be in the future if quit() becomes more complex.
         if exc_type is KeyboardInterrupt:
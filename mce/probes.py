@@ -0,0 +1,236 @@
+"""
+A registry of per-batch callbacks sharing a single pad probe.
+
+Every analytic that wants batch metadata (counting, recording, export...)
+registers with a :class:`ProbeRegistry` instead of adding it's own pad probe.
+The registry times every call, and a callback that runs over it's budget is
+called less often (every 2nd batch, then every 4th...) and, if it's still over
+budget at the longest interval, disabled. Each step is logged as a warning, so
+a slow analytic costs a few frames of metadata, not the streaming thread.
+"""
+
+# Copyright (c) 2020 Michael de Gans
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import logging
+import time
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    List,
+    Mapping,
+    Optional,
+)
+
+logger = logging.getLogger(__name__)
+
+__all__ = [
+    'MAX_INTERVAL',
+    'ProbeRegistry',
+    'REGISTRY_BUDGET',
+    'Registration',
+]
+
+# the most batches a slow callback may be skipped for before it's disabled
+MAX_INTERVAL = 16
+# consecutive calls over budget before a callback is slowed down
+STRIKES = 3
+# consecutive calls within half the budget before it's sped up again
+RECOVER = 100
+# the budget of a callback registered without one: the registry's (None is
+# no budget)
+REGISTRY_BUDGET = object()
+
+PadProbeCallback = Callable[
+    [Gst.Pad, Gst.PadProbeInfo, Any],
+    Gst.PadProbeReturn,
+]
+
+
+class Registration(object):
+    """
+    A callback registered with a ProbeRegistry and it's stats.
+
+    :arg name: a unique name for the callback (used in logs and stats)
+    :arg callback: a PadProbeCallback
+    :arg data: user data to pass to |callback|
+    :arg budget: seconds a call may take (or None for no budget)
+    """
+
+    def __init__(self, name: str, callback: PadProbeCallback, data: Any,
+                 budget: Optional[float]):
+        self.name = name
+        self.callback = callback
+        self.data = data
+        self.budget = budget
+        # call every |interval| batches
+        self.interval = 1
+        self.enabled = True
+        self.calls = 0
+        self.skipped = 0
+        self.errors = 0
+        self.over_budget = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self._strikes = 0
+        self._good = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """:returns: call counts and timings (times in seconds)"""
+        return {
+            'calls': self.calls,
+            'skipped': self.skipped,
+            'errors': self.errors,
+            'over_budget': self.over_budget,
+            'mean_time': self.total_time / self.calls if self.calls else 0.0,
+            'max_time': self.max_time,
+            'budget': self.budget,
+            'interval': self.interval,
+            'enabled': self.enabled,
+        }
+
+    def account(self, elapsed: float):
+        """record a call taking |elapsed| seconds and apply the budget"""
+        self.calls += 1
+        self.total_time += elapsed
+        if elapsed > self.max_time:
+            self.max_time = elapsed
+        if self.budget is None:
+            return
+        if elapsed > self.budget:
+            self.over_budget += 1
+            self._good = 0
+            self._strikes += 1
+            if self._strikes >= STRIKES:
+                self._strikes = 0
+                self._slow_down(elapsed)
+        else:
+            self._strikes = 0
+            if self.interval > 1 and elapsed < self.budget / 2:
+                self._good += 1
+                if self._good >= RECOVER:
+                    self._good = 0
+                    self.interval //= 2
+                    logger.info(f"probe {self.name} back within budget, now "
+                                f"every {self.interval} batches")
+
+    def _slow_down(self, elapsed: float):
+        took = f"{elapsed * 1000:.2f}ms (budget {self.budget * 1000:.2f}ms)"
+        if self.interval >= MAX_INTERVAL:
+            self.enabled = False
+            logger.warning(f"probe {self.name} took {took} every "
+                           f"{self.interval} batches. disabling it.")
+        else:
+            self.interval *= 2
+            logger.warning(f"probe {self.name} took {took}. calling it every "
+                           f"{self.interval} batches.")
+
+
+class ProbeRegistry(object):
+    """
+    A single pad probe calling every registered callback, in the order
+    registered, with the same arguments a pad probe gets. If a callback
+    returns Gst.PadProbeReturn.DROP, the buffer is dropped and the callbacks
+    after it aren't called.
+
+    Callbacks may be registered (or removed) while streaming.
+
+    :param budget: the default budget for callbacks, in seconds (default: no
+           budget)
+    """
+
+    def __init__(self, budget: Optional[float] = None):
+        self.budget = budget
+        self.batches = 0
+        # replaced, never mutated, so the streaming thread needs no lock
+        self._registrations = []  # type: List[Registration]
+
+    def attach(self, pad: Gst.Pad):
+        """add the probe to |pad|"""
+        pad.add_probe(Gst.PadProbeType.BUFFER, self.on_buffer, None)
+
+    def register(self, callback: PadProbeCallback, data: Any = None,
+                 name: Optional[str] = None,
+                 budget: Optional[float] = REGISTRY_BUDGET,
+                 ) -> Registration:
+        """
+        Register a callback.
+
+        :arg callback: a PadProbeCallback (eg. mce.osd.on_buffer)
+        :param data: user data to pass to |callback|
+        :param name: a name for logs and stats (default: |callback|'s
+               qualified name, made unique)
+        :param budget: seconds a call may take, or None for no budget (eg.
+               for a callback that must see every batch). Default: the
+               registry's.
+
+        :returns: the Registration (to unregister or read stats from)
+        """
+        if name is None:
+            name = getattr(callback, '__qualname__', None) or repr(callback)
+        taken = {r.name for r in self._registrations}
+        unique, n = name, 1
+        while unique in taken:
+            n += 1
+            unique = f'{name}#{n}'
+        registration = Registration(
+            unique, callback, data,
+            self.budget if budget is REGISTRY_BUDGET else budget)
+        self._registrations = self._registrations + [registration]
+        return registration
+
+    def unregister(self, registration: Registration):
+        """stop calling a registered callback"""
+        self._registrations = [
+            r for r in self._registrations if r is not registration]
+
+    def stats(self) -> Mapping[str, Dict[str, Any]]:
+        """:returns: a mapping of callback name to it's Registration.stats"""
+        return {r.name: r.stats() for r in self._registrations}
+
+    def on_buffer(self, pad: Gst.Pad, info: Gst.PadProbeInfo, _: Any,
+                  ) -> Gst.PadProbeReturn:
+        """the probe callback"""
+        self.batches += 1
+        batches = self.batches
+        clock = time.perf_counter
+        for registration in self._registrations:
+            if not registration.enabled:
+                continue
+            if batches % registration.interval:
+                registration.skipped += 1
+                continue
+            start = clock()
+            try:
+                ret = registration.callback(pad, info, registration.data)
+            except Exception:
+                registration.errors += 1
+                logger.exception(f"probe {registration.name} failed")
+                ret = Gst.PadProbeReturn.OK
+            registration.account(clock() - start)
+            if ret == Gst.PadProbeReturn.DROP:
+                return ret
+        return Gst.PadProbeReturn.OK
@@ -0,0 +1,205 @@
+"""
+An on-demand sampling profiler for a running mce.
+
+mce (see __main__.main) installs a SIGUSR1 handler toggling a
+:class:`SamplingProfiler`. The first signal starts sampling the Python stacks
+of every thread, including the GLib main loop and the GStreamer streaming
+threads running probe callbacks. The second stops it and writes the samples
+to ~/.mce/profiles/ in the "folded" (collapsed stack) format read by
+flamegraph.pl and speedscope, eg:
+
+kill -USR1 $(pgrep -f mce)  # start
+kill -USR1 $(pgrep -f mce)  # stop and write
+flamegraph.pl ~/.mce/profiles/profile-*.folded > profile.svg
+
+While stopped, there is no sampling thread, so it costs nothing.
+"""
+
+# Copyright (c) 2020 Michael de Gans
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import collections
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+
+import gi
+gi.require_version('GLib', '2.0')
+from gi.repository import GLib
+
+from typing import (
+    Counter,
+    Dict,
+    Optional,
+)
+
+logger = logging.getLogger(__name__)
+
+__all__ = [
+    'DEFAULT_INTERVAL',
+    'SamplingProfiler',
+    'install',
+    'profile_dir',
+]
+
+# seconds between samples
+DEFAULT_INTERVAL = 0.005
+# the signal toggling the profiler (SIGUSR2 dumps traces, see mce.trace)
+TOGGLE_SIGNAL = signal.SIGUSR1
+
+# code object -> a frame's label. code objects live as long as the functions
+# they belong to, so this doesn't grow beyond the code that ran.
+_Labels = Dict[object, str]
+
+
+def profile_dir() -> str:
+    """:returns: ~/.mce/profiles, creating it if necessary"""
+    path = os.path.join(os.path.expanduser('~'), '.mce', 'profiles')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+class SamplingProfiler(object):
+    """
+    Samples the Python stack of every thread, every |interval| seconds, from
+    a background thread, counting identical stacks.
+
+    A stack is only visible while a thread is running Python, so a streaming
+    thread shows up while it's in a probe callback (or waiting for the GIL
+    to run one) and not while it's in C (eg. nvinfer).
+
+    :param interval: seconds between samples
+    """
+
+    def __init__(self, interval: float = DEFAULT_INTERVAL):
+        self.interval = interval
+        # "thread;outermost;...;innermost" -> samples
+        self.stacks = collections.Counter()  # type: Counter[str]
+        self.samples = 0
+        self._labels = {}  # type: _Labels
+        self._thread = None  # type: Optional[threading.Thread]
+        self._stop = threading.Event()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self):
+        """start sampling (from a new, clean, set of samples)"""
+        if self.running:
+            return
+        self.stacks.clear()
+        self.samples = 0
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name='mce-profiler', daemon=True)
+        self._thread.start()
+        logger.info(f"profiler started (every {self.interval * 1000:.1f}ms)")
+
+    def stop(self):
+        """stop sampling"""
+        if not self.running:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        logger.info(f"profiler stopped after {self.samples} samples")
+
+    def toggle(self) -> Optional[str]:
+        """
+        start sampling, or stop it and write the samples
+
+        :returns: the path written, if stopped
+        """
+        if not self.running:
+            self.start()
+            return None
+        self.stop()
+        return self.write()
+
+    def write(self, path: Optional[str] = None) -> str:
+        """
+        write the samples in the folded format, one stack per line
+
+        :param path: where to write (default: a new file in profile_dir())
+        :returns: the path written
+        """
+        if path is None:
+            path = os.path.join(
+                profile_dir(),
+                f'profile-{os.getpid()}-{int(time.time())}.folded')
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f'{stack} {count}\n')
+        logger.info(f"wrote {len(self.stacks)} stacks to {path}")
+        return path
+
+    def _run(self):
+        own = threading.get_ident()
+        stop = self._stop
+        while not stop.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                self.stacks[self._fold(names.get(ident, ident), frame)] += 1
+            self.samples += 1
+
+    def _fold(self, thread, frame) -> str:
+        labels = self._labels
+        parts = []
+        while frame is not None:
+            code = frame.f_code
+            label = labels.get(code)
+            if label is None:
+                label = labels[code] = (
+                    f'{code.co_name} '
+                    f'({os.path.basename(code.co_filename)}:'
+                    f'{code.co_firstlineno})')
+            parts.append(label)
+            frame = frame.f_back
+        parts.append(str(thread))
+        parts.reverse()
+        return ';'.join(parts)
+
+
+def install(signum: int = TOGGLE_SIGNAL,
+            profiler: Optional[SamplingProfiler] = None) -> SamplingProfiler:
+    """
+    toggle a SamplingProfiler whenever |signum| is received. The handler runs
+    on the GLib main loop.
+
+    :param profiler: the profiler to toggle (default: a new one)
+    :returns: the profiler
+    """
+    profiler = SamplingProfiler() if profiler is None else profiler
+
+    def on_signal() -> bool:
+        try:
+            profiler.toggle()
+        except OSError as err:
+            logger.error(f"could not write profile: {err}")
+        return True  # keep the handler
+
+    GLib.unix_signal_add(GLib.PRIORITY_DEFAULT, signum, on_signal)
+    return profiler
@@ -0,0 +1,427 @@
+"""
+Event triggered recording of encoded video with a per-source pre-roll ring.
+
+Each source with recording enabled gets an encoded branch (see
+:class:`mce.pipeline.SourceBin`) ending in an appsink. Encoded access units
+are kept in a short, keyframe aligned, :class:`PrerollRing`. When a
+:class:`TriggerRule` matches in the OSD probe (:meth:`EventRecorder.on_buffer`)
+the ring is flushed to a file, followed by everything received until the
+post-roll runs out. Nothing is ever re-encoded.
+"""
+
+# Copyright (c) 2020 Michael de Gans
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import collections
+import logging
+import os
+import queue
+import threading
+import time
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+
+from typing import (
+    Deque,
+    Dict,
+    Iterable,
+    List,
+    Mapping,
+    Optional,
+)
+
+import mce.osd
+from mce import pyds
+
+logger = logging.getLogger(__name__)
+
+__all__ = [
+    'EncodedFrame',
+    'EventRecorder',
+    'PrerollRing',
+    'TriggerRule',
+]
+
+# file extensions for elementary streams of the supported codecs
+EXTENSIONS = {
+    'video/x-h264': 'h264',
+    'video/x-h265': 'h265',
+}
+
+EncodedFrame = collections.namedtuple(
+    'EncodedFrame', ('pts', 'keyframe', 'data'))
+EncodedFrame.__doc__ = """
+A NamedTuple holding one encoded access unit.
+
+:arg pts: presentation timestamp in nanoseconds
+:arg keyframe: True if the frame can be decoded on it's own
+:arg data: the encoded bytes (byte-stream format, so they can be concatenated)
+"""
+
+TriggerRule = collections.namedtuple(
+    'TriggerRule', ('class_id', 'min_count'))
+TriggerRule.__doc__ = """
+A NamedTuple describing when a frame should trigger a recording.
+
+:arg class_id: the detector class id to count (eg. mce.osd.PERSON)
+:arg min_count: trigger when at least this many are found in a single frame
+"""
+
+
+class PrerollRing(object):
+    """
+    A bounded ring of encoded frames, grouped by GOP so the oldest frame is
+    always a keyframe and anything drained from it can be decoded.
+
+    :param max_bytes: memory cap for the ring. If a single GOP is larger than
+           this, it is discarded and frames are dropped until the next keyframe.
+    :param duration: how much stream time (in seconds) to keep. Whole GOPs are
+           only discarded while the remainder still covers this duration.
+    """
+
+    def __init__(self, max_bytes: int = 16 << 20, duration: float = 5.0):
+        self.max_bytes = max_bytes
+        self.duration = int(duration * Gst.SECOND)
+        self._gops = collections.deque()  # type: Deque[List[EncodedFrame]]
+        self._gop_bytes = collections.deque()  # type: Deque[int]
+        self._bytes = 0
+        # frames dropped because they weren't preceded by a keyframe
+        self.dropped = 0
+
+    def __len__(self):  # noqa: D105
+        return sum(len(gop) for gop in self._gops)
+
+    @property
+    def bytes(self) -> int:
+        """:returns: the number of encoded bytes currently held"""
+        return self._bytes
+
+    def push(self, frame: EncodedFrame):
+        """add a frame to the ring, discarding old GOPs as necessary"""
+        if frame.keyframe:
+            self._gops.append([frame])
+            self._gop_bytes.append(len(frame.data))
+        elif self._gops:
+            self._gops[-1].append(frame)
+            self._gop_bytes[-1] += len(frame.data)
+        else:
+            self.dropped += 1
+            return
+        self._bytes += len(frame.data)
+        self._trim(frame.pts)
+
+    def _trim(self, newest_pts: int):
+        while len(self._gops) > 1 and (
+                self._bytes > self.max_bytes
+                or self._gops[1][0].pts <= newest_pts - self.duration):
+            self._pop_gop()
+        if self._bytes > self.max_bytes:
+            # a single GOP over the cap. drop it and wait for a keyframe.
+            self.dropped += len(self._gops[0])
+            self._pop_gop()
+
+    def _pop_gop(self):
+        self._gops.popleft()
+        self._bytes -= self._gop_bytes.popleft()
+
+    def drain(self) -> List[EncodedFrame]:
+        """:returns: all the frames held, oldest first, and empty the ring"""
+        frames = [frame for gop in self._gops for frame in gop]
+        self._gops.clear()
+        self._gop_bytes.clear()
+        self._bytes = 0
+        return frames
+
+
+class _SourceState(object):
+    """recording state for a single source"""
+
+    def __init__(self, ring: PrerollRing, extension: str):
+        self.ring = ring
+        self.extension = extension
+        self.lock = threading.Lock()
+        self.last_pts = 0
+        # stream time at which the current recording stops, or None
+        self.record_until = None  # type: Optional[int]
+        self.events = 0
+        self.frames = 0
+        self.bytes_written = 0
+        # recordings closed early because the writer fell behind
+        self.truncated = 0
+
+
+class EventRecorder(object):
+    """
+    Records pre-roll plus post-roll of encoded video to |directory| whenever
+    one of |rules| matches in a frame.
+
+    Use :meth:`make_branch` as a SourceBin encoded branch factory and
+    :meth:`on_buffer` as a pad probe on the OSD sink pad. DeepStreamApp does
+    both when given a recorder.
+
+    Files are written as elementary streams (.h264 / .h265) from a single
+    background thread so the streaming threads never wait on disk. If the
+    writer falls more than |max_queue_bytes| behind (a slow disk), recordings
+    are closed early, with a warning, instead of buffering without limit.
+
+    :arg directory: where to write recordings
+    :param rules: an Iterable of TriggerRule. Any match triggers a recording.
+    :param preroll: seconds of video to keep from before a trigger
+    :param postroll: seconds of video to record after the last trigger
+    :param max_bytes: memory cap for each source's pre-roll ring
+    :param max_queue_bytes: memory cap for bytes waiting to be written (for
+           all sources)
+    """
+
+    def __init__(self, directory: str,
+                 rules: Iterable[TriggerRule] = (
+                     TriggerRule(mce.osd.PERSON, 1),),
+                 preroll: float = 5.0,
+                 postroll: float = 5.0,
+                 max_bytes: int = 16 << 20,
+                 max_queue_bytes: int = 64 << 20):
+        self.directory = directory
+        self.rules = tuple(rules)
+        self.preroll = preroll
+        self.postroll = int(postroll * Gst.SECOND)
+        self.max_bytes = max_bytes
+        self.max_queue_bytes = max_queue_bytes
+        # muxer pad index -> source name. DeepStreamApp shares the
+        # InferenceBin's mapping with us so frame metadata can be attributed.
+        self.slots = {}  # type: Dict[int, str]
+        self._sources = {}  # type: Dict[str, _SourceState]
+        self._files = {}  # only touched by the writer thread
+        self._queue = queue.Queue()
+        # bytes put on the queue and not yet written
+        self._queue_bytes = 0
+        self._queue_lock = threading.Lock()
+        self._writer = threading.Thread(
+            target=self._write_loop, name='recorder', daemon=True)
+        self._writer.start()
+
+    def make_branch(self, source_bin, caps_name: str
+                    ) -> Optional[List[Gst.Element]]:
+        """
+        A SourceBin encoded branch factory.
+
+        :returns: the elements of a recording branch for |source_bin|, or None
+                  if the codec (|caps_name|) is not supported
+        """
+        # import here for the same reason as in __main__.main()
+        import mce.pipeline
+        extension = EXTENSIONS.get(caps_name)
+        if extension is None:
+            logger.warning(
+                f"{source_bin.name}: can't record {caps_name} "
+                f"(supported: {', '.join(EXTENSIONS)})")
+            return None
+        name = source_bin.name
+        self._sources[name] = _SourceState(
+            PrerollRing(self.max_bytes, self.preroll), extension)
+        elements = mce.pipeline.make_elements((
+            mce.pipeline.ElementDescription(
+                'queue', f'{name}_record_queue', {
+                    'leaky': 2,  # downstream (drop old buffers)
+                    'max-size-buffers': 30,
+                    'max-size-bytes': 0,
+                    'max-size-time': 0,
+                },
+            ),
+            mce.pipeline.ElementDescription(
+                f'{extension}parse', f'{name}_record_parser', {
+                    # repeat SPS/PPS before every keyframe so any GOP can start
+                    # a file
+                    'config-interval': -1,
+                },
+            ),
+            mce.pipeline.ElementDescription(
+                'capsfilter', f'{name}_record_caps', {
+                    'caps': Gst.Caps.from_string(
+                        f'{caps_name},stream-format=byte-stream,alignment=au'),
+                },
+            ),
+            mce.pipeline.ElementDescription(
+                'appsink', f'{name}_record_sink', {
+                    'emit-signals': True,
+                    'sync': False,
+                    'async': False,
+                    'drop': True,
+                    'max-buffers': 30,
+                },
+            ),
+        ))
+        elements[-1].connect('new-sample', self._on_new_sample, name)
+        return elements
+
+    def _on_new_sample(self, appsink: Gst.Element, name: str
+                       ) -> Gst.FlowReturn:
+        sample = appsink.emit('pull-sample')  # type: Gst.Sample
+        if sample is None:
+            return Gst.FlowReturn.OK
+        buffer = sample.get_buffer()  # type: Gst.Buffer
+        state = self._sources[name]
+        pts = buffer.pts
+        if pts == Gst.CLOCK_TIME_NONE:
+            pts = state.last_pts
+        frame = EncodedFrame(
+            pts,
+            not buffer.has_flags(Gst.BufferFlags.DELTA_UNIT),
+            buffer.extract_dup(0, buffer.get_size()),
+        )
+        with state.lock:
+            state.last_pts = pts
+            state.frames += 1
+            if state.record_until is None:
+                state.ring.push(frame)
+            elif pts <= state.record_until:
+                if not self._write(name, state, frame.data):
+                    state.ring.push(frame)
+            else:
+                state.record_until = None
+                self._queue.put(('close', name, None))
+                state.ring.push(frame)
+        return Gst.FlowReturn.OK
+
+    def trigger(self, name: str):
+        """
+        Start (or extend) a recording on the source named |name|. Safe to call
+        from any thread.
+        """
+        state = self._sources.get(name)
+        if state is None:
+            return
+        with state.lock:
+            if state.record_until is None:
+                state.events += 1
+                frames = state.ring.drain()
+                filename = os.path.join(
+                    self.directory,
+                    f"{name}_{time.strftime('%Y%m%d-%H%M%S')}_"
+                    f"{state.events}.{state.extension}")
+                logger.info(f"{name}: recording to {filename}")
+                self._queue.put(('open', name, filename))
+                state.record_until = state.last_pts + self.postroll
+                for frame in frames:
+                    if not self._write(name, state, frame.data):
+                        return
+            state.record_until = state.last_pts + self.postroll
+
+    def _write(self, name: str, state: _SourceState, data: bytes) -> bool:
+        """
+        Queue |data| for the recording of |name|, or, if the queue is full,
+        close the recording early. Call with state.lock held.
+
+        :returns: False if the recording was closed
+        """
+        with self._queue_lock:
+            full = self._queue_bytes + len(data) > self.max_queue_bytes
+            if not full:
+                self._queue_bytes += len(data)
+        if full:
+            logger.warning(
+                f"{name}: recording closed early, the writer is "
+                f"{self.max_queue_bytes} bytes behind (is the disk slow?)")
+            state.record_until = None
+            state.truncated += 1
+            self._queue.put(('close', name, None))
+            return False
+        self._queue.put(('write', name, data))
+        state.bytes_written += len(data)
+        return True
+
+    def on_buffer(self, pad: Gst.Pad, info: Gst.PadProbeInfo, _: None,
+                  ) -> Gst.PadProbeReturn:
+        """a pad probe evaluating self.rules for every frame in the batch"""
+        gst_buffer = info.get_buffer()
+        if not gst_buffer:
+            raise BufferError("Could not get Gst.Buffer")
+        batch_meta = pyds.gst_buffer_get_nvds_batch_meta(hash(gst_buffer))
+        for frame_meta in mce.osd.frame_meta_iterator(
+                batch_meta.frame_meta_list):
+            counter = collections.Counter(
+                obj_meta.class_id for obj_meta in mce.osd.obj_meta_iterator(
+                    frame_meta.obj_meta_list))
+            if any(counter[rule.class_id] >= rule.min_count
+                   for rule in self.rules):
+                name = self.slots.get(frame_meta.pad_index)
+                if name is not None:
+                    self.trigger(name)
+        return Gst.PadProbeReturn.OK
+
+    def stats(self) -> Mapping[str, Mapping[str, int]]:
+        """:returns: a mapping of source name to a mapping of statistics"""
+        stats = {}
+        for name, state in self._sources.items():
+            with state.lock:
+                stats[name] = {
+                    'frames': state.frames,
+                    'ring_frames': len(state.ring),
+                    'ring_bytes': state.ring.bytes,
+                    'ring_dropped': state.ring.dropped,
+                    'events': state.events,
+                    'recording': state.record_until is not None,
+                    'bytes_written': state.bytes_written,
+                    'truncated': state.truncated,
+                }
+        return stats
+
+    def _write_loop(self):
+        while True:
+            op, name, payload = self._queue.get()
+            try:
+                if op == 'write' and name in self._files:
+                    self._files[name].write(payload)
+                elif op == 'open':
+                    if name in self._files:
+                        self._files.pop(name).close()
+                    self._files[name] = open(payload, 'wb')
+                elif op == 'close' and name in self._files:
+                    self._files.pop(name).close()
+                elif op == 'quit':
+                    return
+            except OSError:
+                logger.error(f"{name}: recording failed", exc_info=True)
+                failed = self._files.pop(name, None)
+                if failed is not None:
+                    try:
+                        failed.close()
+                    except OSError:
+                        pass  # already failing, and logged
+            finally:
+                if op == 'write':
+                    with self._queue_lock:
+                        self._queue_bytes -= len(payload)
+                self._queue.task_done()
+
+    def close(self):
+        """finish all recordings and stop the writer thread"""
+        for name, state in self._sources.items():
+            with state.lock:
+                if state.record_until is not None:
+                    state.record_until = None
+                    self._queue.put(('close', name, None))
+        self._queue.put(('quit', None, None))
+        self._writer.join()
+        for f in self._files.values():
+            f.close()
+        self._files.clear()
+        logger.info(f"recorder stats: {self.stats()}")
@@ -0,0 +1,143 @@
+"""
+Per-source regions of interest.
+
+A SourceBin with a Roi crops it's decoded video (with nvvideoconvert) before
+it reaches the stream muxer, so inference only sees (and only spends time on)
+the part of the frame that matters. The RoiMapper probe then maps detections
+back to full frame coordinates in the batch metadata, after every probe
+added with DeepStreamApp.add_probe, for the metadata leaving the pipeline
+(eg. to an output branch).
+
+Those probes see boxes where the osd draws them: in tiler output pixels (or
+muxer pixels, if headless), with cropped sources letterboxed from their Roi.
+Map them with mce.geometry.frame_transform (mce.tracking.FrameMapper does
+this for a DeepStreamApp).
+"""
+
+# Copyright (c) 2020 Michael de Gans
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import logging
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+
+from typing import (
+    Any,
+    Mapping,
+    Optional,
+)
+
+import mce.geometry
+import mce.osd
+from mce import pyds
+from mce.geometry import Roi
+
+logger = logging.getLogger(__name__)
+
+__all__ = [
+    'Roi',
+    'RoiMapper',
+    'crop_caps',
+    'crop_property',
+]
+
+
+def crop_property(roi: Roi) -> str:
+    """:returns: |roi| as an nvvideoconvert "src-crop" ("left:top:width:height")"""
+    return f'{roi.left}:{roi.top}:{roi.width}:{roi.height}'
+
+
+def crop_caps(roi: Roi) -> Gst.Caps:
+    """:returns: caps to keep nvvideoconvert's output at |roi|'s size"""
+    return Gst.Caps.from_string(
+        f'video/x-raw(memory:NVMM),width={roi.width},height={roi.height}')
+
+
+class RoiMapper(object):
+    """
+    A pad probe mapping the boxes of cropped sources from stream muxer (or
+    tiler) coordinates back to full frame coordinates.
+
+    Boxes are only rewritten where nothing downstream draws or probes them,
+    so :meth:`~attach` adds the probe after the osd, or, if headless, on the
+    sink after the InferenceBin's probes (the tracker and every probe see
+    the same coordinates either way, see the module docs). Sources without
+    a Roi are left alone.
+
+    :arg rois: a mapping of source name (eg. "source_0") to Roi
+    :arg slots: a mapping of muxer pad index to source name (InferenceBin.slots)
+    """
+
+    def __init__(self, rois: Mapping[str, Roi], slots: Mapping[int, str]):
+        self.rois = rois
+        self.slots = slots
+        self.muxer = (0, 0)
+        self.tiler = None  # type: Optional[Gst.Element]
+
+    def attach(self, inference_bin):
+        """add the probe to an InferenceBin (see class docs for where)"""
+        muxer = inference_bin['stream-muxer']
+        self.muxer = (muxer.get_property('width'),
+                      muxer.get_property('height'))
+        self.tiler = inference_bin['tiler']
+        if inference_bin['osd'] is not None:
+            element, direction = inference_bin['osd'], 'src'
+        else:
+            # called after the probes on the same pad (in the order added)
+            element, direction = inference_bin['sink'], 'sink'
+        pad = element.get_static_pad(direction)  # type: Gst.Pad
+        if not pad:
+            raise RuntimeError(
+                f"could not get {element.name} {direction} pad")
+        pad.add_probe(Gst.PadProbeType.BUFFER, self.on_buffer, None)
+
+    def on_buffer(self, pad: Gst.Pad, info: Gst.PadProbeInfo, _: Any,
+                  ) -> Gst.PadProbeReturn:
+        """the probe callback"""
+        batch_meta = pyds.gst_buffer_get_nvds_batch_meta(
+            hash(info.get_buffer()))
+        grid = None
+        if self.tiler is not None:
+            grid = (self.tiler.get_property('rows'),
+                    self.tiler.get_property('columns'),
+                    (self.tiler.get_property('width'),
+                     self.tiler.get_property('height')))
+        for frame_meta in mce.osd.frame_meta_iterator(
+                batch_meta.frame_meta_list):
+            roi = self.rois.get(self.slots.get(frame_meta.pad_index))
+            if roi is None:
+                continue
+            for obj_meta in mce.osd.obj_meta_iterator(
+                    frame_meta.obj_meta_list):
+                rect_params = obj_meta.rect_params
+                rect = (rect_params.left, rect_params.top,
+                        rect_params.width, rect_params.height)
+                if grid is not None:
+                    rect = mce.geometry.untile(
+                        rect, frame_meta.pad_index, grid[0], grid[1],
+                        grid[2], self.muxer)
+                (rect_params.left, rect_params.top,
+                 rect_params.width, rect_params.height,
+                 ) = mce.geometry.unletterbox(
+                    rect, (roi.width, roi.height), self.muxer,
+                    (roi.left, roi.top))
+        return Gst.PadProbeReturn.OK
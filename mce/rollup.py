@@ -0,0 +1,353 @@
+"""
+Fixed memory time-series of per source, per class, object counts.
+
+A :class:`Rollup` is fed the object counts of every frame, a batch at a time,
+as a (sources x classes) array. Counts are kept at several resolutions (by
+default 60 x 1 second, 60 x 1 minute and 24 x 1 hour), each a ring of
+buckets holding the min, max, sum and occupancy (frames with at least one
+object) of the counts that fell in it. A closed bucket is merged into the
+next coarser resolution, so nothing is ever recomputed from raw counts.
+
+Whenever a bucket closes (at most once a second) the ring's running
+(newest-first) min, max and sums are updated, so :meth:`Rollup.query` for
+any window up to a ring's span is a handful of lookups.
+"""
+
+# Copyright (c) 2020 Michael de Gans
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import collections
+import logging
+import math
+import threading
+import time
+
+import numpy as np
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+
+from typing import (
+    Any,
+    Dict,
+    List,
+    Optional,
+    Sequence,
+)
+
+import mce.osd
+from mce import pyds
+
+logger = logging.getLogger(__name__)
+
+__all__ = [
+    'DEFAULT_RESOLUTIONS',
+    'Resolution',
+    'Rollup',
+    'Stats',
+]
+
+Resolution = collections.namedtuple(
+    'Resolution', ('name', 'seconds', 'length'))
+Resolution.__doc__ = """
+A NamedTuple class describing one resolution of a Rollup.
+
+:arg name: a name (eg. "minute")
+:arg seconds: the length of a bucket in seconds
+:arg length: buckets kept (the ring spans |seconds| * |length|)
+"""
+
+DEFAULT_RESOLUTIONS = (
+    Resolution('second', 1, 60),
+    Resolution('minute', 60, 60),
+    Resolution('hour', 3600, 24),
+)
+
+Stats = collections.namedtuple(
+    'Stats', ('min', 'max', 'mean', 'occupancy', 'frames'))
+Stats.__doc__ = """
+A NamedTuple class describing counts over a window.
+
+:arg min: the fewest objects in any frame (None if there were no frames)
+:arg max: the most objects in any frame (None if there were no frames)
+:arg mean: the mean objects per frame (None if there were no frames)
+:arg occupancy: the fraction of frames with at least one object
+:arg frames: frames counted
+"""
+
+
+class _Ring(object):
+    """the buckets of one resolution, and their running aggregates"""
+
+    def __init__(self, resolution: Resolution, sources: int, classes: int):
+        self.resolution = resolution
+        length = resolution.length
+        shape = (length, sources, classes)
+        self.min = np.full(shape, np.inf)
+        self.max = np.full(shape, -np.inf)
+        self.sum = np.zeros(shape)
+        self.occupied = np.zeros(shape)
+        self.frames = np.zeros((length, sources))
+        # the bucket being filled (not yet in the running aggregates)
+        self.current = None  # type: Optional[int]
+        # running aggregates over the closed buckets, newest first, so
+        # [k - 1] covers the newest k closed buckets
+        self.run_min = np.full(shape, np.inf)
+        self.run_max = np.full(shape, -np.inf)
+        self.run_sum = np.zeros(shape)
+        self.run_occupied = np.zeros(shape)
+        self.run_frames = np.zeros((length, sources))
+
+    def slot(self, bucket: int) -> int:
+        return bucket % self.resolution.length
+
+    def clear(self, bucket: int):
+        i = self.slot(bucket)
+        self.min[i] = np.inf
+        self.max[i] = -np.inf
+        self.sum[i] = 0
+        self.occupied[i] = 0
+        self.frames[i] = 0
+
+    def merge(self, bucket: int, min_, max_, sum_, occupied, frames):
+        """merge aggregated counts into |bucket|"""
+        i = self.slot(bucket)
+        np.minimum(self.min[i], min_, out=self.min[i])
+        np.maximum(self.max[i], max_, out=self.max[i])
+        self.sum[i] += sum_
+        self.occupied[i] += occupied
+        self.frames[i] += frames
+
+    def close(self):
+        """update the running aggregates, once the current bucket moves"""
+        length = self.resolution.length
+        # closed buckets, newest first. the last is the current bucket's
+        # slot, which a query never reaches.
+        order = [self.slot(self.current - 1 - k) for k in range(length)]
+        np.minimum.accumulate(self.min[order], axis=0, out=self.run_min)
+        np.maximum.accumulate(self.max[order], axis=0, out=self.run_max)
+        np.cumsum(self.sum[order], axis=0, out=self.run_sum)
+        np.cumsum(self.occupied[order], axis=0, out=self.run_occupied)
+        np.cumsum(self.frames[order], axis=0, out=self.run_frames)
+
+
+class Rollup(object):
+    """
+    Per source, per class, object count time-series at several resolutions,
+    in fixed memory. Pass to DeepStreamApp(rollup=...), which starts it, or
+    feed :meth:`add` directly.
+
+    Sources are muxer pad indexes (frame_meta.pad_index, see
+    DeepStreamApp.slots for their names) and classes are class ids.
+
+    :param sources: the number of sources (muxer slots)
+    :param classes: the number of classes
+    :param resolutions: from finest to coarsest. Each bucket length must be
+           a multiple of the previous.
+    """
+
+    def __init__(self, sources: int, classes: int = mce.osd.NUM_CLASSES,
+                 resolutions: Sequence[Resolution] = DEFAULT_RESOLUTIONS):
+        for finer, coarser in zip(resolutions, resolutions[1:]):
+            if coarser.seconds % finer.seconds:
+                raise ValueError(
+                    f"{coarser.name} isn't a multiple of {finer.name}")
+        self.sources = sources
+        self.classes = classes
+        self.rings = [_Ring(r, sources, classes) for r in resolutions]
+        # queries (from any thread) and updates (from the streaming thread)
+        self._lock = threading.Lock()
+        # reused by on_buffer
+        self._counts = np.zeros((sources, classes))
+        self._present = np.zeros(sources, dtype=bool)
+        self._app = None
+        self._registration = None  # type: Optional[mce.probes.Registration]
+
+    def add(self, counts: np.ndarray, present: np.ndarray,
+            now: Optional[float] = None):
+        """
+        Add a batch of counts.
+
+        :arg counts: a (sources x classes) array of the objects in each
+             source's frame
+        :arg present: a (sources,) bool array, True for sources with a frame
+             in the batch
+        :param now: the time (default: time.time())
+        """
+        now = time.time() if now is None else now
+        mask = present[:, np.newaxis]
+        with self._lock:
+            finest = self.rings[0]
+            self._advance(0, int(now // finest.resolution.seconds))
+            finest.merge(
+                finest.current,
+                np.where(mask, counts, np.inf),
+                np.where(mask, counts, -np.inf),
+                counts * mask,
+                (counts > 0) & mask,
+                present)
+
+    def _advance(self, level: int, bucket: int):
+        """move ring |level| to |bucket|, closing and merging on the way"""
+        ring = self.rings[level]
+        if ring.current is None:
+            ring.current = bucket
+            ring.clear(bucket)
+            if level + 1 < len(self.rings):
+                self._advance(level + 1, self._parent(level, bucket))
+            return
+        if bucket <= ring.current:
+            return
+        # merge the finished bucket up, then skip (clearing) any empty ones
+        # in between (no more than a whole ring)
+        if level + 1 < len(self.rings):
+            parent = self.rings[level + 1]
+            self._advance(level + 1, self._parent(level, ring.current))
+            i = ring.slot(ring.current)
+            parent.merge(parent.current, ring.min[i], ring.max[i],
+                         ring.sum[i], ring.occupied[i], ring.frames[i])
+            self._advance(level + 1, self._parent(level, bucket))
+        first = max(ring.current + 1, bucket - ring.resolution.length + 1)
+        for empty in range(first, bucket + 1):
+            ring.clear(empty)
+        ring.current = bucket
+        ring.close()
+
+    def _parent(self, level: int, bucket: int) -> int:
+        finer = self.rings[level].resolution.seconds
+        coarser = self.rings[level + 1].resolution.seconds
+        return bucket * finer // coarser
+
+    def query(self, source: int, class_id: int, window: float) -> Stats:
+        """
+        :returns: Stats for the last |window| seconds, from the finest
+                  resolution spanning it, rounded up to whole buckets
+                  (including the one being filled). Windows longer than
+                  the coarsest resolution's span are cut to it.
+        """
+        with self._lock:
+            for level, ring in enumerate(self.rings):
+                seconds, length = ring.resolution[1:]
+                if window <= seconds * length or ring is self.rings[-1]:
+                    break
+            if ring.current is None:
+                return Stats(None, None, None, 0.0, 0)
+            frames = total = occupied = 0.0
+            low, high = np.inf, -np.inf
+            # the bucket being filled at this resolution and every finer one
+            # (not merged up yet), plus the newest closed buckets
+            for finer in self.rings[:level + 1]:
+                i = finer.slot(finer.current)
+                frames += finer.frames[i, source]
+                total += finer.sum[i, source, class_id]
+                occupied += finer.occupied[i, source, class_id]
+                low = min(low, finer.min[i, source, class_id])
+                high = max(high, finer.max[i, source, class_id])
+            k = min(max(math.ceil(window / seconds) - 1, 0), length - 1)
+            if k:
+                frames += ring.run_frames[k - 1, source]
+                total += ring.run_sum[k - 1, source, class_id]
+                occupied += ring.run_occupied[k - 1, source, class_id]
+                low = min(low, ring.run_min[k - 1, source, class_id])
+                high = max(high, ring.run_max[k - 1, source, class_id])
+        if not frames:
+            return Stats(None, None, None, 0.0, 0)
+        return Stats(float(low), float(high), float(total / frames),
+                     float(occupied / frames), int(frames))
+
+    def series(self, resolution: str, source: int, class_id: int,
+               ) -> List[Optional[float]]:
+        """
+        :returns: the mean count of every bucket at |resolution| (by name),
+                  oldest first, ending with the bucket being filled (None
+                  for buckets with no frames)
+        """
+        with self._lock:
+            ring = next(r for r in self.rings
+                        if r.resolution.name == resolution)
+            if ring.current is None:
+                return []
+            length = ring.resolution.length
+            order = [ring.slot(ring.current - k)
+                     for k in reversed(range(length))]
+            frames = ring.frames[order, source]
+            sums = ring.sum[order, source, class_id]
+        return [float(s / f) if f else None for s, f in zip(sums, frames)]
+
+    def summary(self, window: float) -> Dict[int, Dict[int, Stats]]:
+        """
+        :returns: source -> class id -> Stats for the last |window| seconds
+                  (see :meth:`query`), for the sources with frames in it
+        """
+        summary = {}
+        for source in range(self.sources):
+            stats = {c: self.query(source, c, window)
+                     for c in range(self.classes)}
+            if stats[0].frames:
+                summary[source] = stats
+        return summary
+
+    def start(self, app):
+        """start counting a DeepStreamApp's batches (called on it's
+        __enter__)"""
+        self._app = app
+        self._registration = app.add_probe(self.on_buffer, name='rollup')
+
+    def stop(self):
+        """remove the probe added by start (called on the DeepStreamApp's
+        __exit__)"""
+        if self._registration is not None:
+            self._app.remove_probe(self._registration)
+            self._registration = None
+
+    def on_buffer(self, pad: Gst.Pad, info: Gst.PadProbeInfo, _: Any,
+                  ) -> Gst.PadProbeReturn:
+        """the probe callback"""
+        counts = self._counts
+        present = self._present
+        counts.fill(0)
+        present.fill(False)
+        pads = []  # type: List[int]
+        classes = []  # type: List[int]
+        batch_meta = pyds.gst_buffer_get_nvds_batch_meta(
+            hash(info.get_buffer()))
+        # the latest frame of each source (a batch of a non-live source may
+        # have several), so a source's counts are of one frame
+        latest = {}  # type: Dict[int, Any]
+        for frame_meta in mce.osd.frame_meta_iterator(
+                batch_meta.frame_meta_list):
+            pad_index = frame_meta.pad_index
+            if pad_index >= self.sources:
+                continue
+            other = latest.get(pad_index)
+            if other is None or frame_meta.frame_num >= other.frame_num:
+                latest[pad_index] = frame_meta
+        for pad_index, frame_meta in latest.items():
+            present[pad_index] = True
+            for obj_meta in mce.osd.obj_meta_iterator(
+                    frame_meta.obj_meta_list):
+                if obj_meta.class_id < self.classes:
+                    pads.append(pad_index)
+                    classes.append(obj_meta.class_id)
+        if pads:
+            np.add.at(counts, (pads, classes), 1)
+        self.add(counts, present)
+        return Gst.PadProbeReturn.OK
@@ -0,0 +1,213 @@
+"""
+An RTSP server fed directly from a DeepStreamApp.
+
+Video is encoded once in the main pipeline (or not at all, for per-source
+mounts fed from a SourceBin's encoded tee) and pushed into a shared
+media per mount, so any number of clients cost no extra encoding and there
+is no UDP loop back into the server.
+"""
+
+# Copyright (c) 2020 Michael de Gans
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import logging
+import socket
+import threading
+
+import gi
+gi.require_version('Gst', '1.0')
+gi.require_version('GstRtspServer', '1.0')
+from gi.repository import (
+    Gst,
+    GstRtspServer,
+)
+
+from typing import (
+    Dict,
+    List,
+    Optional,
+)
+
+logger = logging.getLogger(__name__)
+
+__all__ = [
+    'DEFAULT_MOUNT',
+    'DEFAULT_PORT',
+    'RtspServer',
+]
+
+DEFAULT_PORT = 8554
+DEFAULT_MOUNT = '/mce'
+
+# payloaders for encoded caps names
+PAYLOADERS = {
+    'video/x-h264': 'rtph264pay',
+    'video/x-h265': 'rtph265pay',
+}
+
+
+class RtspServer(object):
+    """
+    A GstRtspServer.RTSPServer with one shared media per mount, each fed from
+    an appsink in the main pipeline.
+
+    The server is attached to the default GLib.MainContext, so it runs on the
+    DeepStreamApp's GLib.MainLoop.
+
+    :param port: the port to serve on
+    """
+
+    def __init__(self, port: int = DEFAULT_PORT):
+        self.port = port
+        self._server = GstRtspServer.RTSPServer.new()
+        self._server.props.service = str(port)
+        self._server.attach(None)
+        self._lock = threading.Lock()
+        # mount path -> appsrc elements of prepared media
+        self._appsrcs = {}  # type: Dict[str, List[Gst.Element]]
+        # mount path -> encoded caps name
+        self._mounts = {}  # type: Dict[str, str]
+
+    def url(self, mount: str) -> str:
+        """:returns: a url clients can use to view |mount|"""
+        return f"rtsp://{socket.gethostname()}:{self.port}{mount}"
+
+    def add_mount(self, mount: str, caps_name: str = 'video/x-h264'):
+        """
+        Serve encoded video pushed with :meth:`~push` at |mount|. Adding a
+        mount again, with the same |caps_name|, keeps it and it's clients.
+
+        :arg mount: the mount path (eg. "/mce")
+        :param caps_name: the encoded caps name (eg. "video/x-h264")
+        """
+        payloader = PAYLOADERS[caps_name]
+        with self._lock:
+            previous = self._mounts.get(mount)
+            self._mounts[mount] = caps_name
+            if previous == caps_name:
+                return
+            if previous is not None:
+                # the clients can't depayload the new codec
+                logger.warning(
+                    f"{mount}: replacing {previous} with {caps_name}, "
+                    f"existing clients will stop receiving video")
+            self._appsrcs[mount] = []
+        factory = GstRtspServer.RTSPMediaFactory.new()
+        factory.set_launch(
+            f"( appsrc name=src is-live=true format=time do-timestamp=true "
+            f"! {payloader} name=pay0 pt=96 config-interval=1 )")
+        # one media (and so one payloader) for every client
+        factory.set_shared(True)
+        factory.connect('media-configure', self._on_media_configure, mount)
+        self._server.get_mount_points().add_factory(mount, factory)
+        logger.info(f"serving RTSP at {self.url(mount)}")
+
+    def _on_media_configure(self, _, media: GstRtspServer.RTSPMedia,
+                            mount: str):
+        appsrc = media.get_element().get_child_by_name('src')
+        media.connect('unprepared', self._on_media_unprepared, mount, appsrc)
+        with self._lock:
+            self._appsrcs[mount].append(appsrc)
+
+    def _on_media_unprepared(self, _, mount: str, appsrc: Gst.Element):
+        with self._lock:
+            if appsrc in self._appsrcs[mount]:
+                self._appsrcs[mount].remove(appsrc)
+
+    def push(self, mount: str, sample: Gst.Sample):
+        """push an encoded |sample| to every client of |mount|"""
+        with self._lock:
+            appsrcs = tuple(self._appsrcs.get(mount, ()))
+        if not appsrcs:
+            return
+        # the media has it's own clock and base time, so drop the main
+        # pipeline's timestamps and let appsrc apply it's own.
+        buffer = sample.get_buffer().copy()
+        buffer.pts = Gst.CLOCK_TIME_NONE
+        buffer.dts = Gst.CLOCK_TIME_NONE
+        sample = Gst.Sample.new(buffer, sample.get_caps(), None, None)
+        for appsrc in appsrcs:
+            appsrc.emit('push-sample', sample)
+
+    def connect_appsink(self, appsink: Gst.Element, mount: str):
+        """
+        Feed |mount| from |appsink|, adding the mount if necessary. The appsink
+        should be receiving parsed, byte-stream, h264 or h265.
+        """
+        with self._lock:
+            exists = mount in self._mounts
+        if not exists:
+            self.add_mount(mount)
+        appsink.set_property('emit-signals', True)
+        appsink.connect('new-sample', self._on_new_sample, mount)
+
+    def _on_new_sample(self, appsink: Gst.Element, mount: str
+                       ) -> Gst.FlowReturn:
+        sample = appsink.emit('pull-sample')  # type: Gst.Sample
+        if sample is not None:
+            self.push(mount, sample)
+        return Gst.FlowReturn.OK
+
+    def make_branch(self, source_bin, caps_name: str
+                    ) -> Optional[List[Gst.Element]]:
+        """
+        A SourceBin encoded branch factory serving the source, as is, at
+        "/|source_bin.name|".
+        """
+        # import here for the same reason as in __main__.main()
+        import mce.pipeline
+        if caps_name not in PAYLOADERS:
+            logger.warning(f"{source_bin.name}: can't serve {caps_name}")
+            return None
+        name = source_bin.name
+        mount = f'/{name}'
+        self.add_mount(mount, caps_name)
+        elements = mce.pipeline.make_elements((
+            mce.pipeline.ElementDescription(
+                'queue', f'{name}_rtsp_queue', {
+                    'leaky': 2,  # downstream (drop old buffers)
+                    'max-size-buffers': 30,
+                    'max-size-bytes': 0,
+                    'max-size-time': 0,
+                },
+            ),
+            mce.pipeline.ElementDescription(
+                mce.pipeline.ENCODED_PARSERS[caps_name],
+                f'{name}_rtsp_parser', {
+                    'config-interval': -1,
+                },
+            ),
+            mce.pipeline.ElementDescription(
+                'capsfilter', f'{name}_rtsp_caps', {
+                    'caps': Gst.Caps.from_string(
+                        f'{caps_name},stream-format=byte-stream,alignment=au'),
+                },
+            ),
+            mce.pipeline.ElementDescription(
+                'appsink', f'{name}_rtsp_sink', {
+                    'sync': False,
+                    'async': False,
+                    'drop': True,
+                    'max-buffers': 30,
+                },
+            ),
+        ))
+        self.connect_appsink(elements[-1], mount)
+        return elements
@@ -0,0 +1,173 @@
+"""
+Low-overhead, sampled, per-frame tracing.
+
+A :class:`Tracer` registered as a probe callback records one line of
+metadata per frame for 1 in every N batches into a fixed-size ring, so it
+can stay on in production. Nothing is formatted until the ring is dumped
+(as JSON lines), which happens on request (:meth:`Tracer.dump`) or on a
+signal (SIGUSR2 by default), eg:
+
+kill -USR2 $(pgrep -f mce)
+
+writes ~/.mce/traces/trace-<pid>-<time>.jsonl. Disabled, the probe costs a
+counter increment and a modulo per batch (see mce.benchmark trace-overhead).
+"""
+
+# Copyright (c) 2020 Michael de Gans
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import collections
+import json
+import logging
+import os
+import signal
+import time
+
+import gi
+gi.require_version('Gst', '1.0')
+gi.require_version('GLib', '2.0')
+from gi.repository import (
+    GLib,
+    Gst,
+)
+
+from typing import (
+    Any,
+    Deque,
+    Dict,
+    Iterator,
+    Optional,
+    TextIO,
+    Tuple,
+)
+
+import mce.osd
+from mce import pyds
+
+logger = logging.getLogger(__name__)
+
+__all__ = [
+    'DEFAULT_CAPACITY',
+    'FIELDS',
+    'Tracer',
+    'trace_dir',
+]
+
+# records kept (older ones are overwritten)
+DEFAULT_CAPACITY = 10000
+# the signal dumping the ring (SIGUSR1 is the profiler's, see mce.profile)
+DUMP_SIGNAL = signal.SIGUSR2
+
+# the fields of every record, in order. records are stored as plain tuples
+# and only turned into dicts when dumped.
+FIELDS = ('time', 'batch', 'pad_index', 'frame_num', 'objects', 'latency')
+
+Record = Tuple[float, int, int, int, int, float]
+
+
+def trace_dir() -> str:
+    """:returns: ~/.mce/traces, creating it if necessary"""
+    path = os.path.join(os.path.expanduser('~'), '.mce', 'traces')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+class Tracer(object):
+    """
+    A probe callback recording every frame of 1 in |every| batches. Add with
+    DeepStreamApp.add_probe.
+
+    :param every: sample 1 in this many batches (0 disables tracing, which
+           may be changed at any time)
+    :param capacity: the most records kept
+    """
+
+    def __init__(self, every: int = 30, capacity: int = DEFAULT_CAPACITY):
+        self.every = every
+        self.batches = 0
+        self.ring = collections.deque(maxlen=capacity)  # type: Deque[Record]
+
+    def on_buffer(self, pad: Gst.Pad, info: Gst.PadProbeInfo, _: Any,
+                  ) -> Gst.PadProbeReturn:
+        """the probe callback"""
+        self.batches += 1
+        every = self.every
+        if not every or self.batches % every:
+            return Gst.PadProbeReturn.OK
+        now = time.time()
+        batch = self.batches
+        append = self.ring.append
+        batch_meta = pyds.gst_buffer_get_nvds_batch_meta(
+            hash(info.get_buffer()))
+        for frame_meta in mce.osd.frame_meta_iterator(
+                batch_meta.frame_meta_list):
+            append((now, batch, frame_meta.pad_index, frame_meta.frame_num,
+                    frame_meta.num_obj_meta,
+                    now - frame_meta.ntp_timestamp / 1e9))
+        return Gst.PadProbeReturn.OK
+
+    def records(self) -> Iterator[Dict[str, Any]]:
+        """:returns: an iterator of the records, oldest first, as dicts"""
+        # copy first, since the streaming thread may be appending
+        for record in list(self.ring):
+            yield dict(zip(FIELDS, record))
+
+    def dump(self, f: TextIO) -> int:
+        """
+        write the records to |f| as JSON lines
+
+        :returns: the number of records written
+        """
+        count = 0
+        for record in self.records():
+            f.write(json.dumps(record))
+            f.write('\n')
+            count += 1
+        return count
+
+    def dump_file(self, path: Optional[str] = None) -> str:
+        """
+        write the records to |path| (default: a new file in trace_dir())
+
+        :returns: the path written
+        """
+        if path is None:
+            path = os.path.join(
+                trace_dir(), f'trace-{os.getpid()}-{int(time.time())}.jsonl')
+        with open(path, 'w') as f:
+            count = self.dump(f)
+        logger.info(f"wrote {count} trace records to {path}")
+        return path
+
+    def install_signal(self, signum: int = DUMP_SIGNAL) -> int:
+        """
+        dump to a new file in trace_dir() whenever |signum| is received. The
+        handler runs on the GLib main loop, not in the streaming threads.
+
+        :returns: the GLib source id (to remove with GLib.source_remove)
+        """
+        def on_signal() -> bool:
+            try:
+                self.dump_file()
+            except OSError as err:
+                logger.error(f"could not write trace: {err}")
+            return True  # keep the handler
+
+        return GLib.unix_signal_add(GLib.PRIORITY_DEFAULT, signum, on_signal)
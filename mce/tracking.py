@@ -0,0 +1,241 @@
+"""
+Shared parts of probes following tracked objects across batches (see
+mce.zones and mce.tracks).
+
+Boxes at a DeepStreamApp's probes (see InferenceBin.add_probe) are where the
+osd draws them: in tiler output pixels, or muxer pixels if headless, and
+letterboxed into the muxer's resolution. A :class:`FrameMapper` maps a batch
+of them to full frame pixels at once, with one affine transform per frame
+(see mce.geometry.frame_transform).
+
+A :class:`TrackTable` keeps per track state as rows of numpy arrays, so a
+batch of tracks is read and updated at once, with rows found by key (eg.
+(source, object_id)) and reused once freed.
+"""
+
+# Copyright (c) 2020 Michael de Gans
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import logging
+
+import numpy as np
+
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Hashable,
+    Iterable,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+)
+
+import mce.geometry
+
+logger = logging.getLogger(__name__)
+
+__all__ = [
+    'FrameMapper',
+    'TrackTable',
+    'last_of_each',
+    'map_boxes',
+]
+
+# rows a TrackTable starts with (and grows by, at least)
+MIN_ROWS = 64
+
+# a tiler's (rows, columns, (width, height))
+Grid = Tuple[int, int, Tuple[int, int]]
+# (x offset, y offset, x scale, y scale)
+Transform = Tuple[float, float, float, float]
+
+
+def map_boxes(boxes: np.ndarray, transforms: np.ndarray) -> np.ndarray:
+    """
+    :returns: (N x 4) |boxes| (left, top, width, height) mapped by (N x 4)
+              |transforms| (see :meth:`FrameMapper.transform`)
+    """
+    boxes = boxes * transforms[:, [2, 3, 2, 3]]
+    boxes[:, :2] += transforms[:, :2]
+    return boxes
+
+
+def last_of_each(keys: Sequence[Hashable]) -> Optional[List[int]]:
+    """
+    :returns: the indexes of the last of each key in |keys|, in order, or None
+              if there are no duplicates (eg. from two frames of one source
+              in a batch)
+    """
+    last = {key: i for i, key in enumerate(keys)}
+    if len(last) == len(keys):
+        return None
+    return sorted(last.values())
+
+
+class FrameMapper(object):
+    """
+    Maps boxes at a DeepStreamApp's probes to full frame pixels (see the
+    module docs). Start on a DeepStreamApp with :meth:`start`.
+
+    :arg label: names the user in warnings (eg. "zones")
+    """
+
+    def __init__(self, label: str):
+        self.label = label
+        # muxer pad index -> source name
+        self.slots = {}  # type: Mapping[int, str]
+        self.muxer = (0, 0)
+        self.tiler = None  # set by start, if not headless
+        self._content = None  # type: Optional[Callable]
+        self._unknown = set()  # type: Set[str]
+
+    def start(self, app):
+        """read the muxer, tiler and sources of a DeepStreamApp"""
+        muxer = app['stream-muxer']
+        self.muxer = (muxer.get_property('width'),
+                      muxer.get_property('height'))
+        self.tiler = app['tiler']
+        self.slots = app.slots
+        self._content = app.source_content
+
+    def grid(self) -> Optional[Grid]:
+        """
+        :returns: the tiler's layout, or None if headless. Read it once per
+                  batch (it may change, see InferenceBin.plan_layout).
+        """
+        if self.tiler is None:
+            return None
+        return (self.tiler.get_property('rows'),
+                self.tiler.get_property('columns'),
+                (self.tiler.get_property('width'),
+                 self.tiler.get_property('height')))
+
+    def transform(self, pad_index: int, grid: Optional[Grid]) -> Transform:
+        """
+        :returns: (x offset, y offset, x scale, y scale) taking a box of the
+                  frame from |pad_index| to full frame pixels
+
+        :arg grid: the tiler's layout, from :meth:`grid`
+        """
+        name = self.slots.get(pad_index)
+        content = self._content(name) if self._content else None
+        if content is None:
+            if name not in self._unknown:
+                self._unknown.add(name)
+                logger.warning(
+                    f"{self.label}: {name}'s size is unknown (use --probe), "
+                    f"so it's boxes are in muxer pixels")
+            size, offset = self.muxer, (0, 0)
+        else:
+            size, offset = content
+        return mce.geometry.frame_transform(
+            pad_index, size, self.muxer, offset, grid)
+
+
+class TrackTable(object):
+    """
+    Per track state as rows of numpy arrays (see the module docs). The arrays
+    grow, doubling, as needed, up to |max_rows|, so index them through the
+    table after :meth:`allocate`.
+
+    :arg columns: the name, the shape of one row and the dtype of each array
+         (eg. ('xy', (2,), float)). Each is an attribute of the table.
+    :param max_rows: the most rows (default: no limit)
+    """
+
+    def __init__(self, columns: Iterable[Tuple[str, Tuple[int, ...], Any]],
+                 max_rows: Optional[int] = None):
+        self.max_rows = max_rows
+        self.slot_of = {}  # type: Dict[Hashable, int]
+        self.keys = []  # type: List[Optional[Hashable]]
+        self._free = []  # type: List[int]
+        self._columns = tuple(columns)
+        for name, shape, dtype in self._columns:
+            setattr(self, name, np.zeros((0,) + tuple(shape), dtype=dtype))
+        # when each row was last seen. free rows are never seen (inf), so
+        # they're never stale
+        self.seen = np.zeros(0)
+
+    def __len__(self):
+        return len(self.slot_of)
+
+    @property
+    def full(self) -> bool:
+        """True if every row is used and there may be no more"""
+        return not self._free and self.max_rows is not None \
+            and len(self.keys) >= self.max_rows
+
+    def lookup(self, keys: Sequence[Hashable]) -> np.ndarray:
+        """:returns: the row of each of |keys| (-1 if it has none)"""
+        get = self.slot_of.get
+        return np.fromiter((get(k, -1) for k in keys), dtype=int,
+                           count=len(keys))
+
+    def allocate(self, key: Hashable) -> int:
+        """
+        :returns: the row of |key|, a free one (zeroed) if it has none
+
+        :raises IndexError: if full
+        """
+        slot = self.slot_of.get(key)
+        if slot is not None:
+            return slot
+        if not self._free:
+            self._grow()
+        slot = self._free.pop()
+        for name, _, _ in self._columns:
+            getattr(self, name)[slot] = 0
+        self.keys[slot] = key
+        self.slot_of[key] = slot
+        return slot
+
+    def _grow(self):
+        size = len(self.keys)
+        grow = max(size, MIN_ROWS)
+        if self.max_rows is not None:
+            grow = min(grow, self.max_rows - size)
+        if grow <= 0:
+            raise IndexError(f"no more than {self.max_rows} rows")
+        for name, shape, dtype in self._columns:
+            setattr(self, name, np.concatenate((
+                getattr(self, name),
+                np.zeros((grow,) + tuple(shape), dtype=dtype))))
+        self.seen = np.concatenate((self.seen, np.full(grow, np.inf)))
+        self.keys.extend([None] * grow)
+        self._free.extend(reversed(range(size, size + grow)))
+
+    def free(self, slot: int):
+        """free a row (if it's used)"""
+        key = self.keys[slot]
+        if key is None:
+            return
+        if self.slot_of.get(key) == slot:
+            del self.slot_of[key]
+        self.keys[slot] = None
+        self.seen[slot] = np.inf
+        self._free.append(slot)
+
+    def stale(self, now: float, ttl: float) -> np.ndarray:
+        """:returns: the rows not seen for more than |ttl| seconds"""
+        return np.nonzero(now - self.seen > ttl)[0]
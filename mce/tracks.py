@@ -0,0 +1,354 @@
+"""
+Track level events, instead of per frame detections.
+
+A tracker (see make_inference_description's |tracker|) reports the same
+object, with the same object_id, on every frame it's in: 30 near identical
+detections a second. :class:`TrackEvents` compresses them into:
+
+* APPEARED: the first frame of a track
+* MOVED: the track's centre moved more than |move| times it's size since
+  it's last event
+* LEFT: the track wasn't seen for |ttl| seconds (or was evicted, see
+  |max_tracks|)
+
+Every event carries a summary of the track so far: when it was first seen,
+it's dwell time, frames seen and it's best (highest confidence) box, in full
+frame pixels. Everything in between is suppressed. Tracks are rows of
+preallocated arrays, updated a batch at a time, and there are never more than
+|max_tracks| of them, however many objects come and go.
+"""
+
+# Copyright (c) 2020 Michael de Gans
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import collections
+import logging
+import threading
+import time
+
+import numpy as np
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+
+from typing import (
+    Any,
+    Callable,
+    Deque,
+    Dict,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+import mce.osd
+import mce.tracking
+from mce import pyds
+
+logger = logging.getLogger(__name__)
+
+__all__ = [
+    'APPEARED',
+    'LEFT',
+    'MOVED',
+    'TrackEvent',
+    'TrackEvents',
+]
+
+# TrackEvent kinds
+APPEARED = 'appeared'
+MOVED = 'moved'
+LEFT = 'left'
+
+# seconds a track is kept after it's last seen
+DEFAULT_TTL = 2.0
+# a MOVED event after moving this many times the box's size
+DEFAULT_MOVE = 1.0
+# the most tracks kept (the least recently seen leaves first)
+DEFAULT_MAX_TRACKS = 10000
+# events kept by TrackEvents
+DEFAULT_MAX_EVENTS = 10000
+
+# (source name, object_id)
+Key = Tuple[str, int]
+
+TrackEvent = collections.namedtuple(
+    'TrackEvent', ('time', 'kind', 'source', 'object_id', 'class_id',
+                   'first_seen', 'dwell', 'frames', 'box', 'confidence'))
+TrackEvent.__doc__ = """
+A NamedTuple class describing an event of a track, and the track so far.
+
+:arg time: when (as time.time()). For LEFT, when the track was last seen.
+:arg kind: APPEARED, MOVED or LEFT
+:arg source: the source name (eg. "source_0")
+:arg object_id: the tracker's object_id
+:arg class_id: the class id last seen
+:arg first_seen: when the track appeared
+:arg dwell: seconds between the first and last frames seen
+:arg frames: frames the track was seen in
+:arg box: the best confidence (left, top, width, height) so far, in full
+     frame pixels
+:arg confidence: the best confidence so far
+"""
+
+
+class TrackEvents(object):
+    """
+    Compresses tracked detections into track events (see the module docs).
+    Start on a DeepStreamApp with :meth:`start`, or feed :meth:`process`.
+
+    :param move: a MOVED event when a track's centre moves more than this
+           times the (geometric mean) size of it's box since it's last event
+    :param ttl: seconds after a track is last seen before it's LEFT
+    :param max_tracks: the most tracks kept. When full, the least recently
+           seen track is LEFT early. New tracks beyond it in one batch are
+           dropped.
+    :param max_events: events kept in :attr:`events` (older are dropped)
+    :param on_event: called with every TrackEvent, from the streaming thread
+    """
+
+    def __init__(self, move: float = DEFAULT_MOVE, ttl: float = DEFAULT_TTL,
+                 max_tracks: int = DEFAULT_MAX_TRACKS,
+                 max_events: int = DEFAULT_MAX_EVENTS,
+                 on_event: Optional[Callable[[TrackEvent], Any]] = None):
+        self.move = move
+        self.ttl = ttl
+        self.max_tracks = max_tracks
+        self.on_event = on_event
+        self.events = collections.deque(
+            maxlen=max_events)  # type: Deque[TrackEvent]
+        self.detections = 0
+        self.emitted = 0
+        self.evicted = 0
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._next_prune = 0.0
+        # by key. 'centre' is the centre at the last event and 'seen' when
+        # the track was last seen.
+        self._tracks = mce.tracking.TrackTable((
+            ('first_seen', (), float),
+            ('frames', (), int),
+            ('class_id', (), int),
+            ('best_box', (4,), float),
+            ('best_confidence', (), float),
+            ('centre', (2,), float),
+        ), max_rows=max_tracks)
+        self._mapper = mce.tracking.FrameMapper('track events')
+        self._app = None
+        self._registration = None  # type: Optional[mce.probes.Registration]
+
+    @property
+    def tracks(self) -> int:
+        """the number of live tracks"""
+        return len(self._tracks)
+
+    def process(self, keys: Sequence[Key], boxes: np.ndarray,
+                confidences: np.ndarray, class_ids: np.ndarray,
+                now: Optional[float] = None):
+        """
+        Update the tracks with a batch of tracked detections.
+
+        :arg keys: (source name, object_id) of every detection. If a key is
+             in the batch more than once (eg. in two frames of one source),
+             only the last is used.
+        :arg boxes: (N x 4) (left, top, width, height) in full frame pixels
+        :arg confidences: (N,) detection confidences
+        :arg class_ids: (N,) class ids
+        :param now: the time (default: time.time())
+        """
+        now = time.time() if now is None else now
+        events = []  # type: List[TrackEvent]
+        last = mce.tracking.last_of_each(keys)
+        if last is not None:
+            keys = [keys[i] for i in last]
+            boxes, confidences = boxes[last], confidences[last]
+            class_ids = class_ids[last]
+        with self._lock:
+            self.detections += len(keys)
+            if len(keys):
+                self._update(keys, boxes, confidences, class_ids, now, events)
+            if now >= self._next_prune:
+                self._prune(now, events)
+        self._emit(events)
+
+    def _update(self, keys, boxes, confidences, class_ids, now, events):
+        tracks = self._tracks
+        slots = tracks.lookup(keys)
+        new = slots < 0
+        centres = boxes[:, :2] + boxes[:, 2:] / 2
+        # so no track seen in this batch is evicted to make room
+        tracks.seen[slots[~new]] = now
+        for i in np.nonzero(new)[0]:
+            slot = slots[i] = self._allocate(keys[i], now, events)
+            if slot < 0:
+                continue
+            tracks.first_seen[slot] = now
+            tracks.seen[slot] = now
+            tracks.best_confidence[slot] = -np.inf
+            tracks.centre[slot] = centres[i]
+        if (slots < 0).any():
+            kept = slots >= 0
+            self.dropped += int(np.count_nonzero(~kept))
+            slots, new, centres = slots[kept], new[kept], centres[kept]
+            keys = [k for k, keep in zip(keys, kept) if keep]
+            boxes = boxes[kept]
+            confidences = confidences[kept]
+            class_ids = class_ids[kept]
+        tracks.frames[slots] += 1
+        tracks.class_id[slots] = class_ids
+        better = confidences > tracks.best_confidence[slots]
+        tracks.best_confidence[slots[better]] = confidences[better]
+        tracks.best_box[slots[better]] = boxes[better]
+        size = np.sqrt(np.abs(boxes[:, 2] * boxes[:, 3]))
+        distance = np.hypot(*(centres - tracks.centre[slots]).T)
+        moved = ~new & (distance > self.move * size)
+        tracks.centre[slots[moved]] = centres[moved]
+        for i in np.nonzero(new | moved)[0]:
+            events.append(self._event(
+                now, APPEARED if new[i] else MOVED, keys[i], slots[i]))
+
+    def _event(self, now: float, kind: str, key: Key, slot: int,
+               ) -> TrackEvent:
+        tracks = self._tracks
+        first_seen = float(tracks.first_seen[slot])
+        return TrackEvent(
+            now, kind, key[0], key[1], int(tracks.class_id[slot]),
+            first_seen, float(tracks.seen[slot]) - first_seen,
+            int(tracks.frames[slot]),
+            tuple(float(v) for v in tracks.best_box[slot]),
+            float(tracks.best_confidence[slot]))
+
+    def _allocate(self, key: Key, now: float, events) -> int:
+        """
+        :returns: a free row for |key|, evicting the least recently seen
+                  track if full, or -1 if every track was seen at |now|
+        """
+        tracks = self._tracks
+        if tracks.full:
+            oldest = int(np.argmin(tracks.seen))
+            if tracks.seen[oldest] >= now:
+                return -1
+            self.evicted += 1
+            self._leave(oldest, events)
+        return tracks.allocate(key)
+
+    def _leave(self, slot: int, events):
+        """a LEFT event for the track in |slot|, then free it"""
+        tracks = self._tracks
+        key = tracks.keys[slot]
+        if key is None:
+            return
+        events.append(self._event(
+            float(tracks.seen[slot]), LEFT, key, slot))
+        tracks.free(slot)
+
+    def _prune(self, now: float, events):
+        self._next_prune = now + self.ttl / 2
+        for slot in self._tracks.stale(now, self.ttl):
+            self._leave(int(slot), events)
+
+    def _emit(self, events: Sequence[TrackEvent]):
+        self.emitted += len(events)
+        for event in events:
+            self.events.append(event)
+            if self.on_event is not None:
+                self.on_event(event)
+
+    def flush(self):
+        """LEFT every track (eg. when the app exits)"""
+        events = []  # type: List[TrackEvent]
+        with self._lock:
+            for slot in sorted(self._tracks.slot_of.values()):
+                self._leave(slot, events)
+        self._emit(events)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        :returns: 'detections' seen, 'events' emitted, their 'ratio'
+                  (detections per event), live 'tracks', tracks 'evicted'
+                  early and detections 'dropped' (see max_tracks)
+        """
+        with self._lock:
+            return {
+                'detections': self.detections,
+                'events': self.emitted,
+                'ratio': self.detections / self.emitted
+                if self.emitted else None,
+                'tracks': len(self._tracks),
+                'evicted': self.evicted,
+                'dropped': self.dropped,
+            }
+
+    def start(self, app):
+        """add the probe to a DeepStreamApp (called on it's __enter__)"""
+        self._mapper.start(app)
+        if app['tracker'] is None:
+            logger.warning("track events: no tracker, so there are no "
+                           "tracks (see --tracker)")
+        self._app = app
+        self._registration = app.add_probe(
+            self.on_buffer, name='track-events')
+
+    def stop(self):
+        """remove the probe added by start and :meth:`flush` (called on the
+        DeepStreamApp's __exit__)"""
+        if self._registration is not None:
+            self._app.remove_probe(self._registration)
+            self._registration = None
+            self.flush()
+
+    def on_buffer(self, pad: Gst.Pad, info: Gst.PadProbeInfo, _: Any,
+                  ) -> Gst.PadProbeReturn:
+        """the probe callback"""
+        mapper = self._mapper
+        grid = mapper.grid()
+        untracked = mce.osd.UNTRACKED_OBJECT_ID
+        keys = []  # type: List[Key]
+        boxes = []  # type: List[Tuple[float, float, float, float]]
+        confidences = []  # type: List[float]
+        class_ids = []  # type: List[int]
+        transforms = []  # type: List[Tuple[float, float, float, float]]
+        batch_meta = pyds.gst_buffer_get_nvds_batch_meta(
+            hash(info.get_buffer()))
+        for frame_meta in mce.osd.frame_meta_iterator(
+                batch_meta.frame_meta_list):
+            name = mapper.slots.get(frame_meta.pad_index)
+            transform = None
+            for obj_meta in mce.osd.obj_meta_iterator(
+                    frame_meta.obj_meta_list):
+                if obj_meta.object_id == untracked:
+                    continue
+                if transform is None:
+                    transform = mapper.transform(frame_meta.pad_index, grid)
+                rect_params = obj_meta.rect_params
+                keys.append((name, obj_meta.object_id))
+                boxes.append((rect_params.left, rect_params.top,
+                              rect_params.width, rect_params.height))
+                confidences.append(obj_meta.confidence)
+                class_ids.append(obj_meta.class_id)
+                transforms.append(transform)
+        boxes = mce.tracking.map_boxes(
+            np.array(boxes, dtype=float).reshape(-1, 4),
+            np.array(transforms, dtype=float).reshape(-1, 4))
+        self.process(keys, boxes, np.array(confidences, dtype=float),
+                     np.array(class_ids, dtype=int))
+        return Gst.PadProbeReturn.OK
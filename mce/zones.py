@@ -0,0 +1,577 @@
+"""
+Zone occupancy and line crossing analytics.
+
+Zones (polygons) and lines are defined per source, in full frame pixels, eg.
+in a JSON file (see :func:`load`):
+
+{
+  "source_0": {
+    "zones": {"door": {"polygon": [[0, 400], [300, 400], [300, 720],
+                                   [0, 720]], "classes": [2]}},
+    "lines": {"gate": {"line": [[640, 0], [640, 720]]}}
+  }
+}
+
+Nothing is tested object by object. When :class:`ZoneAnalytics` is built,
+every source's zones are rasterized, once, into a grid of cells (CELL_SIZE
+pixels square) covering their bounding box, each cell a bitfield of the
+zones it's in. Per batch, every box is mapped back to full frame pixels (as
+arrays, see mce.tracking), and its anchor (the bottom centre, where a person
+stands) looks up its zones with one gather. Line crossings, of the anchor's
+path since the last frame, are tested against every line at once and need
+tracked objects (see make_inference_description's |tracker|).
+
+Results are counters (see :meth:`ZoneAnalytics.stats`) and, for tracked
+objects, events (entering or leaving a zone, crossing a line) kept in a
+bounded deque and passed to an optional callback.
+"""
+
+# Copyright (c) 2020 Michael de Gans
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import collections
+import json
+import logging
+import math
+import threading
+import time
+
+import numpy as np
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+
+from typing import (
+    Any,
+    Callable,
+    Deque,
+    Dict,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+import mce.osd
+import mce.tracking
+from mce import pyds
+from mce.osd import UNTRACKED_OBJECT_ID
+
+logger = logging.getLogger(__name__)
+
+__all__ = [
+    'CELL_SIZE',
+    'ENTER',
+    'EXIT',
+    'Event',
+    'IN',
+    'Line',
+    'OUT',
+    'Zone',
+    'ZoneAnalytics',
+    'load',
+]
+
+# pixels per side of a rasterized zone cell
+CELL_SIZE = 8
+# the most zones (one bit each of a uint64)
+MAX_ZONES = 64
+# seconds a track is kept after it's last seen
+DEFAULT_TTL = 5.0
+# events kept by ZoneAnalytics
+DEFAULT_MAX_EVENTS = 10000
+
+# Event kinds
+ENTER = 'enter'
+EXIT = 'exit'
+IN = 'in'
+OUT = 'out'
+
+Zone = collections.namedtuple(
+    'Zone', ('name', 'source', 'polygon', 'classes'))
+Zone.__new__.__defaults__ = (None,)
+Zone.__doc__ = """
+A NamedTuple class describing a zone of a source.
+
+:arg name: a unique name (eg. "door")
+:arg source: the source (or consumer) name (eg. "source_0")
+:arg polygon: a Sequence of (x, y) vertices, in full frame pixels
+:arg classes: the class ids counted (default: all)
+"""
+
+Line = collections.namedtuple(
+    'Line', ('name', 'source', 'a', 'b', 'classes'))
+Line.__new__.__defaults__ = (None,)
+Line.__doc__ = """
+A NamedTuple class describing a counting line of a source. Crossing from
+the right of a -> b to the left (as seen on screen) is IN, the other way is
+OUT.
+
+:arg name: a unique name (eg. "gate")
+:arg source: the source (or consumer) name (eg. "source_0")
+:arg a: the (x, y) start, in full frame pixels
+:arg b: the (x, y) end, in full frame pixels
+:arg classes: the class ids counted (default: all)
+"""
+
+Event = collections.namedtuple(
+    'Event', ('time', 'kind', 'name', 'source', 'object_id', 'class_id'))
+Event.__doc__ = """
+A NamedTuple class describing a tracked object entering or leaving a zone
+or crossing a line.
+
+:arg time: when (as time.time())
+:arg kind: ENTER or EXIT (a zone) or IN or OUT (a line)
+:arg name: the zone or line name
+:arg source: the source name
+:arg object_id: the tracker's object_id
+:arg class_id: the object's class id
+"""
+
+
+def load(path: str) -> Tuple[List[Zone], List[Line]]:
+    """
+    :returns: the zones and lines in a JSON file (see the module docs). A
+              zone may be a bare list of vertices and a line a bare pair of
+              points.
+    """
+    with open(path) as f:
+        config = json.load(f)
+    zones = []
+    lines = []
+    for source, defs in config.items():
+        for name, zone in defs.get('zones', {}).items():
+            if not isinstance(zone, dict):
+                zone = {'polygon': zone}
+            zones.append(Zone(name, source,
+                              [tuple(p) for p in zone['polygon']],
+                              zone.get('classes')))
+        for name, line in defs.get('lines', {}).items():
+            if not isinstance(line, dict):
+                line = {'line': line}
+            a, b = line['line']
+            lines.append(Line(name, source, tuple(a), tuple(b),
+                              line.get('classes')))
+    return zones, lines
+
+
+def _inside(points: np.ndarray, polygon: np.ndarray) -> np.ndarray:
+    """
+    :returns: a bool array, True for each of (N x 2) |points| inside
+              |polygon| (even-odd rule), tested against every edge at once
+    """
+    x, y = points[:, 0:1], points[:, 1:2]
+    x0, y0 = polygon[:, 0], polygon[:, 1]
+    x1, y1 = np.roll(x0, -1), np.roll(y0, -1)
+    spans = (y0 > y) != (y1 > y)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cross_x = x0 + (y - y0) * (x1 - x0) / (y1 - y0)
+    return (np.count_nonzero(spans & (x < cross_x), axis=1) % 2) == 1
+
+
+def _cross(o: np.ndarray, d: np.ndarray, p: np.ndarray) -> np.ndarray:
+    """:returns: the z of (d x (p - o)) for broadcast (..., 2) arrays"""
+    return d[..., 0] * (p[..., 1] - o[..., 1]) \
+        - d[..., 1] * (p[..., 0] - o[..., 0])
+
+
+def _duplicates(sources: np.ndarray, object_ids: np.ndarray) -> np.ndarray:
+    """
+    :returns: a bool array, True for every tracked object but the last with
+              it's (source, object_id), eg. in a batch with two frames of one
+              source
+    """
+    # stable, so the last of each run of equal keys is the last in the batch
+    order = np.lexsort((object_ids, sources))
+    s, o = sources[order], object_ids[order]
+    same_as_next = (s[:-1] == s[1:]) & (o[:-1] == o[1:]) \
+        & (o[:-1] != np.uint64(UNTRACKED_OBJECT_ID))
+    duplicate = np.zeros(len(order), dtype=bool)
+    duplicate[order[:-1][same_as_next]] = True
+    return duplicate
+
+
+def _class_bits(defs: Sequence, classes: int) -> np.ndarray:
+    """
+    :returns: a (classes + 1) uint64 array of the bits of |defs| counting
+              each class. The last entry (for any other class) is 0.
+    """
+    bits = np.zeros(classes + 1, dtype=np.uint64)
+    for i, d in enumerate(defs):
+        bit = np.uint64(1 << i)
+        for class_id in range(classes) if d.classes is None else d.classes:
+            if 0 <= class_id < classes:
+                bits[class_id] |= bit
+    return bits
+
+
+class ZoneAnalytics(object):
+    """
+    Per batch zone occupancy and line crossing counts (see the module docs).
+    Pass to DeepStreamApp(zones=...), which starts it, or feed
+    :meth:`process` directly.
+
+    :arg zones: the Zones (no more than MAX_ZONES)
+    :param lines: the Lines (no more than MAX_ZONES)
+    :param classes: the number of classes
+    :param cell: the rasterized cell size, in pixels
+    :param ttl: seconds a track (for events and crossings) is kept after
+           it's last seen. A track forgotten inside a zone leaves it.
+    :param max_events: events kept (older ones are dropped)
+    :param on_event: called with every Event, from the streaming thread
+    """
+
+    def __init__(self, zones: Sequence[Zone], lines: Sequence[Line] = (),
+                 classes: int = mce.osd.NUM_CLASSES, cell: int = CELL_SIZE,
+                 ttl: float = DEFAULT_TTL,
+                 max_events: int = DEFAULT_MAX_EVENTS,
+                 on_event: Optional[Callable[[Event], Any]] = None):
+        if len(zones) > MAX_ZONES or len(lines) > MAX_ZONES:
+            raise ValueError(f"no more than {MAX_ZONES} zones and lines")
+        self.zones = list(zones)
+        self.lines = list(lines)
+        self.classes = classes
+        self.cell = cell
+        self.ttl = ttl
+        self.on_event = on_event
+        self.events = collections.deque(
+            maxlen=max_events)  # type: Deque[Event]
+        # source name -> index into the per source tables
+        self.sources = {}  # type: Dict[str, int]
+        for d in self.zones + self.lines:
+            self.sources.setdefault(d.source, len(self.sources))
+        self._rasterize()
+        self._zone_bits = _class_bits(self.zones, classes)
+        self._zone_shifts = np.arange(len(self.zones), dtype=np.uint64)
+        self._line_a = np.array([line.a for line in self.lines],
+                                dtype=float).reshape(-1, 2)
+        self._line_d = np.array([line.b for line in self.lines],
+                                dtype=float).reshape(-1, 2) - self._line_a
+        self._line_source = np.array(
+            [self.sources[line.source] for line in self.lines], dtype=int)
+        self._line_bits = _class_bits(self.lines, classes)
+        self._line_shifts = np.arange(len(self.lines), dtype=np.uint64)
+        # counters (read from any thread, so updated under the lock)
+        self._lock = threading.Lock()
+        self.occupancy = np.zeros(len(self.zones), dtype=int)
+        self.entries = np.zeros(len(self.zones), dtype=int)
+        self.exits = np.zeros(len(self.zones), dtype=int)
+        self.crossings_in = np.zeros(len(self.lines), dtype=int)
+        self.crossings_out = np.zeros(len(self.lines), dtype=int)
+        self.batches = 0
+        # the last anchor, zone bits and class id of every track, by
+        # (source index, object_id)
+        self._tracks = mce.tracking.TrackTable((
+            ('xy', (2,), float),
+            ('bits', (), np.uint64),
+            ('class_id', (), int),
+        ))
+        self._next_prune = 0.0
+        self._mapper = mce.tracking.FrameMapper('zones')
+        self._app = None
+        self._registration = None  # type: Optional[mce.probes.Registration]
+
+    def _rasterize(self):
+        """build every source's grid of zone bits"""
+        cell = self.cell
+        origins, shapes, grids = [], [], []
+        for source, index in sorted(self.sources.items(), key=lambda i: i[1]):
+            polygons = [(i, np.array(z.polygon, dtype=float))
+                        for i, z in enumerate(self.zones)
+                        if z.source == source]
+            if not polygons:
+                origins.append((0.0, 0.0))
+                shapes.append((0, 0))
+                grids.append(np.zeros(0, dtype=np.uint64))
+                continue
+            vertices = np.concatenate([p for _, p in polygons])
+            left, top = np.floor(vertices.min(axis=0))
+            right, bottom = np.ceil(vertices.max(axis=0))
+            cols = max(1, int(math.ceil((right - left) / cell)))
+            rows = max(1, int(math.ceil((bottom - top) / cell)))
+            # cell centres
+            xs = left + (np.arange(cols) + 0.5) * cell
+            ys = top + (np.arange(rows) + 0.5) * cell
+            centres = np.stack(np.meshgrid(xs, ys), axis=-1).reshape(-1, 2)
+            grid = np.zeros(rows * cols, dtype=np.uint64)
+            for i, polygon in polygons:
+                grid[_inside(centres, polygon)] |= np.uint64(1 << i)
+            origins.append((left, top))
+            shapes.append((rows, cols))
+            grids.append(grid)
+        self._origin = np.array(origins, dtype=float).reshape(-1, 2)
+        self._rows = np.array([s[0] for s in shapes], dtype=int)
+        self._cols = np.array([s[1] for s in shapes], dtype=int)
+        sizes = self._rows * self._cols
+        self._offset = np.concatenate(([0], np.cumsum(sizes)[:-1])).astype(
+            int)
+        # a trailing 0 for anchors outside every grid
+        self._grid = np.concatenate(
+            grids + [np.zeros(1, dtype=np.uint64)])
+
+    def lookup(self, sources: np.ndarray, anchors: np.ndarray) -> np.ndarray:
+        """
+        :returns: the zone bits at each anchor (uint64)
+
+        :arg sources: (N,) source indexes (see :attr:`sources`)
+        :arg anchors: (N x 2) points in full frame pixels
+        """
+        origin = self._origin[sources]
+        cols = self._cols[sources]
+        rows = self._rows[sources]
+        cx = np.floor((anchors[:, 0] - origin[:, 0]) / self.cell).astype(int)
+        cy = np.floor((anchors[:, 1] - origin[:, 1]) / self.cell).astype(int)
+        inside = (cx >= 0) & (cx < cols) & (cy >= 0) & (cy < rows)
+        flat = np.where(inside, self._offset[sources] + cy * cols + cx,
+                        len(self._grid) - 1)
+        return self._grid[flat]
+
+    def process(self, sources: np.ndarray, anchors: np.ndarray,
+                class_ids: np.ndarray, object_ids: np.ndarray,
+                present: np.ndarray, now: Optional[float] = None):
+        """
+        Count a batch.
+
+        :arg sources: (N,) source indexes (see :attr:`sources`) of every
+             object
+        :arg anchors: (N x 2) anchors of every object in full frame pixels
+        :arg class_ids: (N,) class ids
+        :arg object_ids: (N,) tracker object ids (UNTRACKED_OBJECT_ID if
+             untracked, as uint64)
+        :arg present: a (sources,) bool array, True for sources with a frame
+             in the batch (their zones' occupancy is replaced)
+        :param now: the time (default: time.time())
+
+        A tracked object in the batch more than once (eg. in two frames of
+        one source) is counted once, where it was last.
+        """
+        now = time.time() if now is None else now
+        duplicate = _duplicates(sources, object_ids)
+        if duplicate.any():
+            keep = ~duplicate
+            sources, anchors = sources[keep], anchors[keep]
+            class_ids, object_ids = class_ids[keep], object_ids[keep]
+        classes = np.where((class_ids >= 0) & (class_ids < self.classes),
+                           class_ids, self.classes)
+        events = []  # type: List[Event]
+        bits = self.lookup(sources, anchors) & self._zone_bits[classes]
+        # objects x zones
+        members = ((bits[:, np.newaxis] >> self._zone_shifts)
+                   & np.uint64(1)).astype(bool)
+        counts = members.sum(axis=0)
+        zone_present = present[[self.sources[z.source] for z in self.zones]]
+        tracked = np.nonzero(object_ids != np.uint64(UNTRACKED_OBJECT_ID))[0]
+        names = list(self.sources)
+        with self._lock:
+            self.batches += 1
+            self.occupancy[zone_present] = counts[zone_present]
+            if len(tracked):
+                self._track(tracked, sources, anchors, classes, object_ids,
+                            bits, now, names, events)
+            if now >= self._next_prune:
+                self._prune(now, names, events)
+        for event in events:
+            self.events.append(event)
+            if self.on_event is not None:
+                self.on_event(event)
+
+    def _track(self, tracked, sources, anchors, classes, object_ids, bits,
+               now, names, events):
+        """update the tracks, counting entries, exits and crossings"""
+        tracks = self._tracks
+        keys = list(zip(sources[tracked].tolist(),
+                        object_ids[tracked].tolist()))
+        slots = tracks.lookup(keys)
+        known = slots >= 0
+        if known.any():
+            rows = tracked[known]
+            old = slots[known]
+            now_bits = bits[rows]
+            entered = now_bits & ~tracks.bits[old]
+            left = tracks.bits[old] & ~now_bits
+            for i in np.nonzero(entered | left)[0]:
+                self._zone_events(
+                    int(entered[i]), int(left[i]), now, names,
+                    sources[rows[i]], object_ids[rows[i]],
+                    classes[rows[i]], events)
+            if len(self.lines):
+                self._crossings(rows, tracks.xy[old], sources, anchors,
+                                classes, object_ids, now, names, events)
+        for i in np.nonzero(~known)[0]:
+            slots[i] = tracks.allocate(keys[i])
+            row = tracked[i]
+            if bits[row]:
+                self._zone_events(int(bits[row]), 0, now, names,
+                                  sources[row], object_ids[row],
+                                  classes[row], events)
+        tracks.xy[slots] = anchors[tracked]
+        tracks.bits[slots] = bits[tracked]
+        tracks.class_id[slots] = classes[tracked]
+        tracks.seen[slots] = now
+
+    def _crossings(self, rows, prev_xy, sources, anchors, classes,
+                   object_ids, now, names, events):
+        """test every path (prev_xy -> anchor) against every line at once"""
+        p = prev_xy[:, np.newaxis, :]
+        q = anchors[rows][:, np.newaxis, :]
+        a = self._line_a[np.newaxis]
+        d = self._line_d[np.newaxis]
+        side_p = _cross(a, d, p)
+        side_q = _cross(a, d, q)
+        path = q - p
+        crossed = ((side_p * side_q < 0)
+                   & (_cross(p, path, a) * _cross(p, path, a + d) < 0)
+                   & (sources[rows][:, np.newaxis] == self._line_source)
+                   & ((self._line_bits[classes[rows]][:, np.newaxis]
+                       >> self._line_shifts) & np.uint64(1)).astype(bool))
+        if not crossed.any():
+            return
+        # image y points down, so the left of a -> b is the negative side
+        going_in = crossed & (side_q < 0)
+        self.crossings_in += going_in.sum(axis=0)
+        self.crossings_out += (crossed & ~going_in).sum(axis=0)
+        for i, j in zip(*np.nonzero(crossed)):
+            row = rows[i]
+            events.append(Event(
+                now, IN if going_in[i, j] else OUT, self.lines[j].name,
+                names[sources[row]], int(object_ids[row]),
+                int(classes[row])))
+
+    def _zone_events(self, entered: int, left: int, now: float, names,
+                     source: int, object_id: int, class_id: int, events):
+        for i, zone in enumerate(self.zones):
+            bit = 1 << i
+            if entered & bit:
+                self.entries[i] += 1
+                events.append(Event(now, ENTER, zone.name, names[source],
+                                    int(object_id), int(class_id)))
+            elif left & bit:
+                self.exits[i] += 1
+                events.append(Event(now, EXIT, zone.name, names[source],
+                                    int(object_id), int(class_id)))
+
+    def _prune(self, now: float, names, events):
+        """forget tracks unseen for ttl seconds (they leave their zones)"""
+        self._next_prune = now + self.ttl / 2
+        tracks = self._tracks
+        for slot in tracks.stale(now, self.ttl):
+            key = tracks.keys[slot]
+            if tracks.bits[slot]:
+                self._zone_events(0, int(tracks.bits[slot]), now, names,
+                                  key[0], key[1], tracks.class_id[slot],
+                                  events)
+            tracks.free(slot)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        :returns: 'zones' (name to 'source', current 'occupancy', tracked
+                  'entries' and 'exits'), 'lines' (name to 'source', 'in'
+                  and 'out' crossings), 'tracks' and 'batches'
+        """
+        with self._lock:
+            return {
+                'zones': {z.name: {
+                    'source': z.source,
+                    'occupancy': int(self.occupancy[i]),
+                    'entries': int(self.entries[i]),
+                    'exits': int(self.exits[i]),
+                } for i, z in enumerate(self.zones)},
+                'lines': {l.name: {
+                    'source': l.source,
+                    'in': int(self.crossings_in[i]),
+                    'out': int(self.crossings_out[i]),
+                } for i, l in enumerate(self.lines)},
+                'tracks': len(self._tracks),
+                'batches': self.batches,
+            }
+
+    def start(self, app):
+        """start counting a DeepStreamApp's batches (called on it's
+        __enter__)"""
+        self._mapper.start(app)
+        if app['tracker'] is None and self.lines:
+            logger.warning("zones: no tracker, so no line crossings or zone "
+                           "events (only occupancy) will be counted")
+        self._app = app
+        self._registration = app.add_probe(self.on_buffer, name='zones')
+
+    def stop(self):
+        """remove the probe added by start (called on the DeepStreamApp's
+        __exit__)"""
+        if self._registration is not None:
+            self._app.remove_probe(self._registration)
+            self._registration = None
+
+    def on_buffer(self, pad: Gst.Pad, info: Gst.PadProbeInfo, _: Any,
+                  ) -> Gst.PadProbeReturn:
+        """the probe callback"""
+        mapper = self._mapper
+        grid = mapper.grid()
+        present = np.zeros(len(self.sources), dtype=bool)
+        # per frame: source index, transform and objects
+        frames = []  # type: List[Tuple[int, Tuple, int]]
+        boxes = []  # type: List[Tuple[float, float, float, float]]
+        class_ids = []  # type: List[int]
+        object_ids = []  # type: List[int]
+        batch_meta = pyds.gst_buffer_get_nvds_batch_meta(
+            hash(info.get_buffer()))
+        # the latest frame of each source (a batch of a non-live source may
+        # have several), so objects are only counted once
+        latest = {}  # type: Dict[int, Any]
+        for frame_meta in mce.osd.frame_meta_iterator(
+                batch_meta.frame_meta_list):
+            index = self.sources.get(mapper.slots.get(frame_meta.pad_index))
+            if index is None:
+                continue
+            other = latest.get(index)
+            if other is None or frame_meta.frame_num >= other.frame_num:
+                latest[index] = frame_meta
+        for index, frame_meta in latest.items():
+            present[index] = True
+            count = 0
+            for obj_meta in mce.osd.obj_meta_iterator(
+                    frame_meta.obj_meta_list):
+                rect_params = obj_meta.rect_params
+                boxes.append((rect_params.left, rect_params.top,
+                              rect_params.width, rect_params.height))
+                class_ids.append(obj_meta.class_id)
+                object_ids.append(obj_meta.object_id)
+                count += 1
+            if count:
+                frames.append((index, mapper.transform(
+                    frame_meta.pad_index, grid), count))
+        if not present.any():
+            return Gst.PadProbeReturn.OK
+        counts = [f[2] for f in frames]
+        sources = np.repeat(
+            np.array([f[0] for f in frames], dtype=int), counts)
+        transforms = np.repeat(
+            np.array([f[1] for f in frames], dtype=float).reshape(-1, 4),
+            counts, axis=0)
+        boxes = mce.tracking.map_boxes(
+            np.array(boxes, dtype=float).reshape(-1, 4), transforms)
+        # the bottom centre, in full frame pixels
+        anchors = np.empty((len(boxes), 2))
+        anchors[:, 0] = boxes[:, 0] + boxes[:, 2] / 2
+        anchors[:, 1] = boxes[:, 1] + boxes[:, 3]
+        self.process(sources, anchors, np.array(class_ids, dtype=int),
+                     np.array(object_ids, dtype=np.uint64), present)
+        return Gst.PadProbeReturn.OK
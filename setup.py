@@ -30,7 +30,8 @@ setuptools.setup(
         'Programming Language :: Python :: 3.8',
     ],
     python_requires='>=3.6',
-    # install_requires=['requests'],
+    # requests is only needed by mce.lucifer (see requirements.txt)
+    install_requires=['numpy'],
     packages=['mce'],
     package_data={
         'mce': [
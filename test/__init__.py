@@ -6,6 +6,14 @@ import unittest
 # from test.init_test import *
 # from test.pipeline_test import *
 # from test.main_test import *
+from test.discover_test import *
+from test.geometry_test import *
+from test.gsttrace_test import *
+from test.patrol_test import *
+from test.rollup_test import *
+from test.rtsp_test import *
+from test.tracks_test import *
+from test.zones_test import *
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,135 @@
+import os
+import socket
+import tempfile
+import time
+import unittest
+import unittest.mock
+
+try:
+    import gi
+    gi.require_version('Gst', '1.0')
+    gi.require_version('GstPbutils', '1.0')
+    from gi.repository import Gst
+    Gst.init(None)
+    # after Gst.init (see mce.__main__.main)
+    import mce.discover as discover
+    from mce.geometry import Roi
+except (ImportError, ValueError):
+    Gst = discover = None
+
+# (encoder, muxer, extension) to make a test file with, the first found wins
+WRITERS = (
+    ('x264enc', 'matroskamux', 'mkv'),
+    ('jpegenc', 'avimux', 'avi'),
+)
+
+
+def have(*factories: str) -> bool:
+    return all(Gst.ElementFactory.find(f) for f in factories)
+
+
+def info(width=1920, height=1080, fps=30.0, live=False, uri='file:///a'):
+    return discover.SourceInfo(uri, width, height, fps, 'video/x-h264', live,
+                               0.0 if live else 10.0)
+
+
+@unittest.skipIf(discover is None, 'needs GStreamer (gi)')
+class TestPlan(unittest.TestCase):
+
+    def test_sizes_and_rates(self):
+        self.assertEqual(discover.plan([info(), info(1280, 720, 25.0)]), {
+            'source_sizes': [(1920, 1080), (1280, 720)],
+            'source_fps': [30.0, 25.0],
+            'live': False,
+        })
+
+    def test_unprobed_sources_are_left_out(self):
+        plan = discover.plan([None, info(live=True)])
+        self.assertEqual(plan['source_sizes'], [(1920, 1080)])
+        self.assertTrue(plan['live'])
+
+    def test_unknown_size_and_rate(self):
+        plan = discover.plan([info(0, 0, 0.0)])
+        self.assertEqual((plan['source_sizes'], plan['source_fps']), ([], []))
+
+    def test_roi_size(self):
+        plan = discover.plan([info(), info()], [Roi(0, 0, 640, 480)])
+        self.assertEqual(plan['source_sizes'], [(640, 480), (1920, 1080)])
+
+
+@unittest.skipIf(discover is None, 'needs GStreamer (gi)')
+class TestProbeAll(unittest.TestCase):
+
+    def setUp(self):
+        discover.clear_cache()
+
+    def tearDown(self):
+        discover.clear_cache()
+
+    def test_failures_are_not_cached(self):
+        results = {'file:///a': info(), 'file:///b': None}
+        with unittest.mock.patch.object(
+                discover, 'probe', side_effect=lambda u, _: results[u],
+        ) as probe:
+            self.assertEqual(
+                discover.probe_all(['file:///a', 'file:///b', 'file:///a']),
+                results)
+            self.assertEqual(probe.call_count, 2)
+            discover.probe_all(['file:///a', 'file:///b'])
+            self.assertEqual(probe.call_count, 3)
+
+
+@unittest.skipIf(discover is None, 'needs GStreamer (gi)')
+class TestProbe(unittest.TestCase):
+
+    def test_missing_file(self):
+        self.assertIsNone(discover.probe(
+            Gst.filename_to_uri(os.path.abspath('missing.mkv')), 1.0))
+
+    def test_unreachable(self):
+        with socket.socket() as s:
+            s.bind(('127.0.0.1', 0))
+            port = s.getsockname()[1]
+        # nothing listens there now, so the connection is refused
+        self.assertIsNone(
+            discover.probe(f'rtsp://127.0.0.1:{port}/none', 2.0))
+
+    @unittest.skipUnless(discover and have('souphttpsrc'),
+                         'needs souphttpsrc')
+    def test_timeout(self):
+        # accepts connections, but never answers
+        with socket.socket() as server:
+            server.bind(('127.0.0.1', 0))
+            server.listen(1)
+            start = time.monotonic()
+            self.assertIsNone(discover.probe(
+                f'http://127.0.0.1:{server.getsockname()[1]}/video', 1.0))
+            self.assertLess(time.monotonic() - start, 10.0)
+
+    def test_local_file(self):
+        writer = next((w for w in WRITERS if have(*w[:2])), None)
+        if writer is None:
+            self.skipTest('needs x264enc and matroskamux, or jpegenc and '
+                          'avimux, to write a test file')
+        encoder, muxer, extension = writer
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, f'test.{extension}')
+            pipeline = Gst.parse_launch(
+                f'videotestsrc num-buffers=30 ! video/x-raw,width=320,'
+                f'height=240,framerate=15/1 ! videoconvert ! {encoder} ! '
+                f'{muxer} ! filesink location={path}')
+            pipeline.set_state(Gst.State.PLAYING)
+            pipeline.get_bus().timed_pop_filtered(
+                10 * Gst.SECOND,
+                Gst.MessageType.EOS | Gst.MessageType.ERROR)
+            pipeline.set_state(Gst.State.NULL)
+            found = discover.probe(Gst.filename_to_uri(path))
+        self.assertIsNotNone(found)
+        self.assertEqual((found.width, found.height), (320, 240))
+        self.assertAlmostEqual(found.fps, 15.0)
+        self.assertFalse(found.live)
+        self.assertAlmostEqual(found.duration, 2.0, places=1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,210 @@
+import os
+import tempfile
+import unittest
+
+from mce.geometry import (
+    DEFAULT_NETWORK_SIZE,
+    align,
+    frame_transform,
+    network_size,
+    parse_dims,
+    plan_layout,
+    plan_muxer,
+    tile_area,
+    unletterbox,
+    untile,
+)
+
+# resnet10's input layer, as in the DeepStream samples
+PROTOTXT = """
+name: "ResNet-10"
+input: "input_1"
+input_shape {
+  dim: 1
+  dim: 3
+  dim: 368
+  dim: 640
+}
+"""
+
+
+class TestParseDims(unittest.TestCase):
+
+    def test_chw(self):
+        self.assertEqual(parse_dims('3;368;640'), (640, 368))
+
+    def test_with_order(self):
+        self.assertEqual(parse_dims('3;224;224;0'), (224, 224))
+
+    def test_invalid(self):
+        self.assertIsNone(parse_dims('3;368'))
+        self.assertIsNone(parse_dims('c;h;w'))
+        self.assertIsNone(parse_dims(''))
+
+
+class TestNetworkSize(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def write(self, filename: str, contents: str) -> str:
+        path = os.path.join(self.dir.name, filename)
+        with open(path, 'w') as f:
+            f.write(contents)
+        return path
+
+    def test_dims_key(self):
+        config = self.write('pie.conf', '[property]\ninfer-dims=3;544;960\n')
+        self.assertEqual(network_size(config), (960, 544))
+
+    def test_proto_file(self):
+        self.write('resnet10.prototxt', PROTOTXT)
+        config = self.write(
+            'pie.conf', '[property]\nproto-file=resnet10.prototxt\n')
+        self.assertEqual(network_size(config), (640, 368))
+
+    def test_missing_file_falls_back(self):
+        self.assertEqual(
+            network_size(os.path.join(self.dir.name, 'missing.conf')),
+            DEFAULT_NETWORK_SIZE)
+
+    def test_no_dims_falls_back(self):
+        config = self.write('pie.conf', '[property]\nbatch-size=1\n')
+        self.assertEqual(network_size(config), DEFAULT_NETWORK_SIZE)
+
+    def test_missing_proto_file_falls_back(self):
+        config = self.write(
+            'pie.conf', '[property]\nproto-file=missing.prototxt\n')
+        self.assertEqual(network_size(config), DEFAULT_NETWORK_SIZE)
+
+    def test_invalid_dims_fall_through_to_proto_file(self):
+        self.write('resnet10.prototxt', PROTOTXT)
+        config = self.write(
+            'pie.conf', '[property]\ninfer-dims=bad\n'
+                        'proto-file=resnet10.prototxt\n')
+        self.assertEqual(network_size(config), (640, 368))
+
+
+class TestAlign(unittest.TestCase):
+
+    def test_rounds_to_nearest(self):
+        self.assertEqual(align(639), 640)
+        self.assertEqual(align(641), 640)
+        self.assertEqual(align(643), 644)
+        self.assertEqual(align(1083, 16), 1088)
+
+    def test_at_least_one_alignment(self):
+        self.assertEqual(align(0), 4)
+        self.assertEqual(align(1, 8), 8)
+
+
+class TestPlanMuxer(unittest.TestCase):
+
+    def test_network_size(self):
+        self.assertEqual(plan_muxer((640, 368)), (640, 368))
+
+    def test_oversample(self):
+        self.assertEqual(plan_muxer((640, 368), oversample=2.0), (1280, 736))
+
+    def test_larger_sources_dont_matter(self):
+        self.assertEqual(
+            plan_muxer((640, 368), [(1920, 1080), (1280, 720)]), (640, 368))
+
+    def test_shrinks_to_largest_source(self):
+        # keeps the network's aspect ratio
+        self.assertEqual(plan_muxer((640, 368), [(320, 240)]), (320, 184))
+        self.assertEqual(
+            plan_muxer((640, 368), [(320, 240), (160, 120)], oversample=2.0),
+            (320, 184))
+
+    def test_alignment(self):
+        width, height = plan_muxer((300, 170), alignment=16)
+        self.assertEqual((width % 16, height % 16), (0, 0))
+
+
+class TestPlanLayout(unittest.TestCase):
+
+    def test_tile_area(self):
+        self.assertEqual(tile_area((1920, 1080), 16 / 9), 1920 * 1080)
+        # pillar boxed
+        self.assertEqual(tile_area((1000, 1000), 2.0), 1000 * 500)
+        # letter boxed
+        self.assertAlmostEqual(tile_area((1000, 1000), 0.5), 500 * 1000)
+
+    def test_no_sources(self):
+        self.assertEqual(plan_layout(0, (1920, 1080)), (1, 1))
+
+    def test_square_counts(self):
+        self.assertEqual(plan_layout(1, (1920, 1080)), (1, 1))
+        self.assertEqual(plan_layout(4, (1920, 1080)), (2, 2))
+        self.assertEqual(plan_layout(9, (1920, 1080)), (3, 3))
+
+    def test_fewer_empty_tiles(self):
+        # not 3x3 with 4 empty tiles
+        self.assertEqual(plan_layout(5, (1920, 1080)), (2, 3))
+
+    def test_source_aspect(self):
+        # portrait sources fit side by side
+        self.assertEqual(
+            plan_layout(2, (1920, 1080), [(1080, 1920)] * 2), (1, 2))
+        # very wide ones stack
+        self.assertEqual(
+            plan_layout(2, (1920, 1080), [(3840, 720)] * 2), (2, 1))
+
+
+class TestTransforms(unittest.TestCase):
+
+    def assertRectEqual(self, a, b):
+        for x, y in zip(a, b):
+            self.assertAlmostEqual(x, y)
+
+    def test_untile(self):
+        # the bottom right tile of a 2x2 grid, at half the muxer size
+        self.assertRectEqual(
+            untile((960 + 96, 540 + 54, 96, 54), 3, 2, 2, (1920, 1080),
+                   (1920, 1080)),
+            (192, 108, 192, 108))
+
+    def test_untile_first_tile(self):
+        self.assertRectEqual(
+            untile((10, 20, 30, 40), 0, 1, 1, (1280, 720), (640, 360)),
+            (5, 10, 15, 20))
+
+    def test_unletterbox(self):
+        # 1280x720 scaled by 0.5 into the top left of 640x368
+        self.assertRectEqual(
+            unletterbox((10, 20, 30, 40), (1280, 720), (640, 368)),
+            (20, 40, 60, 80))
+
+    def test_unletterbox_offset(self):
+        self.assertRectEqual(
+            unletterbox((10, 20, 30, 40), (1280, 720), (640, 368),
+                        offset=(100, 200)),
+            (120, 240, 60, 80))
+
+    def test_frame_transform_without_grid(self):
+        self.assertRectEqual(
+            frame_transform(0, (1280, 720), (640, 368), (100, 200)),
+            (100, 200, 2, 2))
+
+    def test_frame_transform_matches_untile_and_unletterbox(self):
+        grid = (2, 3, (1920, 1080))
+        muxer = (640, 368)
+        content = (1280, 720)
+        rect = (700, 600, 50, 80)
+        x_offset, y_offset, x_scale, y_scale = frame_transform(
+            4, content, muxer, (16, 8), grid)
+        expected = unletterbox(
+            untile(rect, 4, grid[0], grid[1], grid[2], muxer),
+            content, muxer, (16, 8))
+        self.assertRectEqual(
+            (rect[0] * x_scale + x_offset, rect[1] * y_scale + y_offset,
+             rect[2] * x_scale, rect[3] * y_scale),
+            expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
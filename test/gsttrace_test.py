@@ -0,0 +1,130 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from mce.gsttrace import (
+    parse_record,
+    summarize,
+    summarize_file,
+)
+
+try:
+    import gi
+    gi.require_version('Gst', '1.0')
+    from gi.repository import Gst
+    Gst.init(None)
+except (ImportError, ValueError):
+    Gst = None
+
+PREFIX = '0:00:00.{:09d} 12345 0x55d1c0 TRACE GST_TRACER :0:: '
+# as written by the latency and stats tracers, 100ms apart
+RECORDS = (
+    'new-element, thread-id=(guint64)1, ts=(guint64)1000000, ix=(uint)1, '
+    'parent-ix=(uint)0, name=(string)videotestsrc0, '
+    'type=(string)GstVideoTestSrc, is-bin=(boolean)0;',
+    'new-element, thread-id=(guint64)1, ts=(guint64)1000000, ix=(uint)2, '
+    'parent-ix=(uint)0, name=(string)fakesink0, type=(string)GstFakeSink, '
+    'is-bin=(boolean)0;',
+    'element-latency, element-id=(string)0x55d1c1, '
+    'element=(string)videoconvert0, src=(string)src, time=(guint64)2000000, '
+    'ts=(guint64)100000000;',
+    'element-latency, element-id=(string)0x55d1c1, '
+    'element=(string)videoconvert0, src=(string)src, time=(guint64)4000000, '
+    'ts=(guint64)200000000;',
+    'latency, src-element-id=(string)0x55d1c2, '
+    'src-element=(string)videotestsrc0, src=(string)src, '
+    'sink-element-id=(string)0x55d1c3, sink-element=(string)fakesink0, '
+    'sink=(string)sink, time=(guint64)6000000, ts=(guint64)300000000;',
+    'buffer, thread-id=(guint64)1, ts=(guint64)400000000, index=(uint)0, '
+    'pad-ix=(uint)3, element-ix=(uint)2, peer-pad-ix=(uint)4, '
+    'peer-element-ix=(uint)1, buffer-size=(uint)115200;',
+    'buffer, thread-id=(guint64)1, ts=(guint64)1001000000, index=(uint)1, '
+    'pad-ix=(uint)3, element-ix=(uint)2, peer-pad-ix=(uint)4, '
+    'peer-element-ix=(uint)1, buffer-size=(uint)115200;',
+)
+
+
+def log_lines():
+    lines = ['0:00:00.000000001 12345 0x55d1c0 INFO GST_INIT gst.c:1 init\n']
+    for i, record in enumerate(RECORDS):
+        lines.append(PREFIX.format(i) + record + '\n')
+    return lines
+
+
+class TestParseRecord(unittest.TestCase):
+
+    def test_not_a_record(self):
+        self.assertIsNone(parse_record(log_lines()[0]))
+        self.assertIsNone(parse_record(''))
+
+    def test_fields(self):
+        name, fields = parse_record(log_lines()[3])
+        self.assertEqual(name, 'element-latency')
+        self.assertEqual(fields['element'], 'videoconvert0')
+        self.assertEqual(fields['time'], 2000000)
+        self.assertEqual(fields['element-id'], '0x55d1c1')
+
+    def test_quoted_string(self):
+        _, fields = parse_record(
+            PREFIX.format(0) + 'new-element, ix=(uint)1, '
+            'name=(string)"a, \\"b\\"", ts=(guint64)1;')
+        self.assertEqual(fields['name'], 'a, "b"')
+        self.assertEqual(fields['ts'], 1)
+
+
+class TestSummarize(unittest.TestCase):
+
+    def check(self, summary):
+        self.assertAlmostEqual(summary['duration'], 1.0)
+        latency = summary['elements']['videoconvert0']['latency']
+        self.assertEqual(latency['count'], 2)
+        self.assertAlmostEqual(latency['mean_ms'], 3.0)
+        self.assertAlmostEqual(latency['min_ms'], 2.0)
+        self.assertAlmostEqual(latency['max_ms'], 4.0)
+        sink = summary['elements']['fakesink0']
+        self.assertEqual(sink['buffers'], 2)
+        self.assertAlmostEqual(sink['buffers_per_second'], 2.0)
+        path = summary['paths']['videotestsrc0:src->fakesink0:sink']
+        self.assertAlmostEqual(path['mean_ms'], 6.0)
+
+    def test_summarize(self):
+        self.check(summarize(log_lines()))
+
+    def test_empty(self):
+        self.assertEqual(summarize([]), {
+            'duration': 0.0, 'elements': {}, 'paths': {}})
+
+    def test_summarize_file(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            log = os.path.join(tmp, 'gst-trace-0.log')
+            with open(log, 'w') as f:
+                f.writelines(log_lines())
+            self.check(summarize_file(log))
+            with open(os.path.join(tmp, 'gst-trace-0.json')) as f:
+                self.check(json.load(f))
+
+
+@unittest.skipUnless(Gst and Gst.ElementFactory.find('videotestsrc'),
+                     'needs GStreamer and videotestsrc')
+class TestTracePipeline(unittest.TestCase):
+
+    def test_cpu_only_pipeline(self):
+        # the tracers are read by Gst.init, so trace in a new process
+        with tempfile.TemporaryDirectory() as tmp:
+            subprocess.run(
+                [sys.executable, '-m', 'mce.gsttrace', '--log-dir', tmp,
+                 '--pipeline',
+                 'videotestsrc num-buffers=100 ! fakesink name=sink sync=0'],
+                check=True, timeout=60, stdout=subprocess.DEVNULL)
+            summary, = (f for f in os.listdir(tmp) if f.endswith('.json'))
+            with open(os.path.join(tmp, summary)) as f:
+                summary = json.load(f)
+        self.assertGreaterEqual(summary['elements']['sink']['buffers'], 100)
+        self.assertTrue(summary['paths'])
+
+
+if __name__ == '__main__':
+    unittest.main()
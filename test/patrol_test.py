@@ -0,0 +1,82 @@
+import unittest
+
+from mce.patrol import (
+    ROUND_ROBIN,
+    WEIGHTED,
+    Camera,
+    Schedule,
+)
+
+
+def cameras(*revisits, weights=()):
+    weights = list(weights) + [1.0] * (len(revisits) - len(weights))
+    return [Camera(f'rtsp://camera_{i}', dwell=10.0, revisit=r, weight=w)
+            for i, (r, w) in enumerate(zip(revisits, weights))]
+
+
+class TestSchedule(unittest.TestCase):
+
+    def visit(self, schedule, index, end):
+        schedule.start(index)
+        schedule.end(index, end)
+
+    def test_unknown_policy(self):
+        with self.assertRaises(ValueError):
+            Schedule(cameras(60.0), policy='random')
+
+    def test_due_and_revisit(self):
+        schedule = Schedule(cameras(60.0))
+        self.assertTrue(schedule.due(0, 0.0))
+        self.visit(schedule, 0, 10.0)
+        self.assertFalse(schedule.due(0, 69.9))
+        self.assertTrue(schedule.due(0, 70.0))
+
+    def test_round_robin_order(self):
+        schedule = Schedule(cameras(0.0, 0.0, 0.0), ROUND_ROBIN)
+        picked = []
+        for t in range(5):
+            index = schedule.pick(float(t))
+            picked.append(index)
+            self.visit(schedule, index, t + 0.5)
+        self.assertEqual(picked, [0, 1, 2, 0, 1])
+
+    def test_round_robin_skips_cameras_not_due(self):
+        schedule = Schedule(cameras(0.0, 100.0, 0.0), ROUND_ROBIN)
+        self.visit(schedule, 1, 10.0)
+        self.visit(schedule, 0, 20.0)
+        # camera 1 is next in order, but not due until 110
+        self.assertEqual(schedule.rank(20.0), [1, 2, 0])
+        self.assertEqual(schedule.pick(20.0), 2)
+
+    def test_exclude(self):
+        schedule = Schedule(cameras(0.0, 0.0), ROUND_ROBIN)
+        self.assertEqual(schedule.pick(0.0, exclude={0}), 1)
+        self.assertEqual(schedule.rank(0.0, exclude={0, 1}), [])
+
+    def test_weighted_order(self):
+        schedule = Schedule(cameras(60.0, 60.0, 60.0, weights=(1.0, 3.0)),
+                            WEIGHTED)
+        # never visited goes first, in index order
+        self.assertEqual(schedule.pick(0.0), 0)
+        for index in range(3):
+            self.visit(schedule, index, 0.0)
+        # equally overdue, so the heaviest first
+        self.assertEqual(schedule.rank(120.0), [1, 0, 2])
+        # camera 1 waited less, but it's weight still puts it first
+        self.visit(schedule, 1, 100.0)
+        self.assertEqual(schedule.rank(200.0), [1, 0, 2])
+        self.visit(schedule, 1, 190.0)
+        # just visited, so last despite it's weight
+        self.assertEqual(schedule.rank(200.0), [0, 2, 1])
+
+    def test_pick_none_due(self):
+        schedule = Schedule(cameras(60.0, 60.0), WEIGHTED)
+        for index in range(2):
+            self.visit(schedule, index, 10.0)
+        self.assertIsNone(schedule.pick(30.0))
+        self.assertIsNotNone(schedule.pick(70.0))
+        self.assertIsNone(Schedule([]).pick(0.0))
+
+
+if __name__ == '__main__':
+    unittest.main()
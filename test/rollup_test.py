@@ -0,0 +1,110 @@
+import collections
+import unittest
+
+import numpy as np
+
+import mce.osd
+import mce.probes
+import mce.rollup
+from mce.rollup import Rollup
+
+GList = collections.namedtuple('GList', ('data', 'next'))
+FrameMeta = collections.namedtuple(
+    'FrameMeta', ('pad_index', 'frame_num', 'obj_meta_list'))
+ObjMeta = collections.namedtuple('ObjMeta', ('class_id',))
+
+
+def glist(items):
+    head = None
+    for item in reversed(items):
+        head = GList(item, head)
+    return head
+
+
+class FakePyds(object):
+    """just enough of pyds for Rollup.on_buffer"""
+
+    def __init__(self, frames):
+        self.frame_meta_list = glist(frames)
+
+    def gst_buffer_get_nvds_batch_meta(self, _):
+        return self
+
+    @staticmethod
+    def glist_get_nvds_frame_meta(data):
+        return data
+
+    @staticmethod
+    def glist_get_nvds_object_meta(data):
+        return data
+
+
+class FakeInfo(object):
+    @staticmethod
+    def get_buffer():
+        return 1
+
+
+def frame(pad_index, frame_num, *class_ids):
+    return FrameMeta(pad_index, frame_num,
+                     glist([ObjMeta(c) for c in class_ids]))
+
+
+class FakeApp(object):
+    """just the probe methods of a DeepStreamApp"""
+
+    def __init__(self):
+        self.probes = mce.probes.ProbeRegistry()
+        self.add_probe = self.probes.register
+        self.remove_probe = self.probes.unregister
+
+
+class TestRollup(unittest.TestCase):
+
+    def setUp(self):
+        self.rollup = Rollup(2, classes=2)
+        self.present = np.array([True, False])
+
+    def add(self, count, now):
+        counts = np.zeros((2, 2))
+        counts[0, 0] = count
+        self.rollup.add(counts, self.present, now=now)
+
+    def test_query(self):
+        for t, count in enumerate((0, 2, 4)):
+            self.add(count, now=float(t))
+        stats = self.rollup.query(0, 0, 60)
+        self.assertEqual(stats.frames, 3)
+        self.assertEqual((stats.min, stats.max), (0.0, 4.0))
+        self.assertAlmostEqual(stats.mean, 2.0)
+        self.assertAlmostEqual(stats.occupancy, 2 / 3)
+
+    def test_no_frames(self):
+        self.assertIsNone(self.rollup.query(1, 0, 60).mean)
+        self.assertEqual(self.rollup.summary(60), {})
+
+    def test_one_frame_per_source_per_batch(self):
+        # eg. two frames of a non-live source in one batch
+        real_pyds = mce.rollup.pyds
+        mce.rollup.pyds = mce.osd.pyds = FakePyds(
+            [frame(0, 1, 0, 0), frame(0, 2, 0, 0, 0)])
+        try:
+            self.rollup.on_buffer(None, FakeInfo(), None)
+        finally:
+            mce.rollup.pyds = mce.osd.pyds = real_pyds
+        stats = self.rollup.query(0, 0, 60)
+        self.assertEqual(stats.frames, 1)
+        self.assertEqual(stats.max, 3.0)
+
+    def test_stop_removes_probe(self):
+        app = FakeApp()
+        self.rollup.start(app)
+        self.assertIn('rollup', app.probes.stats())
+        self.rollup.stop()
+        self.assertEqual(app.probes.stats(), {})
+        # twice is harmless (DeepStreamApp.__exit__ can run twice)
+        self.rollup.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+import socket
+import unittest
+
+import gi
+gi.require_version('Gst', '1.0')
+gi.require_version('GLib', '2.0')
+from gi.repository import (
+    GLib,
+    Gst,
+)
+
+Gst.init(None)
+
+# after Gst.init (see mce.__main__.main)
+import mce.pipeline
+import mce.rtsp
+
+# seconds to wait for a client to receive video
+TIMEOUT = 10
+
+
+def have(*factories: str) -> bool:
+    return all(Gst.ElementFactory.find(f) for f in factories)
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('', 0))
+        return s.getsockname()[1]
+
+
+class TestEncoderDescription(unittest.TestCase):
+
+    def test_nvidia_encoder_is_fed_nvmm(self):
+        converter, caps, encoder, parser = \
+            mce.pipeline.make_encoder_description('enc', 'nvv4l2h264enc')
+        self.assertEqual(converter.type, 'nvvideoconvert')
+        self.assertIn('memory:NVMM', caps.properties['caps'].to_string())
+        self.assertEqual(encoder.type, 'nvv4l2h264enc')
+        self.assertEqual(encoder.properties['iframeinterval'], 30)
+        self.assertEqual(parser.type, 'h264parse')
+
+    def test_stand_in_encoder_is_fed_system_memory(self):
+        converter, caps, encoder, _ = mce.pipeline.make_encoder_description(
+            'enc', 'x264enc', bitrate=2000000, gop=10)
+        # nvdsosd's output is NVMM, so videoconvert can't be used here
+        self.assertEqual(converter.type, 'nvvideoconvert')
+        self.assertNotIn('memory:NVMM', caps.properties['caps'].to_string())
+        self.assertEqual(encoder.properties['bitrate'], 2000)
+        self.assertEqual(encoder.properties['key-int-max'], 10)
+
+
+@unittest.skipUnless(
+    have('videotestsrc', 'nvvideoconvert', 'x264enc', 'rtspsrc',
+         'rtph264depay'),
+    'needs videotestsrc, nvvideoconvert, x264enc, rtspsrc and rtph264depay')
+class TestRtspServer(unittest.TestCase):
+
+    def setUp(self):
+        self.server = mce.rtsp.RtspServer(free_port())
+        self.source = Gst.Pipeline.new('source')
+        elements = mce.pipeline.make_elements((
+            mce.pipeline.ElementDescription(
+                'videotestsrc', 'src', {'is-live': True}),
+            mce.pipeline.ElementDescription(
+                'capsfilter', 'src_caps', {
+                    'caps': Gst.Caps.from_string(
+                        'video/x-raw,width=320,height=240,framerate=30/1'),
+                }),
+            *mce.pipeline.make_encoder_description('enc', 'x264enc', gop=10),
+            mce.pipeline.ElementDescription(
+                'appsink', 'sink', {'sync': False}),
+        ))
+        mce.pipeline.add_iterable(self.source, elements)
+        self.server.connect_appsink(elements[-1], mce.rtsp.DEFAULT_MOUNT)
+        self.client = Gst.parse_launch(
+            f"rtspsrc location=rtsp://127.0.0.1:{self.server.port}"
+            f"{mce.rtsp.DEFAULT_MOUNT} latency=0 ! rtph264depay "
+            f"! fakesink name=sink signal-handoffs=true")
+        self.loop = GLib.MainLoop()
+        self.received = 0
+
+    def tearDown(self):
+        self.client.set_state(Gst.State.NULL)
+        self.source.set_state(Gst.State.NULL)
+
+    def _on_handoff(self, *_):
+        self.received += 1
+        GLib.idle_add(self.loop.quit)
+
+    def receive(self) -> int:
+        """:returns: the buffers the client got before TIMEOUT"""
+        self.received = 0
+        handler = self.client.get_by_name('sink').connect(
+            'handoff', self._on_handoff)
+        timeout = GLib.timeout_add_seconds(TIMEOUT, self.loop.quit)
+        self.loop.run()
+        GLib.source_remove(timeout)
+        self.client.get_by_name('sink').disconnect(handler)
+        return self.received
+
+    def test_client_receives_video(self):
+        self.source.set_state(Gst.State.PLAYING)
+        self.client.set_state(Gst.State.PLAYING)
+        self.assertGreater(self.receive(), 0)
+
+    def test_add_mount_again_keeps_clients(self):
+        self.source.set_state(Gst.State.PLAYING)
+        self.client.set_state(Gst.State.PLAYING)
+        self.assertGreater(self.receive(), 0)
+        self.server.add_mount(mce.rtsp.DEFAULT_MOUNT)
+        self.assertTrue(self.server._appsrcs[mce.rtsp.DEFAULT_MOUNT])
+        self.assertGreater(self.receive(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import unittest
+from unittest import mock
+
+import numpy as np
+
+import mce.probes
+from mce.tracks import (
+    APPEARED,
+    LEFT,
+    MOVED,
+    TrackEvents,
+)
+
+
+def batch(*detections):
+    """
+    :returns: process() arguments for |detections| of (object_id, (left,
+              top, width, height), confidence) on "source_0"
+    """
+    keys = [('source_0', d[0]) for d in detections]
+    boxes = np.array([d[1] for d in detections], dtype=float).reshape(-1, 4)
+    confidences = np.array([d[2] for d in detections], dtype=float)
+    class_ids = np.zeros(len(detections), dtype=int)
+    return keys, boxes, confidences, class_ids
+
+
+class TestTrackEvents(unittest.TestCase):
+
+    def setUp(self):
+        self.tracks = TrackEvents(ttl=1.0, max_tracks=2)
+
+    def process(self, *detections, now: float):
+        self.tracks.process(*batch(*detections), now=now)
+
+    def kinds(self):
+        return [(e.kind, e.object_id) for e in self.tracks.events]
+
+    def test_appeared_moved_left(self):
+        self.process((7, (0, 0, 10, 10), 0.5), now=0.0)
+        # less than it's size
+        self.process((7, (5, 0, 10, 10), 0.9), now=0.1)
+        self.process((7, (30, 0, 10, 10), 0.6), now=0.2)
+        self.process(now=5.0)
+        self.assertEqual(
+            self.kinds(), [(APPEARED, 7), (MOVED, 7), (LEFT, 7)])
+        left = self.tracks.events[-1]
+        self.assertEqual(left.frames, 3)
+        self.assertAlmostEqual(left.dwell, 0.2)
+        self.assertEqual(left.box, (5.0, 0.0, 10.0, 10.0))
+        self.assertAlmostEqual(left.confidence, 0.9)
+        self.assertEqual(self.tracks.tracks, 0)
+
+    def test_least_recently_seen_is_evicted(self):
+        self.process((1, (0, 0, 10, 10), 0.5), now=0.0)
+        self.process((2, (0, 0, 10, 10), 0.5), now=0.1)
+        self.process((3, (0, 0, 10, 10), 0.5), now=0.2)
+        self.assertEqual(self.kinds(), [
+            (APPEARED, 1), (APPEARED, 2), (LEFT, 1), (APPEARED, 3)])
+        self.assertEqual(self.tracks.stats()['evicted'], 1)
+
+    def test_new_tracks_beyond_max_tracks_are_dropped(self):
+        self.process((1, (0, 0, 10, 10), 0.5), (2, (0, 0, 10, 10), 0.5),
+                     (3, (0, 0, 10, 10), 0.5), now=0.0)
+        self.assertEqual(self.tracks.tracks, 2)
+        self.assertEqual(self.tracks.stats()['dropped'], 1)
+
+    def test_duplicate_keys_in_a_batch(self):
+        # eg. two frames of a non-live source in one batch
+        self.process((7, (0, 0, 10, 10), 0.5), (7, (2, 0, 10, 10), 0.6),
+                     now=0.0)
+        self.assertEqual(self.tracks.tracks, 1)
+        self.assertEqual(self.kinds(), [(APPEARED, 7)])
+        self.assertEqual(self.tracks.events[0].box, (2.0, 0.0, 10.0, 10.0))
+        # leaving must not fail, now or later
+        self.process(now=5.0)
+        self.process(now=10.0)
+        self.tracks.flush()
+        self.assertEqual(self.kinds(), [(APPEARED, 7), (LEFT, 7)])
+        self.assertEqual(self.tracks.tracks, 0)
+
+    def test_stop_removes_probe_and_flushes(self):
+        probes = mce.probes.ProbeRegistry()
+        app = mock.MagicMock(
+            add_probe=probes.register, remove_probe=probes.unregister)
+        self.tracks.start(app)
+        self.assertIn('track-events', probes.stats())
+        self.process((7, (0, 0, 10, 10), 0.5), now=0.0)
+        self.tracks.stop()
+        self.assertEqual(probes.stats(), {})
+        self.assertEqual(self.kinds(), [(APPEARED, 7), (LEFT, 7)])
+        # twice is harmless (DeepStreamApp.__exit__ can run twice)
+        self.tracks.stop()
+        self.assertEqual(len(self.tracks.events), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
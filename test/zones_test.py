@@ -0,0 +1,100 @@
+import unittest
+
+import numpy as np
+
+import mce.osd
+from mce.zones import (
+    ENTER,
+    EXIT,
+    IN,
+    OUT,
+    Line,
+    Zone,
+    ZoneAnalytics,
+)
+
+SQUARE = [(0, 0), (100, 0), (100, 100), (0, 100)]
+UNTRACKED = np.uint64(mce.osd.UNTRACKED_OBJECT_ID)
+
+
+def batch(*objects):
+    """
+    :returns: process() arrays for |objects| of (source index, (x, y),
+              object_id) of class 0
+    """
+    sources = np.array([o[0] for o in objects], dtype=int)
+    anchors = np.array([o[1] for o in objects], dtype=float).reshape(-1, 2)
+    class_ids = np.zeros(len(objects), dtype=int)
+    object_ids = np.array([o[2] for o in objects], dtype=np.uint64)
+    return sources, anchors, class_ids, object_ids
+
+
+class TestZoneAnalytics(unittest.TestCase):
+
+    def setUp(self):
+        self.analytics = ZoneAnalytics(
+            [Zone('door', 'source_0', SQUARE)],
+            [Line('gate', 'source_0', (200, 0), (200, 100))],
+            ttl=1.0)
+        self.present = np.ones(1, dtype=bool)
+
+    def process(self, *objects, now: float):
+        self.analytics.process(*batch(*objects), self.present, now=now)
+
+    def kinds(self):
+        return [e.kind for e in self.analytics.events]
+
+    def test_lookup(self):
+        bits = self.analytics.lookup(
+            np.zeros(3, dtype=int),
+            np.array([(50, 50), (150, 50), (-10, 50)], dtype=float))
+        self.assertEqual(bits.tolist(), [1, 0, 0])
+
+    def test_occupancy_untracked(self):
+        self.process((0, (50, 50), UNTRACKED), (0, (60, 60), UNTRACKED),
+                     (0, (150, 50), UNTRACKED), now=0.0)
+        stats = self.analytics.stats()
+        self.assertEqual(stats['zones']['door']['occupancy'], 2)
+        self.assertEqual(stats['tracks'], 0)
+
+    def test_enter_and_exit(self):
+        self.process((0, (150, 50), 7), now=0.0)
+        self.process((0, (50, 50), 7), now=0.1)
+        self.process((0, (150, 50), 7), now=0.2)
+        self.assertEqual(self.kinds(), [ENTER, EXIT])
+        door = self.analytics.stats()['zones']['door']
+        self.assertEqual((door['entries'], door['exits']), (1, 1))
+
+    def test_crossings(self):
+        # a -> b points down the screen, so it's left is x > 200, and
+        # crossing from it's right to it's left is IN
+        self.process((0, (150, 50), 7), now=0.0)
+        self.process((0, (250, 50), 7), now=0.1)
+        self.process((0, (150, 50), 7), now=0.2)
+        self.assertEqual(self.kinds(), [IN, OUT])
+
+    def test_pruned_track_leaves(self):
+        self.process((0, (50, 50), 7), now=0.0)
+        self.process(now=5.0)
+        self.assertEqual(self.kinds(), [ENTER, EXIT])
+        self.assertEqual(self.analytics.stats()['tracks'], 0)
+
+    def test_duplicate_objects_in_a_batch(self):
+        # eg. two frames of a non-live source in one batch
+        self.process((0, (40, 50), 7), (0, (50, 50), 7), now=0.0)
+        stats = self.analytics.stats()
+        self.assertEqual(stats['zones']['door']['occupancy'], 1)
+        self.assertEqual(stats['zones']['door']['entries'], 1)
+        self.assertEqual(stats['tracks'], 1)
+        # forgetting the track must not fail, now or later
+        self.process(now=5.0)
+        self.process(now=10.0)
+        self.assertEqual(self.analytics.stats()['tracks'], 0)
+        self.assertEqual(self.kinds(), [ENTER, EXIT])
+        # and the slot is reused
+        self.process((0, (50, 50), 7), now=11.0)
+        self.assertEqual(self.analytics.stats()['tracks'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()